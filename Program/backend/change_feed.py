@@ -0,0 +1,325 @@
+import os
+import time
+import errno
+import select
+import struct
+import asyncio
+import ctypes
+import ctypes.util
+import threading
+
+from size_index import normalize_path
+
+# inotify(7) event masks
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+# Marks a folder for a full rescan instead of a list of touched names
+RESCAN = None
+
+
+class _Inotify:
+    """Minimal ctypes binding; raises OSError where inotify isn't available."""
+
+    def __init__(self):
+        name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(name, use_errno=True) if name else None
+        if libc is None or not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """[(wd, mask, name), ...] for the events queued right now."""
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                name = buffer[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Subscription:
+    """One client's feed: events for ``paths`` land on ``queue`` in the client's event loop."""
+
+    def __init__(self, paths, loop, max_queued):
+        self.paths = paths
+        self.loop = loop
+        self.max_queued = max_queued
+        self.queue = asyncio.Queue()
+
+    def publish(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.queue.qsize() >= self.max_queued:
+            # The client is too slow to keep up; have it reload instead of replaying the backlog
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = {"type": "resync", "data": {"paths": self.paths}}
+        self.queue.put_nowait(event)
+
+
+class ChangeFeed:
+    """Pushes per-folder listing deltas to subscribed clients.
+
+    Only folders somebody is looking at are tracked: each gets an inotify watch
+    (or is rescanned every ``poll_interval`` seconds where inotify isn't
+    available) and a snapshot of its entries. Watch events and ``touch()`` calls
+    from the API's mutation hooks only record which names changed; every
+    ``interval`` seconds those names are re-described and compared with the
+    snapshot, and each folder's subscribers get one event with the entries
+    that were added, removed or modified since the last one.
+
+    ``describe(folder, name)`` returns the listing entry for a name, or None
+    if it no longer exists.
+    """
+
+    def __init__(self, root, describe, interval, poll_interval, max_queued=256):
+        self.root = root
+        self.describe = describe
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.max_queued = max_queued
+        self._lock = threading.Lock()
+        self._folders = {}  # path -> {"subscribers": set, "entries": {name: entry}, "wd": int or None}
+        self._watches = {}  # wd -> path
+        self._pending = {}  # path -> set of names, or RESCAN
+        self._stopped = threading.Event()
+        self._thread = None
+        try:
+            self._inotify = _Inotify()
+        except OSError:
+            self._inotify = None
+
+    @property
+    def mode(self):
+        return "inotify" if self._inotify is not None else "polling"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    # Subscriptions
+
+    def subscribe(self, paths, loop):
+        """Subscribe to folders under ``root``; raises ValueError for paths that lead outside it."""
+        paths = sorted({normalize_path(path) for path in paths})
+        root = os.path.realpath(self.root)
+        for path in paths:
+            # Symlinks too: describe() would expose whatever folder they point at
+            full_path = os.path.realpath(os.path.join(self.root, path))
+            if ".." in path.split("/") or os.path.commonpath([root, full_path]) != root:
+                raise ValueError(f"Path is outside the upload folder: {path}")
+        subscription = Subscription(paths, loop, self.max_queued)
+        for path in paths:
+            with self._lock:
+                folder = self._folders.get(path)
+                if folder is not None:
+                    folder["subscribers"].add(subscription)
+                    continue
+            # First subscriber: take the baseline snapshot outside the lock
+            folder = {"subscribers": {subscription}, "entries": self._scan(path), "wd": None}
+            if self._inotify is not None:
+                try:
+                    folder["wd"] = self._inotify.add_watch(os.path.join(self.root, path))
+                except OSError:
+                    # Not a folder, or out of watches: this folder falls back to polling
+                    pass
+            with self._lock:
+                existing = self._folders.get(path)
+                if existing is not None:
+                    existing["subscribers"].add(subscription)
+                    if folder["wd"] is not None and folder["wd"] != existing["wd"]:
+                        self._inotify.rm_watch(folder["wd"])
+                    continue
+                self._folders[path] = folder
+                if folder["wd"] is not None:
+                    self._watches[folder["wd"]] = path
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for path in subscription.paths:
+                folder = self._folders.get(path)
+                if folder is None:
+                    continue
+                folder["subscribers"].discard(subscription)
+                if not folder["subscribers"]:
+                    del self._folders[path]
+                    self._pending.pop(path, None)
+                    if folder["wd"] is not None and self._watches.pop(folder["wd"], None) is not None:
+                        if self._inotify is not None:
+                            self._inotify.rm_watch(folder["wd"])
+
+    # Change notices
+
+    def touch(self, rel_path):
+        """Record that ``rel_path`` changed. Its ancestors change too: their folder sizes move."""
+        path = normalize_path(rel_path)
+        with self._lock:
+            while path:
+                parent, _, name = path.rpartition("/")
+                if parent in self._folders:
+                    self._mark(parent, name)
+                path = parent
+
+    def _mark(self, path, name):
+        names = self._pending.get(path, set())
+        if names is RESCAN:
+            return
+        if name is RESCAN:
+            self._pending[path] = RESCAN
+        else:
+            names.add(name)
+            self._pending[path] = names
+
+    # Worker
+
+    def _run(self):
+        next_poll = time.monotonic() + self.poll_interval
+        while not self._stopped.is_set():
+            if self._inotify is not None:
+                try:
+                    select.select([self._inotify.fd], [], [], self.interval)
+                    self._read_watch_events()
+                except (OSError, ValueError):
+                    if self._stopped.is_set():
+                        return
+            else:
+                self._stopped.wait(self.interval)
+            if time.monotonic() >= next_poll:
+                next_poll = time.monotonic() + self.poll_interval
+                with self._lock:
+                    for path, folder in self._folders.items():
+                        if folder["wd"] is None:
+                            self._mark(path, RESCAN)
+            try:
+                self._flush()
+            except Exception:
+                continue
+
+    def _read_watch_events(self):
+        events = self._inotify.read()
+        if not events:
+            return
+        with self._lock:
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    # The kernel dropped events; only a full rescan is trustworthy now
+                    for path in self._folders:
+                        self._mark(path, RESCAN)
+                    continue
+                path = self._watches.get(wd)
+                if path is None or path not in self._folders:
+                    continue
+                if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    # The folder itself went away; its path is polled from now on
+                    self._watches.pop(wd, None)
+                    self._folders[path]["wd"] = None
+                    self._mark(path, RESCAN)
+                elif name:
+                    self._mark(path, name)
+
+    def _scan(self, path):
+        entries = {}
+        try:
+            names = os.listdir(os.path.join(self.root, path))
+        except OSError:
+            return entries
+        for name in names:
+            entry = self.describe(path, name)
+            if entry is not None:
+                entries[name] = entry
+        return entries
+
+    def _flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        for path, names in pending.items():
+            with self._lock:
+                folder = self._folders.get(path)
+                if folder is None:
+                    continue
+                entries = folder["entries"]
+            if names is RESCAN:
+                current = self._scan(path)
+                names = set(entries) | set(current)
+            else:
+                current = {}
+                for name in names:
+                    entry = self.describe(path, name)
+                    if entry is not None:
+                        current[name] = entry
+
+            added, removed, modified = [], [], []
+            for name in sorted(names):
+                old, new = entries.get(name), current.get(name)
+                if old is None and new is not None:
+                    added.append(new)
+                elif old is not None and new is None:
+                    removed.append(name)
+                elif old != new:
+                    modified.append(new)
+            if not (added or removed or modified):
+                continue
+
+            with self._lock:
+                folder = self._folders.get(path)
+                if folder is None:
+                    continue
+                for name in removed:
+                    folder["entries"].pop(name, None)
+                for entry in added + modified:
+                    folder["entries"][entry["name"]] = entry
+                subscribers = list(folder["subscribers"])
+            event = {"type": "change", "data": {"path": path, "added": added, "removed": removed, "modified": modified}}
+            for subscription in subscribers:
+                subscription.publish(event)
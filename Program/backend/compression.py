@@ -0,0 +1,362 @@
+import os
+import zlib
+import asyncio
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from metrics import timed
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it "br" is never negotiated
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; without it "zstd" is never negotiated
+    zstandard = None
+
+# Server preference when the client rates several codings equally
+ENCODINGS = tuple(
+    encoding for encoding, available in (("zstd", zstandard is not None), ("br", brotli is not None), ("gzip", True))
+    if available
+)
+# Levels for responses compressed on the fly, and for sidecar variants that are compressed once
+DYNAMIC_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+STATIC_LEVELS = {"zstd": 12, "br": 9, "gzip": 9}
+SUFFIXES = {"zstd": ".zst", "br": ".br", "gzip": ".gz"}
+
+# Media types worth compressing; everything else (images, video, archives, octet-stream) is
+# either already compressed or of unknown content and is sent as is
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/x-ndjson", "application/javascript", "application/xml",
+    "application/x-yaml", "application/yaml", "application/x-sh", "image/svg+xml",
+}
+# Complete bodies above this are compressed on a worker thread instead of the event loop
+OFFLOAD_BYTES = 256 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def compressible(media_type):
+    media_type = (media_type or "").split(";")[0].strip().lower()
+    if media_type == "text/event-stream":
+        return False
+    return (
+        media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith("+json") or media_type.endswith("+xml")
+    )
+
+
+def negotiate(accept_encoding, encodings=ENCODINGS):
+    """Pick the coding to use for an Accept-Encoding header, or None for identity."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def variant_etag(etag, encoding):
+    """Entity tag of the ``encoding`` variant of a representation tagged ``etag``."""
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+
+class _Compressor:
+    """Uniform streaming interface over zlib, brotli and zstandard."""
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=level)
+        elif encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    def compress(self, data):
+        if self.encoding == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def flush(self):
+        """Emit everything buffered so far, so the client can decode it now."""
+        if self.encoding == "gzip":
+            return self._obj.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return self._obj.flush()
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+def compress(data, encoding, level=None):
+    compressor = _Compressor(encoding, DYNAMIC_LEVELS[encoding] if level is None else level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def _timed_compress(data, encoding):
+    with timed("compress_response"):
+        return compress(data, encoding)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with the coding negotiated from Accept-Encoding.
+
+    Only compressible media types are touched, and complete bodies smaller than
+    ``minimum_size`` are sent as is. Responses that already have a
+    Content-Encoding, and file responses advertising byte ranges (those are
+    served from the precompressed sidecar cache instead), are left alone.
+    Streamed bodies are compressed chunk by chunk with a flush after each, so
+    rows still reach the client as they are produced.
+    """
+
+    def __init__(self, app, minimum_size=1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if (
+                    "content-encoding" in headers or "content-range" in headers
+                    or "accept-ranges" in headers or not compressible(headers.get("content-type"))
+                ):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Held back until the first body chunk shows whether to compress
+                    start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body:
+                    if len(body) < self.minimum_size:
+                        passthrough = True
+                        await send(start)
+                        await send(message)
+                        return
+                    if len(body) > OFFLOAD_BYTES:
+                        context = contextvars.copy_context()
+                        compressed = await asyncio.get_running_loop().run_in_executor(
+                            None, context.run, _timed_compress, body, encoding
+                        )
+                    else:
+                        compressed = _timed_compress(body, encoding)
+                    headers = MutableHeaders(raw=start["headers"])
+                    self._set_encoding(headers, encoding)
+                    headers["content-length"] = str(len(compressed))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                compressor = _Compressor(encoding, DYNAMIC_LEVELS[encoding])
+                headers = MutableHeaders(raw=start["headers"])
+                self._set_encoding(headers, encoding)
+                if "content-length" in headers:
+                    del headers["content-length"]
+                await send(start)
+
+            chunk = compressor.compress(body)
+            chunk += compressor.flush() if more_body else compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _set_encoding(headers, encoding):
+        headers["content-encoding"] = encoding
+        headers.add_vary_header("Accept-Encoding")
+        if "etag" in headers:
+            headers["etag"] = variant_etag(headers["etag"], encoding)
+
+
+class PrecompressedCache:
+    """On-disk cache of compressed variants of large text files, for /download.
+
+    Variants are keyed by source path, inode, size, mtime and coding, so an
+    edited file gets new entries and the stale ones age out of the
+    ``max_bytes`` LRU. A request for a variant that doesn't exist yet is served
+    uncompressed while the variant is built in the background; every later
+    request gets the stored file, so a hot log is compressed once instead of
+    once per download. Files that don't shrink by at least 10% are remembered
+    and always served as is.
+    """
+
+    def __init__(self, cache_dir, max_bytes, min_size, workers, text_extensions=()):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.min_size = min_size
+        # Text files whose type mimetypes doesn't know (.log, .conf, ...)
+        self.text_extensions = set(text_extensions)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="precompress")
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total = 0
+        self._building = set()
+        # Variant names that turned out not to be worth storing, most recent last
+        self._incompressible = OrderedDict()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Rebuild the LRU order from the cache directory, oldest access first."""
+        found = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            try:
+                stats = os.stat(path)
+            except OSError:
+                continue
+            found.append((stats.st_atime, name, stats.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+    def eligible(self, path, stats, media_type):
+        if stats.st_size < self.min_size:
+            return False
+        return compressible(media_type) or os.path.splitext(path)[1].lower() in self.text_extensions
+
+    def variant_name(self, src_path, stats, encoding):
+        key = f"{os.path.abspath(src_path)}|{stats.st_ino}|{stats.st_size}|{stats.st_mtime_ns}|{encoding}"
+        return hashlib.sha256(key.encode()).hexdigest() + SUFFIXES[encoding]
+
+    def variant(self, src_path, stats, accept_encoding):
+        """(encoding, path) of a stored variant acceptable to the client, or None.
+
+        When the negotiated variant is missing it is queued for building.
+        """
+        encoding = negotiate(accept_encoding)
+        if encoding is None:
+            return None
+        name = self.variant_name(src_path, stats, encoding)
+        path = os.path.join(self.cache_dir, name)
+        with self._lock:
+            if name in self._incompressible:
+                return None
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                if os.path.exists(path):
+                    return encoding, path
+                self._total -= self._entries.pop(name)
+            if name in self._building:
+                return None
+            self._building.add(name)
+        self._pool.submit(self._build, src_path, stats, encoding, name)
+        return None
+
+    def _build(self, src_path, stats, encoding, name):
+        dest_path = os.path.join(self.cache_dir, name)
+        tmp_path = f"{dest_path}.{threading.get_ident()}.tmp"
+        try:
+            compressor = _Compressor(encoding, STATIC_LEVELS[encoding])
+            with timed("precompress_file"), open(src_path, 'rb') as src, open(tmp_path, 'wb') as dest:
+                while True:
+                    block = src.read(READ_CHUNK_SIZE)
+                    if not block:
+                        break
+                    dest.write(compressor.compress(block))
+                dest.write(compressor.finish())
+            nbytes = os.path.getsize(tmp_path)
+            current = os.stat(src_path)
+            if (current.st_mtime_ns, current.st_size) != (stats.st_mtime_ns, stats.st_size):
+                # Changed while we read it; the next request queues the new version
+                os.remove(tmp_path)
+                return
+            if nbytes > stats.st_size * 0.9:
+                os.remove(tmp_path)
+                with self._lock:
+                    self._incompressible[name] = True
+                    while len(self._incompressible) > 10000:
+                        self._incompressible.popitem(last=False)
+                return
+            os.replace(tmp_path, dest_path)
+            self._add(name, nbytes)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        finally:
+            with self._lock:
+                self._building.discard(name)
+
+    def _add(self, name, nbytes):
+        with self._lock:
+            self._total += nbytes - self._entries.get(name, 0)
+            self._entries[name] = nbytes
+            self._entries.move_to_end(name)
+            evicted = []
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.cache_dir, old))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes,
+                "building": len(self._building), "encodings": list(ENCODINGS),
+            }
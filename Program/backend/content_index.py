@@ -0,0 +1,328 @@
+import os
+import queue
+import sqlite3
+import threading
+
+from size_index import normalize_path
+from search_index import is_hidden
+
+# Files are indexed as runs of lines so a hit maps straight back to line numbers
+CHUNK_LINES = 50
+CHUNK_MAX_BYTES = 16 * 1024
+# Candidate chunks ranked per query before grouping them by file
+MAX_RANKED_CHUNKS = 2000
+SNIPPET_MAX_CHARS = 240
+# Files with a NUL byte in their first block are treated as binary and skipped
+SNIFF_BYTES = 8192
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    scan_gen INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    start_line INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_file ON chunks (file_id);
+CREATE TABLE IF NOT EXISTS index_state (key TEXT PRIMARY KEY, value INTEGER);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    text, content='chunks', content_rowid='id', tokenize='{tokenizer}'
+);
+CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+
+def split_chunks(text):
+    """(start_line, text) runs of at most CHUNK_LINES lines / CHUNK_MAX_BYTES characters."""
+    chunks = []
+    lines = text.split("\n")
+    start = 0
+    size = 0
+    for i, line in enumerate(lines):
+        if i > start and (i - start >= CHUNK_LINES or size + len(line) > CHUNK_MAX_BYTES):
+            chunks.append((start + 1, "\n".join(lines[start:i])))
+            start = i
+            size = 0
+        size += len(line) + 1
+    if start < len(lines) and any(lines[start:]):
+        chunks.append((start + 1, "\n".join(lines[start:])))
+    return chunks
+
+
+def snippet(line, needle):
+    """Trim a long line to a window around the first match."""
+    if len(line) <= SNIPPET_MAX_CHARS:
+        return line
+    at = max(line.lower().find(needle), 0)
+    start = max(at - SNIPPET_MAX_CHARS // 3, 0)
+    return ("…" if start else "") + line[start:start + SNIPPET_MAX_CHARS] + "…"
+
+
+class ContentIndex:
+    """Full-text index over the contents of editable text files under ``root``.
+
+    Text is stored in line-numbered chunks behind an FTS5 index (trigram when
+    available, so any substring of three or more characters matches, like grep).
+    A single background thread builds the index at startup and then applies the
+    changes queued by the API mutation hooks in order, so requests never wait on it.
+    """
+
+    def __init__(self, root, db_path, extensions, max_file_bytes):
+        self.root = root
+        self.extensions = set(extensions)
+        self.max_file_bytes = max_file_bytes
+        self.ready = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        try:
+            self._conn.executescript(FTS_SCHEMA.format(tokenizer='trigram'))
+            self.substring_match = True
+        except sqlite3.OperationalError:
+            # No trigram tokenizer: fall back to word matching
+            self._conn.executescript(FTS_SCHEMA.format(tokenizer='unicode61'))
+            self.substring_match = False
+        self._conn.commit()
+        row = self._conn.execute("SELECT value FROM index_state WHERE key = 'scan_gen'").fetchone()
+        self._gen = row[0] if row else 0
+
+    def available(self):
+        if self.ready:
+            return True
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM index_state WHERE key = 'complete'").fetchone()
+        return bool(row and row[0])
+
+    def indexable(self, path):
+        return os.path.splitext(path)[1].lower() in self.extensions and not is_hidden(path)
+
+    # Background worker
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="content-index", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        try:
+            self.rebuild()
+        except Exception:
+            pass
+        while True:
+            op = self._queue.get()
+            if op is None:
+                return
+            try:
+                getattr(self, f"_apply_{op[0]}")(*op[1:])
+            except (OSError, sqlite3.Error):
+                continue
+
+    # Mutation hooks: queued, applied by the worker thread
+
+    def path_added(self, path):
+        self._queue.put(("added", normalize_path(path)))
+
+    def path_removed(self, path):
+        self._queue.put(("removed", normalize_path(path)))
+
+    def path_moved(self, src, dst):
+        self._queue.put(("moved", normalize_path(src), normalize_path(dst)))
+
+    def _apply_added(self, path):
+        abs_path = os.path.join(self.root, path)
+        if os.path.isdir(abs_path):
+            for rel_path, stats in self._walk(abs_path, path):
+                self._index_file(rel_path, stats)
+        elif self.indexable(path):
+            try:
+                self._index_file(path, os.stat(abs_path))
+            except OSError:
+                self._apply_removed(path)
+
+    def _apply_removed(self, path):
+        with self._lock, self._conn:
+            ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM files WHERE path = ? OR (path >= ? AND path < ?)",
+                (path, f"{path}/", f"{path}0"),
+            )]
+            self._delete_files(ids)
+
+    def _apply_moved(self, src, dst):
+        n = len(src)
+        with self._lock, self._conn:
+            ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM files WHERE path = ? OR (path >= ? AND path < ?)", (dst, f"{dst}/", f"{dst}0")
+            )]
+            self._delete_files(ids)
+            moved = self._conn.execute(
+                "UPDATE files SET path = ? || substr(path, ?) WHERE path = ? OR (path >= ? AND path < ?)",
+                (dst, n + 1, src, f"{src}/", f"{src}0"),
+            ).rowcount
+            if not self.indexable(dst):
+                self._conn.execute("DELETE FROM chunks WHERE file_id IN (SELECT id FROM files WHERE path = ?)", (dst,))
+                self._conn.execute("DELETE FROM files WHERE path = ?", (dst,))
+        if not moved:
+            # Renamed into an indexable name, or the source was never indexed
+            self._apply_added(dst)
+
+    def _delete_files(self, ids):
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            self._conn.execute(f"DELETE FROM chunks WHERE file_id IN ({marks})", batch)
+            self._conn.execute(f"DELETE FROM files WHERE id IN ({marks})", batch)
+
+    # Indexing
+
+    def _walk(self, abs_dir, rel_dir):
+        for dirpath, dirnames, filenames in os.walk(abs_dir):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            rel = normalize_path(os.path.join(rel_dir, os.path.relpath(dirpath, abs_dir)))
+            for name in filenames:
+                rel_path = f"{rel}/{name}" if rel else name
+                if not self.indexable(rel_path):
+                    continue
+                try:
+                    yield rel_path, os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+
+    def _read_text(self, path, stats):
+        if stats.st_size > self.max_file_bytes:
+            return None
+        with open(os.path.join(self.root, path), 'rb') as f:
+            data = f.read(self.max_file_bytes + 1)
+        if b"\0" in data[:SNIFF_BYTES]:
+            return None
+        return data.decode('utf-8', errors='replace')
+
+    def _index_file(self, path, stats, gen=None, force=False):
+        """(Re)index one file if its size or mtime changed; returns True if it was read."""
+        gen = self._gen if gen is None else gen
+        with self._lock:
+            row = self._conn.execute("SELECT id, size, mtime_ns FROM files WHERE path = ?", (path,)).fetchone()
+        if row and not force and row[1] == stats.st_size and row[2] == stats.st_mtime_ns:
+            with self._lock, self._conn:
+                self._conn.execute("UPDATE files SET scan_gen = ? WHERE id = ?", (gen, row[0]))
+            return False
+
+        text = self._read_text(path, stats)
+        with self._lock, self._conn:
+            if row:
+                self._delete_files([row[0]])
+            file_id = self._conn.execute(
+                "INSERT INTO files (path, size, mtime_ns, scan_gen) VALUES (?, ?, ?, ?)",
+                (path, stats.st_size, stats.st_mtime_ns, gen),
+            ).lastrowid
+            if text:
+                self._conn.executemany(
+                    "INSERT INTO chunks (file_id, start_line, text) VALUES (?, ?, ?)",
+                    [(file_id, start, chunk) for start, chunk in split_chunks(text)],
+                )
+        return True
+
+    def rebuild(self):
+        """Index new and changed files, then drop files that no longer exist."""
+        with self._lock, self._conn:
+            self._gen += 1
+            gen = self._gen
+            self._conn.execute("INSERT OR REPLACE INTO index_state VALUES ('scan_gen', ?)", (gen,))
+
+        indexed = 0
+        for rel_path, stats in self._walk(self.root, ""):
+            if self._index_file(rel_path, stats, gen):
+                indexed += 1
+
+        with self._lock, self._conn:
+            stale = [row[0] for row in self._conn.execute("SELECT id FROM files WHERE scan_gen < ?", (gen,))]
+            self._delete_files(stale)
+            self._conn.execute("INSERT OR REPLACE INTO index_state VALUES ('complete', 1)")
+        self.ready = True
+        return indexed
+
+    # Queries
+
+    def query(self, text, path="", limit=20, offset=0, max_lines=5):
+        """Files whose contents match ``text``, best first, with matching lines.
+
+        Returns (results, total); total counts files among the best MAX_RANKED_CHUNKS chunks.
+        """
+        needle = text.lower()
+        path = normalize_path(path)
+        where = []
+        params = []
+        if self.substring_match and len(text) < 3:
+            # Trigrams need three characters; short needles scan the chunk text instead
+            sql = "SELECT c.file_id, f.path, c.start_line, c.text, 0 FROM chunks c JOIN files f ON f.id = c.file_id"
+            where.append("instr(lower(c.text), ?) > 0")
+            params.append(needle)
+        else:
+            sql = (
+                "SELECT c.file_id, f.path, c.start_line, c.text, bm25(chunks_fts) AS score "
+                "FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid JOIN files f ON f.id = c.file_id"
+            )
+            where.append("chunks_fts MATCH ?")
+            params.append('"' + text.replace('"', '""') + '"')
+        if path:
+            where.append("(f.path >= ? AND f.path < ?)")
+            params += [f"{path}/", f"{path}0"]
+        sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY 5, f.path, c.start_line LIMIT ?"
+        params.append(MAX_RANKED_CHUNKS)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        # Group chunks by file, keeping the rank of each file's best chunk
+        files = {}
+        for file_id, file_path, start_line, chunk, score in rows:
+            entry = files.setdefault(file_id, {"path": file_path, "score": score, "chunks": []})
+            entry["chunks"].append((start_line, chunk))
+        ranked = list(files.values())
+        total = len(ranked)
+        page = ranked[offset:offset + limit] if limit > 0 else ranked[offset:]
+
+        results = []
+        for entry in page:
+            matches = []
+            match_count = 0
+            for start_line, chunk in sorted(entry["chunks"]):
+                for i, line in enumerate(chunk.split("\n")):
+                    if needle in line.lower():
+                        match_count += 1
+                        if len(matches) < max_lines:
+                            matches.append({"line": start_line + i, "text": snippet(line, needle)})
+            if not match_count:
+                # Word-level FTS hit without a literal substring match
+                continue
+            results.append({
+                "path": entry["path"],
+                "name": entry["path"].rsplit("/", 1)[-1],
+                "score": round(-entry["score"], 4),
+                "matches": matches,
+                "match_count": match_count
+            })
+        return results, total
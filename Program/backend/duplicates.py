@@ -0,0 +1,279 @@
+import os
+import errno
+import fcntl
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from search_index import is_hidden
+from temp_files import temp_path
+
+# Bytes read from each end of a file for the cheap first-pass hash
+EDGE_BYTES = 4096
+HASH_BLOCK_SIZE = 1024 * 1024
+# Files hashed together before their groups are reported
+BATCH_FILES = 256
+# ioctl(dest_fd, FICLONE, src_fd) shares extents on btrfs, XFS and friends
+FICLONE = 0x40049409
+
+
+def edge_hash(path, size):
+    """SHA-256 of the first and last EDGE_BYTES; covers the whole file when it is small."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        hasher.update(f.read(EDGE_BYTES))
+        if size > 2 * EDGE_BYTES:
+            f.seek(size - EDGE_BYTES)
+            hasher.update(f.read(EDGE_BYTES))
+        elif size > EDGE_BYTES:
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+def full_hash(path):
+    """SHA-256 of the whole file. Runs inside a pool worker process."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class HashCache:
+    """Edge and full hashes keyed by (device, inode), valid while size and mtime match."""
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                dev INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                edge TEXT,
+                full TEXT,
+                PRIMARY KEY (dev, inode)
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key, size, mtime_ns):
+        """(edge, full) for an unchanged file, (None, None) otherwise."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, edge, full FROM hashes WHERE dev = ? AND inode = ?", key
+            ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None, None
+        return row[2], row[3]
+
+    def put_many(self, rows):
+        """Store (dev, inode, size, mtime_ns, edge, full) rows; a None full keeps a cached one."""
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT INTO hashes (dev, inode, size, mtime_ns, edge, full) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (dev, inode) DO UPDATE SET
+                    full = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns
+                                THEN coalesce(excluded.full, full) ELSE excluded.full END,
+                    size = excluded.size, mtime_ns = excluded.mtime_ns, edge = excluded.edge
+            """, rows)
+
+
+class DuplicateFinder:
+    """Finds files with identical content under a root, narrowing candidates in stages.
+
+    Files are grouped by size from a single directory walk, then by a hash of their
+    first and last few KB (thread pool), and only the survivors get a full-content
+    hash in a process pool. Both hashes are cached by inode, size and mtime so a
+    re-run only reads files that changed.
+    """
+
+    def __init__(self, root, db_path, workers):
+        self.root = root
+        self.workers = workers
+        self.cache = HashCache(db_path)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dup-edge")
+
+    def _pool_executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _scan(self, base, rel_base, min_size):
+        """{size: [(dev, inode, rel_path, mtime_ns), ...]} for every regular, non-hidden file.
+
+        Plain tuples keep memory per file small; most sizes are unique and get dropped.
+        """
+        by_size = {}
+        stack = [(base, rel_base)]
+        scanned = 0
+        while stack:
+            dir_path, rel_dir = stack.pop()
+            try:
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        if is_hidden(entry.name):
+                            continue
+                        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append((entry.path, rel_path))
+                                continue
+                            if not entry.is_file(follow_symlinks=False):
+                                continue
+                            stats = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        scanned += 1
+                        if stats.st_size < min_size:
+                            continue
+                        by_size.setdefault(stats.st_size, []).append(
+                            (stats.st_dev, stats.st_ino, rel_path, stats.st_mtime_ns)
+                        )
+            except OSError:
+                continue
+        return by_size, scanned
+
+    def _edge_hashes(self, size, files):
+        """Fill in the edge hash of each candidate, reading only files the cache can't answer."""
+        def one(item):
+            key, info = item
+            edge, full = self.cache.get(key, size, info["mtime_ns"])
+            if edge is None:
+                try:
+                    edge = edge_hash(os.path.join(self.root, info["paths"][0]), size)
+                except OSError:
+                    return None
+                info["dirty"] = True
+            info["edge"], info["full"] = edge, full
+            return item
+        return [item for item in self._threads.map(one, files) if item is not None]
+
+    def find(self, path="", min_size=1):
+        """Yield {"size", "hash", "files", "reclaimable"} for each duplicate group as it is confirmed,
+        then a final {"summary": ...}."""
+        rel_base = path.strip("/")
+        by_size, scanned = self._scan(os.path.join(self.root, rel_base), rel_base, max(min_size, 1))
+
+        # Only sizes shared by two or more distinct inodes can hold duplicates; biggest first
+        candidates = []
+        for size, entries in by_size.items():
+            if len(entries) < 2:
+                continue
+            inodes = {}
+            for dev, inode, rel_path, mtime_ns in entries:
+                if (dev, inode) in inodes:
+                    # Already hard-linked together: same file, nothing to reclaim
+                    inodes[(dev, inode)]["paths"].append(rel_path)
+                else:
+                    inodes[(dev, inode)] = {"paths": [rel_path], "mtime_ns": mtime_ns}
+            if len(inodes) > 1:
+                candidates.append((size, inodes))
+        del by_size
+        candidates.sort(key=lambda pair: pair[0], reverse=True)
+
+        groups = 0
+        reclaimable = 0
+        batch = []
+        batch_files = 0
+        for index, (size, inodes) in enumerate(candidates):
+            batch.append((size, inodes))
+            batch_files += len(inodes)
+            if batch_files < BATCH_FILES and index < len(candidates) - 1:
+                continue
+            for group in self._confirm(batch):
+                groups += 1
+                reclaimable += group["reclaimable"]
+                yield group
+            batch = []
+            batch_files = 0
+
+        yield {"summary": {"files_scanned": scanned, "groups": groups, "reclaimable": reclaimable}}
+
+    def _confirm(self, batch):
+        # Stage 2: edge hashes, in threads
+        edge_groups = []
+        for size, inodes in batch:
+            by_edge = {}
+            for key, info in self._edge_hashes(size, list(inodes.items())):
+                by_edge.setdefault(info["edge"], []).append((key, info))
+            edge_groups.extend((size, members) for members in by_edge.values() if len(members) > 1)
+
+        # Stage 3: full hashes in the process pool; small files were read completely already
+        pending = []
+        for size, members in edge_groups:
+            for key, info in members:
+                if size <= 2 * EDGE_BYTES:
+                    info["full"] = info["edge"]
+                elif info["full"] is None:
+                    path = os.path.join(self.root, info["paths"][0])
+                    pending.append((info, self._pool_executor().submit(full_hash, path)))
+        for info, future in pending:
+            try:
+                info["full"] = future.result()
+                info["dirty"] = True
+            except OSError:
+                info["full"] = None
+
+        # Everything read in this batch goes to the cache, including files ruled out by stage 2
+        self.cache.put_many([
+            (key[0], key[1], size, info["mtime_ns"], info["edge"], info["full"])
+            for size, inodes in batch for key, info in inodes.items() if info.get("dirty")
+        ])
+
+        for size, members in edge_groups:
+            by_full = {}
+            for key, info in members:
+                if info["full"] is not None:
+                    by_full.setdefault(info["full"], []).append(info["paths"])
+            for digest, copies in by_full.items():
+                if len(copies) > 1:
+                    yield {
+                        "size": size,
+                        "hash": digest,
+                        "files": sorted(path for paths in copies for path in paths),
+                        "reclaimable": size * (len(copies) - 1)
+                    }
+
+
+def link_file(src_path, dst_path, mode):
+    """Replace ``dst_path`` with a hardlink or reflink of ``src_path``, atomically."""
+    tmp_path = temp_path(dst_path, "link")
+    try:
+        if mode == "hardlink":
+            os.link(src_path, tmp_path)
+        else:
+            with open(src_path, 'rb') as src, open(tmp_path, 'xb') as dst:
+                try:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                except OSError as e:
+                    if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV):
+                        raise OSError(e.errno, "Filesystem does not support reflinks") from e
+                    raise
+            stats = os.stat(dst_path)
+            os.chmod(tmp_path, stats.st_mode & 0o7777)
+            os.utime(tmp_path, ns=(stats.st_atime_ns, stats.st_mtime_ns))
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
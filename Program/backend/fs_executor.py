@@ -0,0 +1,87 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import current_phases
+
+_DONE = object()
+
+
+class FsExecutor(ThreadPoolExecutor):
+    """Sized thread pool for blocking filesystem calls, with queue-depth counters.
+
+    Handlers ``await pool.run(fn, ...)`` instead of calling os/shutil directly so
+    a slow disk or network mount only ties up this pool, never the event loop.
+    """
+
+    def __init__(self, name, workers):
+        super().__init__(max_workers=workers, thread_name_prefix=name)
+        self.name = name
+        self.workers = workers
+        self._counts_lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._max_queued = 0
+        self._wait_total = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        queued_at = time.monotonic()
+        # Waits and run times show up in the slow-request log of the request that queued them
+        phases = current_phases()
+        with self._counts_lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+        def call():
+            started = time.monotonic()
+            with self._counts_lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_total += started - queued_at
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counts_lock:
+                    self._running -= 1
+                    self._completed += 1
+                if phases is not None:
+                    phases.add(f"{self.name}.wait", started - queued_at)
+                    phases.add(f"{self.name}.run", time.monotonic() - started)
+
+        return super().submit(call)
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Carry the request's context into the worker so timers there can find it
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self, context.run, functools.partial(fn, *args, **kwargs))
+
+    async def iterate(self, iterator):
+        """Drive a blocking iterator (e.g. a streaming response body) on this pool."""
+        iterator = iter(iterator)
+        try:
+            while True:
+                item = await self.run(next, iterator, _DONE)
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                await self.run(close)
+
+    def stats(self):
+        with self._counts_lock:
+            started = self._completed + self._running
+            return {
+                "workers": self.workers,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "max_queued": self._max_queued,
+                "avg_wait_ms": round(self._wait_total / started * 1000, 3) if started else 0.0
+            }
@@ -0,0 +1,268 @@
+import os
+import uuid
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from compression import variant_etag
+
+# Requests asking for more ranges than this get the whole file instead
+MAX_RANGES = 16
+READ_CHUNK_SIZE = 64 * 1024
+# Whole-file bodies are read in bigger chunks: each one is a thread hop and an ASGI message
+SEND_CHUNK_SIZE = 256 * 1024
+# Values of DOWNLOAD_OFFLOAD: nginx's X-Accel-Redirect (a URI) or X-Sendfile (Apache, lighttpd; a path)
+OFFLOAD_MODES = ("x-accel-redirect", "x-sendfile")
+
+
+def file_etag(stats):
+    """Strong validator: changes whenever the inode, size or mtime of the file changes."""
+    return f'"{stats.st_ino:x}-{stats.st_size:x}-{stats.st_mtime_ns:x}"'
+
+
+def content_disposition(filename):
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _etag_matches(header, etag, weak):
+    """RFC 9110 entity-tag list comparison; ``weak`` allows W/ tags to match."""
+    if header.strip() == "*":
+        return True
+    for tag in header.split(","):
+        tag = tag.strip()
+        if weak and tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag, weak=True)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError):
+            return False
+    return False
+
+
+def _if_range_allows(request, etag, mtime):
+    """A Range is only honoured when If-Range (if sent) still matches the current file."""
+    if_range = request.headers.get("if-range")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return _etag_matches(if_range, etag, weak=False)
+    try:
+        return int(mtime) == int(parsedate_to_datetime(if_range).timestamp())
+    except (TypeError, ValueError, IndexError):
+        return False
+
+
+def parse_range(header, size):
+    """Parse a ``bytes=`` Range header into inclusive (start, end) pairs.
+
+    Returns None when the header should be ignored (malformed, other units or too
+    many ranges) and [] when it is well-formed but nothing is satisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    ranges = []
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+    for part in parts:
+        start, sep, end = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if start == "":
+                # Suffix range: the last N bytes
+                length = int(end)
+                # Nothing is satisfiable in an empty file, not even a suffix
+                if length <= 0 or size == 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            first = int(start)
+            last = int(end) if end else None
+        except ValueError:
+            return None
+        if last is not None and first > last:
+            return None
+        if first >= size:
+            continue
+        ranges.append((first, size - 1 if last is None else min(last, size - 1)))
+    return ranges
+
+
+def _read_range(path, start, end, chunk_size=READ_CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = f.read(min(chunk_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def _multipart(path, ranges, size, media_type, boundary):
+    for start, end in ranges:
+        yield (
+            f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        yield from _read_range(path, start, end)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+class Offload:
+    """Leaves sending file bodies to the reverse proxy in front of the app.
+
+    The app still resolves and checks the file, then answers with an empty
+    response carrying the proxy's internal-redirect header; the proxy sends the
+    bytes itself (with sendfile, ranges and validators of its own). Only files
+    under ``root`` are offloaded: with x-accel-redirect, ``prefix`` is the
+    internal location the proxy maps to ``root``.
+    """
+
+    def __init__(self, mode, root, prefix):
+        if mode not in OFFLOAD_MODES:
+            raise ValueError(f"Unknown offload mode: {mode}")
+        self.mode = mode
+        self.root = os.path.abspath(root)
+        self.prefix = "/" + prefix.strip("/") + "/"
+
+    def header(self, path):
+        """(name, value) of the redirect header for ``path``, or None to serve it in-process."""
+        path = os.path.abspath(path)
+        if os.path.commonpath([path, self.root]) != self.root or path == self.root:
+            return None
+        if self.mode == "x-sendfile":
+            # The path goes into the header as is, which only works for ASCII names
+            return ("x-sendfile", path) if path.isascii() else None
+        return "x-accel-redirect", self.prefix + quote(os.path.relpath(path, self.root).replace(os.sep, "/"))
+
+
+class SendfileResponse(FileResponse):
+    """FileResponse for whole files that avoids copying the body through Python where it can.
+
+    Servers implementing the ASGI zero-copy extension are handed the open file
+    and send it with sendfile(2). Elsewhere the body is read on ``pool`` in
+    SEND_CHUNK_SIZE chunks, a quarter of the thread hops FileResponse takes.
+    """
+
+    chunk_size = SEND_CHUNK_SIZE
+
+    def __init__(self, path, pool=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self.pool = pool
+
+    async def __call__(self, scope, receive, send):
+        zerocopy = "http.response.zerocopy" in (scope.get("extensions") or {})
+        if self.send_header_only or self.stat_result is None or not (zerocopy or self.pool):
+            await super().__call__(scope, receive, send)
+            return
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        size = self.stat_result.st_size
+        if zerocopy:
+            with open(self.path, 'rb') as f:
+                await send({"type": "http.response.zerocopy", "file": f, "count": size, "more_body": False})
+        else:
+            if size:
+                async for block in self.pool.iterate(_read_range(self.path, 0, size - 1, self.chunk_size)):
+                    await send({"type": "http.response.body", "body": block, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+
+def file_response(request, path, filename=None, media_type=None, pool=None, precompressed=None, offload=None):
+    """Serve a file with ETag/Last-Modified validators, 304s and byte ranges (206/416).
+
+    ``filename`` adds an attachment Content-Disposition, as FileResponse does.
+    Range bodies are read on ``pool`` (an FsExecutor) when one is given. With a
+    ``precompressed`` cache, whole-file requests for large text files are served
+    from a stored variant in the coding the client accepts, once one exists.
+    With an ``offload`` (an Offload), all other bodies are left to the proxy.
+    """
+    try:
+        stats = os.stat(path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="File not found")
+    size = stats.st_size
+    media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    etag = file_etag(stats)
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stats.st_mtime, usegmt=True),
+        "accept-ranges": "bytes",
+    }
+    if filename:
+        headers["content-disposition"] = content_disposition(filename)
+
+    variant = None
+    if precompressed is not None and precompressed.eligible(path, stats, media_type):
+        headers["vary"] = "Accept-Encoding"
+        # Ranges always address the identity bytes, so they never get a variant
+        if "range" not in request.headers:
+            variant = precompressed.variant(path, stats, request.headers.get("accept-encoding"))
+    if variant is not None:
+        encoding, variant_path = variant
+        etag = headers["etag"] = variant_etag(etag, encoding)
+    elif offload is not None:
+        redirect = offload.header(path)
+        if redirect is not None:
+            # Validators, 304s and ranges are the proxy's job for the file it serves
+            offload_headers = {name: headers[name] for name in ("content-disposition", "vary") if name in headers}
+            offload_headers[redirect[0]] = redirect[1]
+            return Response(media_type=media_type, headers=offload_headers)
+
+    if _not_modified(request, etag, stats.st_mtime):
+        headers.pop("content-disposition", None)
+        return Response(status_code=304, headers=headers)
+
+    if variant is not None:
+        headers["content-encoding"] = encoding
+        return FileResponse(variant_path, media_type=media_type, headers=headers)
+
+    range_header = request.headers.get("range")
+    if range_header and _if_range_allows(request, etag, stats.st_mtime):
+        ranges = parse_range(range_header, size)
+        if ranges == []:
+            headers["content-range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if len(ranges or []) == 1:
+            start, end = ranges[0]
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            headers["content-length"] = str(end - start + 1)
+            body = _read_range(path, start, end)
+            return StreamingResponse(pool.iterate(body) if pool else body, status_code=206,
+                                     media_type=media_type, headers=headers)
+        if ranges:
+            boundary = uuid.uuid4().hex
+            length = sum(
+                len(f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n") + (end - start + 1) + 2
+                for start, end in ranges
+            ) + len(f"--{boundary}--\r\n")
+            headers["content-length"] = str(length)
+            body = _multipart(path, ranges, size, media_type, boundary)
+            return StreamingResponse(pool.iterate(body) if pool else body, status_code=206,
+                                     media_type=f"multipart/byteranges; boundary={boundary}", headers=headers)
+
+    return SendfileResponse(path, pool=pool, media_type=media_type, headers=headers, stat_result=stats)
@@ -0,0 +1,308 @@
+import os
+import time
+import uuid
+import shutil
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from temp_files import temp_path
+
+COPY_BLOCK_SIZE = 1024 * 1024
+FINISHED_STATES = ("completed", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised from inside a job's work once it has been cancelled."""
+
+
+def measure_tree(path):
+    """(bytes, files) that copying ``path`` will process."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path), 1
+    total = files = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            files += 1
+    return total, files
+
+
+def copy_file(progress, src, dst):
+    """``copy_function`` for shutil.copytree/move that reports progress and can be cancelled.
+
+    Data goes to a hidden temp file next to ``dst`` first, so a cancelled copy never
+    leaves a truncated file behind or clobbers the one it was replacing.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    tmp_path = temp_path(dst, "copy")
+    try:
+        with open(src, 'rb') as fsrc, open(tmp_path, 'xb') as fdst:
+            while True:
+                progress.check()
+                block = fsrc.read(COPY_BLOCK_SIZE)
+                if not block:
+                    break
+                fdst.write(block)
+                progress.advance(len(block))
+        shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    progress.advance(files=1)
+    return dst
+
+
+class ItemProgress:
+    """Progress of one source within a job, so it can be settled when the item ends."""
+
+    def __init__(self, job):
+        self.job = job
+        self.bytes = 0
+        self.files = 0
+
+    def check(self):
+        self.job.check()
+
+    def advance(self, nbytes=0, files=0):
+        self.bytes += nbytes
+        self.files += files
+        self.job.advance(nbytes, files)
+
+
+class Job:
+    def __init__(self, operation, items, destination, run_item, measure, finish):
+        self.id = uuid.uuid4().hex
+        self.operation = operation
+        self.items = list(items)
+        self.destination = destination
+        self.run_item = run_item
+        self.measure = measure
+        self.finish = finish
+        self.state = "queued"
+        self.processed = []
+        self.results = []
+        self.errors = []
+        self.bytes_total = self.bytes_done = 0
+        self.files_total = self.files_done = 0
+        self.created_at = time.time()
+        self.started_at = self.finished_at = None
+        # Resolves with the final snapshot; endpoints that answer synchronously await it
+        self.future = Future()
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def advance(self, nbytes=0, files=0):
+        with self._lock:
+            self.bytes_done += nbytes
+            self.files_done += files
+
+    def add_total(self, nbytes=0, files=0):
+        with self._lock:
+            self.bytes_total += nbytes
+            self.files_total += files
+
+    def snapshot(self):
+        with self._lock:
+            now = self.finished_at or time.time()
+            elapsed = now - self.started_at if self.started_at else 0
+            rate = self.bytes_done / elapsed if elapsed > 0 else 0
+            eta = None
+            if self.state == "running" and elapsed > 0:
+                # Bytes are the better predictor; renames and deletes only move file counts
+                if self.bytes_total and self.bytes_done:
+                    eta = (self.bytes_total - self.bytes_done) / rate
+                elif self.files_total and self.files_done:
+                    eta = elapsed * (self.files_total - self.files_done) / self.files_done
+            return {
+                "id": self.id,
+                "operation": self.operation,
+                "state": self.state,
+                "destination": self.destination,
+                "items": len(self.items),
+                "bytes_done": self.bytes_done,
+                "bytes_total": self.bytes_total,
+                "files_done": self.files_done,
+                "files_total": self.files_total,
+                "processed": list(self.processed),
+                "errors": list(self.errors),
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "elapsed": round(elapsed, 3),
+                "bytes_per_second": round(rate),
+                "eta_seconds": round(max(eta, 0), 1) if eta is not None else None
+            }
+
+
+class JobManager:
+    """Runs copy/move/delete jobs off the request path.
+
+    ``limits`` caps how many jobs of each operation run at once; extra jobs wait
+    in a per-operation queue. The sources of a running job are processed in
+    parallel on a shared worker pool, at most ``item_parallelism`` per job so one
+    large job can't starve the others.
+    """
+
+    def __init__(self, workers, limits, item_parallelism, keep_finished=200):
+        self.limits = dict(limits)
+        self.item_parallelism = item_parallelism
+        self.keep_finished = keep_finished
+        self._workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+        self._runners = ThreadPoolExecutor(max_workers=sum(self.limits.values()), thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._running = {operation: 0 for operation in self.limits}
+        self._pending = {operation: deque() for operation in self.limits}
+        self._lock = threading.Lock()
+
+    def submit(self, operation, items, run_item, destination=None, measure=measure_tree, finish=None):
+        """Queue a job calling ``run_item(progress, item)`` for every item.
+
+        ``measure(item)`` returns the (bytes, files) used for progress totals.
+        ``finish(job)`` runs once all items are done, before the job resolves.
+        """
+        job = Job(operation, items, destination, run_item, measure, finish)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+            if self._running[operation] < self.limits[operation]:
+                self._start(job)
+            else:
+                self._pending[operation].append(job)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        return [job.snapshot() for job in reversed(list(self._jobs.values()))]
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job.cancel()
+        with self._lock:
+            pending = self._pending[job.operation]
+            if job in pending:
+                # Never started, so there is nothing to wait for
+                pending.remove(job)
+                with job._lock:
+                    job.state = "cancelled"
+                    job.finished_at = time.time()
+                job.future.set_result(job.snapshot())
+        return job
+
+    def shutdown(self):
+        for job in list(self._jobs.values()):
+            job.cancel()
+        self._runners.shutdown(wait=False)
+        self._workers.shutdown(wait=False)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self._jobs[job_id]
+
+    def _start(self, job):
+        self._running[job.operation] += 1
+        self._runners.submit(self._run, job)
+
+    def _map(self, job, fn, items):
+        """Run ``fn`` over ``items`` on the worker pool, bounded per job; returns futures in order."""
+        slots = threading.BoundedSemaphore(self.item_parallelism)
+        futures = []
+        for item in items:
+            slots.acquire()
+            future = self._workers.submit(fn, item)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+        wait(futures)
+        return futures
+
+    def _measure(self, job, item):
+        if job.cancelled:
+            return 0, 0
+        try:
+            size = job.measure(item)
+        except Exception:
+            # Unreadable sources fail properly when their item runs
+            size = (0, 0)
+        job.add_total(*size)
+        return size
+
+    def _run_item(self, job, item, size):
+        progress = ItemProgress(job)
+        try:
+            job.check()
+            result = job.run_item(progress, item)
+        except JobCancelled:
+            job.add_total(progress.bytes - size[0], progress.files - size[1])
+            with job._lock:
+                job.errors.append({"file": item, "error": "Cancelled"})
+            return
+        except Exception as e:
+            job.add_total(progress.bytes - size[0], progress.files - size[1])
+            with job._lock:
+                job.errors.append({"file": item, "error": str(e)})
+            return
+        # Renames report nothing while running; count the item as fully done
+        job.advance(max(size[0] - progress.bytes, 0), max(size[1] - progress.files, 0))
+        if result is not None:
+            with job._lock:
+                job.processed.append(item)
+                job.results.append(result)
+
+    def _run(self, job):
+        try:
+            if not job.cancelled:
+                with job._lock:
+                    job.state = "running"
+                    job.started_at = time.time()
+                sizes = [f.result() for f in self._map(job, lambda item: self._measure(job, item), job.items)]
+                self._map(job, lambda pair: self._run_item(job, *pair), list(zip(job.items, sizes)))
+                # Items finish in any order; report them in the order they were given
+                with job._lock:
+                    position = {item: i for i, item in reversed(list(enumerate(job.items)))}
+                    done = sorted(zip(job.processed, job.results), key=lambda pair: position[pair[0]])
+                    job.processed = [item for item, _ in done]
+                    job.results = [result for _, result in done]
+                if job.finish is not None:
+                    job.finish(job)
+        except Exception as e:
+            with job._lock:
+                job.errors.append({"file": None, "error": str(e)})
+        finally:
+            with job._lock:
+                if job.cancelled:
+                    job.state = "cancelled"
+                elif job.errors and not job.processed:
+                    job.state = "failed"
+                else:
+                    job.state = "completed"
+                job.finished_at = time.time()
+            job.future.set_result(job.snapshot())
+            with self._lock:
+                self._running[job.operation] -= 1
+                pending = self._pending[job.operation]
+                if pending:
+                    self._start(pending.popleft())
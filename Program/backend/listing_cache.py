@@ -0,0 +1,136 @@
+import os
+import stat
+import time
+import mimetypes
+import threading
+from collections import OrderedDict, namedtuple
+
+from size_index import normalize_path, parent_of
+from temp_files import is_temp_name
+
+# A directory modified this recently may change again within the same mtime tick,
+# which a cached listing couldn't notice; such listings are not cached yet
+RACY_SECONDS = 2
+
+CachedEntry = namedtuple(
+    "CachedEntry", "name is_dir size mtime mtime_ns mime_type is_image is_editable"
+)
+
+
+class ListingCache:
+    """Directory listings with per-entry metadata, shared by every request.
+
+    A cached listing holds each entry's stat fields plus the mime type and
+    image/editable flags derived from its name, and is served again for as long
+    as its directory's mtime is unchanged: browsing a hot folder costs one stat
+    of the folder instead of one per entry. Entry-level changes that leave the
+    directory mtime alone (a file rewritten in place) are covered by the API's
+    mutation hooks calling ``invalidate()``, and for changes made outside the API
+    by ``max_age``, after which a listing is rescanned regardless.
+
+    Listings are evicted least recently used first once they hold more than
+    ``max_entries`` entries in total.
+    """
+
+    def __init__(self, root, max_entries, max_age, image_extensions, editable_extensions):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.image_extensions = image_extensions
+        self.editable_extensions = editable_extensions
+        self._lock = threading.Lock()
+        self._listings = OrderedDict()  # path -> (mtime_ns, scanned_at, entries)
+        self._total = 0
+        # Bumped by every invalidation, so a scan that raced one is not cached
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def entry_from_stat(self, name, stats):
+        is_dir = stat.S_ISDIR(stats.st_mode)
+        if is_dir:
+            return CachedEntry(name, True, stats.st_size, stats.st_mtime, stats.st_mtime_ns, None, False, False)
+        mime_type, _ = mimetypes.guess_type(name)
+        ext = os.path.splitext(name)[1].lower()
+        return CachedEntry(
+            name, False, stats.st_size, stats.st_mtime, stats.st_mtime_ns, mime_type,
+            ext in self.image_extensions, ext in self.editable_extensions
+        )
+
+    def listing(self, path):
+        """Tuple of CachedEntry for the folder ``path``; raises OSError if it can't be listed."""
+        path = normalize_path(path)
+        full_path = os.path.join(self.root, path)
+        dir_stats = os.stat(full_path)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._listings.get(path)
+            if cached is not None and cached[0] == dir_stats.st_mtime_ns and (
+                not self.max_age or now - cached[1] < self.max_age
+            ):
+                self._listings.move_to_end(path)
+                self._hits += 1
+                return cached[2]
+            self._misses += 1
+            generation = self._generation
+
+        entries = []
+        with os.scandir(full_path) as it:
+            for dir_entry in it:
+                if is_temp_name(dir_entry.name):
+                    continue
+                try:
+                    # Follows symlinks like the listing always has; broken links are left out
+                    entries.append(self.entry_from_stat(dir_entry.name, dir_entry.stat()))
+                except OSError:
+                    continue
+        entries = tuple(entries)
+
+        if time.time() - dir_stats.st_mtime < RACY_SECONDS:
+            return entries
+        with self._lock:
+            if generation != self._generation:
+                return entries
+            old = self._listings.pop(path, None)
+            if old is not None:
+                self._total -= len(old[2])
+            self._listings[path] = (dir_stats.st_mtime_ns, now, entries)
+            self._total += len(entries)
+            while self._total > self.max_entries and self._listings:
+                _, (_, _, evicted) = self._listings.popitem(last=False)
+                self._total -= len(evicted)
+                self._evictions += 1
+        return entries
+
+    def invalidate(self, path):
+        """Forget everything a change to ``path`` can make stale.
+
+        That is the listing containing ``path``, the one containing its parent
+        (the parent's mtime moved), and ``path``'s own subtree.
+        """
+        path = normalize_path(path)
+        parent = parent_of(path) or ""
+        stale = {parent, parent_of(parent) or ""}
+        prefix = f"{path}/" if path else ""
+        with self._lock:
+            self._generation += 1
+            self._invalidations += 1
+            for key in list(self._listings):
+                if key in stale or key == path or key.startswith(prefix):
+                    self._total -= len(self._listings.pop(key)[2])
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "directories": len(self._listings),
+                "entries": self._total,
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
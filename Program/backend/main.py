@@ -1,19 +1,42 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, Response, StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 import os
 import shutil
 from typing import List, Optional
-import aiofiles
 import mimetypes
+import difflib
 import base64
-from datetime import datetime
-import zipfile
-import io
-from pathlib import Path
+from datetime import datetime, timedelta
 import json
 import time
+import threading
+import bisect
+import hashlib
+import asyncio
+from size_index import FolderSizeIndex, normalize_path
+from search_index import SearchIndex, FILE_TYPES, file_type_classes
+from upload_sessions import UploadSessionStore, UploadSessionError
+from zip_stream import stream_zip, walk_files
+from tar_stream import TAR_FORMATS, stream_tar, tar_format_available
+from http_files import Offload, file_response
+from thumbnails import ThumbnailCache, PASSTHROUGH_EXTENSIONS
+from text_pages import LineIndex, read_tail, read_window
+from text_edits import PatchError, apply_patch, atomic_write, content_version, decode_text
+from version_store import VersionStore
+from change_feed import ChangeFeed
+from recent_files import RecentFiles
+from recycle_index import RecycleIndex
+from jobs import JobManager, JobCancelled, copy_file, measure_tree
+from fs_executor import FsExecutor
+from duplicates import DuplicateFinder, full_hash, link_file
+from content_index import ContentIndex
+from listing_cache import ListingCache
+from metrics import REGISTRY, MetricsMiddleware, timed, timed_iter
+from compression import CompressionMiddleware, PrecompressedCache
+from storage_analytics import StorageAnalytics
+from temp_files import is_temp_name, sweep_temp_files, temp_path
 
 app = FastAPI()
 
@@ -25,44 +48,215 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compressible responses of at least COMPRESSION_MIN_SIZE bytes are sent gzip/br/zstd-encoded
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", 1024)))
+
+# Per-route latency/size metrics for /metrics; requests slower than SLOW_REQUEST_SECONDS are logged
+app.add_middleware(MetricsMiddleware, slow_request_seconds=float(os.getenv("SLOW_REQUEST_SECONDS", 0)))
+
 UPLOAD_DIR = "uploads"
 RECYCLE_DIR = "recycle_bin"
 RECENT_FILES_DB = "recent_files.json"
+RECENT_FILES_LIMIT = int(os.getenv("RECENT_FILES_LIMIT", 20))
+RECENT_FILES_FLUSH_INTERVAL = float(os.getenv("RECENT_FILES_FLUSH_INTERVAL", 2))
+SIZE_INDEX_DB = "folder_sizes.db"
+SEARCH_INDEX_DB = "search_index.db"
+CONTENT_INDEX_DB = "content_index.db"
+# Editable files larger than this are left out of the content index
+CONTENT_INDEX_MAX_FILE_BYTES = int(os.getenv("CONTENT_INDEX_MAX_FILE_BYTES", 16 * 1024 * 1024))
+RECYCLE_INDEX_DB = "recycle_bin.db"
+
+# Saved versions of edited files: the newest VERSION_KEEP per file, none older than VERSION_KEEP_DAYS (0 = no limit)
+VERSION_DB = "file_versions.db"
+VERSION_KEEP = int(os.getenv("VERSION_KEEP", 50))
+VERSION_KEEP_DAYS = float(os.getenv("VERSION_KEEP_DAYS", 30))
+VERSION_MAX_FILE_BYTES = int(os.getenv("VERSION_MAX_FILE_BYTES", 16 * 1024 * 1024))
+
+# Uploads are copied to disk in chunks of this size; limits are in bytes, 0 means unlimited
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+MAX_UPLOAD_FILE_SIZE = int(os.getenv("MAX_UPLOAD_FILE_SIZE", 0))
+MAX_UPLOAD_REQUEST_SIZE = int(os.getenv("MAX_UPLOAD_REQUEST_SIZE", 0))
+
+# Resumable chunked uploads: sessions expire after UPLOAD_SESSION_TTL seconds without activity
+UPLOAD_SESSIONS_DIR = "upload_sessions"
+UPLOAD_SESSION_CHUNK_SIZE = int(os.getenv("UPLOAD_SESSION_CHUNK_SIZE", 8 * 1024 * 1024))
+UPLOAD_SESSION_MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_SESSION_MAX_CHUNK_SIZE", 64 * 1024 * 1024))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 24 * 3600))
+
+# With DOWNLOAD_OFFLOAD set to x-accel-redirect (nginx) or x-sendfile, file bodies are sent by the
+# reverse proxy; DOWNLOAD_OFFLOAD_PREFIX is the proxy's internal location for UPLOAD_DIR
+DOWNLOAD_OFFLOAD = os.getenv("DOWNLOAD_OFFLOAD", "")
+DOWNLOAD_OFFLOAD_PREFIX = os.getenv("DOWNLOAD_OFFLOAD_PREFIX", "/protected-uploads/")
+
+# Bytes read and emitted per step while streaming ZIP downloads
+ZIP_STREAM_CHUNK_SIZE = 1024 * 1024
+
+# tar.gz/tar.zst downloads are compressed in ARCHIVE_BLOCK_SIZE blocks across ARCHIVE_WORKERS threads
+ARCHIVE_WORKERS = int(os.getenv("ARCHIVE_WORKERS", os.cpu_count() or 2))
+ARCHIVE_BLOCK_SIZE = int(os.getenv("ARCHIVE_BLOCK_SIZE", 1024 * 1024))
+# File chunks read ahead of compression per archive
+ARCHIVE_READ_AHEAD = 8
+
+# Generated thumbnails are cached on disk up to THUMBNAIL_CACHE_MAX_BYTES
+THUMBNAIL_CACHE_DIR = "thumbnail_cache"
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", os.cpu_count() or 2))
+THUMBNAIL_MIN_SIZE = 16
+THUMBNAIL_MAX_SIZE = 1024
+
+# Compressed variants of text files of at least PRECOMPRESS_MIN_SIZE bytes, served by /download
+PRECOMPRESSED_CACHE_DIR = "compressed_cache"
+PRECOMPRESSED_CACHE_MAX_BYTES = int(os.getenv("PRECOMPRESSED_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+PRECOMPRESS_MIN_SIZE = int(os.getenv("PRECOMPRESS_MIN_SIZE", 64 * 1024))
+PRECOMPRESS_WORKERS = int(os.getenv("PRECOMPRESS_WORKERS", 2))
+
+# Content hashes for the duplicate finder, cached by inode/size/mtime
+HASH_CACHE_DB = "file_hashes.db"
+DUPLICATE_HASH_WORKERS = int(os.getenv("DUPLICATE_HASH_WORKERS", os.cpu_count() or 2))
+
+# Blocking filesystem calls from request handlers run on two pools: metadata (stat, scandir,
+# rename, index updates) and bulk data (reads, writes, hashing, archives)
+FS_METADATA_WORKERS = int(os.getenv("FS_METADATA_WORKERS", 16))
+FS_DATA_WORKERS = int(os.getenv("FS_DATA_WORKERS", 8))
+
+# Copy, move and bulk delete run as background jobs; JOB_LIMIT_* cap concurrent jobs per operation
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 8))
+JOB_ITEM_PARALLELISM = int(os.getenv("JOB_ITEM_PARALLELISM", 4))
+JOB_LIMITS = {
+    "copy": int(os.getenv("JOB_LIMIT_COPY", 2)),
+    "move": int(os.getenv("JOB_LIMIT_MOVE", 4)),
+    "delete": int(os.getenv("JOB_LIMIT_DELETE", 4)),
+}
+# Seconds between progress events on /jobs/{id}/events
+JOB_EVENT_INTERVAL = 0.5
+
+# Live folder updates on /events: changes are batched per CHANGE_FEED_INTERVAL seconds; folders
+# without inotify are rescanned every CHANGE_FEED_POLL_INTERVAL seconds
+CHANGE_FEED_INTERVAL = float(os.getenv("CHANGE_FEED_INTERVAL", 0.25))
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv("CHANGE_FEED_POLL_INTERVAL", 2))
+CHANGE_FEED_KEEPALIVE = 15
+
+# Folder listings are cached until their directory changes, up to LISTING_CACHE_MAX_ENTRIES entries in
+# total; LISTING_CACHE_MAX_AGE seconds bounds how long changes made outside the API can go unnoticed
+LISTING_CACHE_MAX_ENTRIES = int(os.getenv("LISTING_CACHE_MAX_ENTRIES", 200000))
+LISTING_CACHE_MAX_AGE = float(os.getenv("LISTING_CACHE_MAX_AGE", 30))
+
+# Storage analytics are kept current by the mutation hooks and rebuilt from a full scan every
+# STORAGE_ANALYTICS_RECONCILE_INTERVAL seconds; top-N lists go up to STORAGE_ANALYTICS_MAX_TOP
+STORAGE_ANALYTICS_RECONCILE_INTERVAL = float(os.getenv("STORAGE_ANALYTICS_RECONCILE_INTERVAL", 6 * 3600))
+STORAGE_ANALYTICS_MAX_TOP = int(os.getenv("STORAGE_ANALYTICS_MAX_TOP", 50))
+STORAGE_ANALYTICS_MAX_DEPTH = 4
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(RECYCLE_DIR, exist_ok=True)
 
-# Initialize recent files database
-def load_recent_files():
-    if os.path.exists(RECENT_FILES_DB):
+# Folder sizes are served from a persistent index instead of walking each folder per request
+size_index = FolderSizeIndex(UPLOAD_DIR, SIZE_INDEX_DB)
+
+# Metadata index answering /search queries without walking UPLOAD_DIR
+search_index = SearchIndex(UPLOAD_DIR, SEARCH_INDEX_DB)
+
+# Usage by type, extension, age and folder for /stats/storage, maintained in the background
+storage_analytics = StorageAnalytics(UPLOAD_DIR, STORAGE_ANALYTICS_RECONCILE_INTERVAL, STORAGE_ANALYTICS_MAX_TOP)
+
+download_offload = Offload(DOWNLOAD_OFFLOAD, UPLOAD_DIR, DOWNLOAD_OFFLOAD_PREFIX) if DOWNLOAD_OFFLOAD else None
+
+metadata_pool = FsExecutor("fs-metadata", FS_METADATA_WORKERS)
+data_pool = FsExecutor("fs-data", FS_DATA_WORKERS)
+archive_pool = FsExecutor("archive", ARCHIVE_WORKERS)
+
+@REGISTRY.collector
+def filesystem_pool_metrics():
+    pools = [(pool.name, pool.stats()) for pool in (metadata_pool, data_pool, archive_pool)]
+    for key, documentation in (
+        ("queued", "Calls waiting for a filesystem pool thread."),
+        ("running", "Calls running on a filesystem pool."),
+        ("completed", "Calls completed by a filesystem pool."),
+        ("avg_wait_ms", "Average time calls waited for a filesystem pool thread."),
+    ):
+        yield f"fs_pool_{key}", documentation, ("pool",), [((name,), stats[key]) for name, stats in pools]
+    stats = listing_cache.stats()
+    for key, documentation in (
+        ("hits", "Folder listings served from the listing cache."),
+        ("misses", "Folder listings that had to scan the directory."),
+        ("evictions", "Cached listings evicted to stay under the entry limit."),
+        ("entries", "Entries held by cached listings."),
+    ):
+        yield f"listing_cache_{key}", documentation, (), [((), stats[key])]
+    totals = sorted(storage_analytics.type_totals().items())
+    yield "storage_bytes", "Bytes stored per file type.", ("type",), [((t,), size) for t, (size, _) in totals]
+    yield "storage_files", "Files stored per file type.", ("type",), [((t,), count) for t, (_, count) in totals]
+
+upload_sessions = UploadSessionStore(
+    UPLOAD_SESSIONS_DIR, UPLOAD_SESSION_CHUNK_SIZE, UPLOAD_SESSION_MAX_CHUNK_SIZE, UPLOAD_SESSION_TTL,
+    executor=data_pool
+)
+
+# Recently viewed files live in memory and are snapshotted to RECENT_FILES_DB in the background
+recent_files = RecentFiles(RECENT_FILES_DB, RECENT_FILES_LIMIT, RECENT_FILES_FLUSH_INTERVAL)
+
+thumbnail_cache = ThumbnailCache(
+    THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_WORKERS, executor=metadata_pool
+)
+
+duplicate_finder = DuplicateFinder(UPLOAD_DIR, HASH_CACHE_DB, DUPLICATE_HASH_WORKERS)
+
+# One manifest for everything in RECYCLE_DIR instead of a .meta file per item
+recycle_index = RecycleIndex(RECYCLE_INDEX_DB)
+# Names handed out to deletes that are still moving their item into RECYCLE_DIR
+recycle_names_lock = threading.Lock()
+reserved_recycle_names = set()
+
+jobs = JobManager(JOB_WORKERS, JOB_LIMITS, JOB_ITEM_PARALLELISM)
+
+def collect_expired_upload_sessions():
+    while True:
+        time.sleep(600)
         try:
-            with open(RECENT_FILES_DB, 'r') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+            upload_sessions.collect_expired()
+        except OSError:
+            pass
 
-def save_recent_files(recent_files):
-    with open(RECENT_FILES_DB, 'w') as f:
-        json.dump(recent_files, f)
+@app.on_event("startup")
+async def start_indexes():
+    recent_files.load()
+    recent_files.start()
+    size_index.load()
+    recycled_size = lambda path: calculate_folder_size(path) if os.path.isdir(path) else os.path.getsize(path)
+    recycle_index.migrate_meta_files(RECYCLE_DIR, recycled_size)
+    # Items a crash left in RECYCLE_DIR between the move and the index insert
+    recycle_index.adopt_unindexed(RECYCLE_DIR, recycled_size)
+    threading.Thread(target=size_index.rebuild, name="size-index-scan", daemon=True).start()
+    threading.Thread(target=search_index.rebuild, name="search-index-scan", daemon=True).start()
+    content_index.start()
+    storage_analytics.start()
+    threading.Thread(target=version_store.evict_all, name="version-eviction", daemon=True).start()
+    change_feed.start()
+    upload_sessions.collect_expired()
+    threading.Thread(target=collect_expired_upload_sessions, name="upload-session-gc", daemon=True).start()
+    # Temp files from writes a crash interrupted; newer ones may belong to requests already running
+    threading.Thread(
+        target=sweep_temp_files, args=(UPLOAD_DIR, time.time()), name="temp-file-sweep", daemon=True
+    ).start()
 
-def add_to_recent_files(file_path, file_name, file_type):
-    recent_files = load_recent_files()
-    
-    # Remove if already exists
-    recent_files = [f for f in recent_files if f['path'] != file_path]
-    
-    # Add to beginning
-    recent_files.insert(0, {
-        'path': file_path,
-        'name': file_name,
-        'type': file_type,
-        'accessed_at': int(time.time())
-    })
-    
-    # Keep only last 20 files
-    recent_files = recent_files[:20]
-    
-    save_recent_files(recent_files)
+@app.on_event("shutdown")
+async def stop_workers():
+    jobs.shutdown()
+    thumbnail_cache.shutdown()
+    precompressed_cache.shutdown()
+    duplicate_finder.shutdown()
+    content_index.stop()
+    storage_analytics.stop()
+    change_feed.stop()
+    recent_files.stop()
+    metadata_pool.shutdown(wait=False)
+    data_pool.shutdown(wait=False)
+    archive_pool.shutdown(wait=False)
+
+def add_to_recent_files(file_path, file_name, file_type, stats=None):
+    recent_files.add(
+        normalize_path(file_path), file_name, file_type,
+        stats.st_size if stats else None, stats.st_mtime if stats else None
+    )
 
 # Text file extensions that can be edited
 EDITABLE_EXTENSIONS = {'.txt', '.md', '.json', '.xml', '.csv', '.html', '.css', '.js', '.py', '.java', '.cpp', '.c', '.h', '.yml', '.yaml', '.ini', '.conf', '.log'}
@@ -70,6 +264,46 @@ EDITABLE_EXTENSIONS = {'.txt', '.md', '.json', '.xml', '.csv', '.html', '.css',
 # Image extensions for thumbnails
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.svg', '.webp'}
 
+# Listings and per-entry metadata shared by /files, /files/stream and the /search fallback
+listing_cache = ListingCache(
+    UPLOAD_DIR, LISTING_CACHE_MAX_ENTRIES, LISTING_CACHE_MAX_AGE, IMAGE_EXTENSIONS, EDITABLE_EXTENSIONS
+)
+
+# Compressed variants of large text files for /download, built once per file version
+precompressed_cache = PrecompressedCache(
+    PRECOMPRESSED_CACHE_DIR, PRECOMPRESSED_CACHE_MAX_BYTES, PRECOMPRESS_MIN_SIZE, PRECOMPRESS_WORKERS,
+    EDITABLE_EXTENSIONS
+)
+
+@REGISTRY.collector
+def precompressed_cache_metrics():
+    stats = precompressed_cache.stats()
+    yield "precompressed_cache_entries", "Compressed file variants on disk.", (), [((), stats["entries"])]
+    yield "precompressed_cache_bytes", "Bytes used by compressed file variants.", (), [((), stats["bytes"])]
+
+# Full-text index over the contents of editable files, for /search/content
+content_index = ContentIndex(UPLOAD_DIR, CONTENT_INDEX_DB, EDITABLE_EXTENSIONS, CONTENT_INDEX_MAX_FILE_BYTES)
+
+# History of editor saves, delta-compressed
+version_store = VersionStore(VERSION_DB, VERSION_KEEP, VERSION_KEEP_DAYS, VERSION_MAX_FILE_BYTES)
+
+# Folder listing deltas pushed to clients on /events
+change_feed = ChangeFeed(
+    UPLOAD_DIR, lambda path, name: describe_entry(path, name), CHANGE_FEED_INTERVAL, CHANGE_FEED_POLL_INTERVAL
+)
+
+# Text previews larger than this are paged; .log files open on their last lines
+TEXT_PREVIEW_MAX_BYTES = 1024 * 1024
+TEXT_MAX_PAGE_BYTES = 8 * 1024 * 1024
+TEXT_TAIL_LINES = 1000
+TEXT_DEFAULT_LINES = 500
+TEXT_MAX_LINES = 100000
+line_index = LineIndex()
+
+# Entries per chunk written by the NDJSON listing stream
+LISTING_STREAM_BATCH = 100
+
+@timed("folder_size_walk")
 def calculate_folder_size(folder_path):
     """Calculate total size of all files in a folder recursively."""
     total_size = 0
@@ -87,8 +321,196 @@ def calculate_folder_size(folder_path):
         return 0
     return total_size
 
+def date_range_bounds(date_from_str, date_to_str):
+    """Turn the /search YYYY-MM-DD bounds into an mtime range [from, to) in local time.
+
+    An unparseable date disables date filtering altogether, as it always has.
+    """
+    try:
+        mtime_from = mtime_to = None
+        if date_from_str:
+            day = datetime.strptime(date_from_str, '%Y-%m-%d')
+            mtime_from = day.timestamp()
+        if date_to_str:
+            day = datetime.strptime(date_to_str, '%Y-%m-%d') + timedelta(days=1)
+            mtime_to = day.timestamp()
+        return mtime_from, mtime_to
+    except (ValueError, OverflowError, OSError):
+        return None, None
+
+def get_folder_size(rel_path, mtime_ns=None):
+    """Recursive folder size from the index, walking the folder only if it isn't indexed yet."""
+    size = size_index.get(rel_path, mtime_ns)
+    if size is None:
+        size = calculate_folder_size(os.path.join(UPLOAD_DIR, normalize_path(rel_path)))
+    return size
+
+# Hooks called by every endpoint that changes UPLOAD_DIR so the indexes stay in sync
+def on_path_added(rel_path, replaced_size=0):
+    listing_cache.invalidate(rel_path)
+    size_index.path_added(rel_path, replaced_size)
+    search_index.path_added(rel_path)
+    content_index.path_added(rel_path)
+    storage_analytics.path_added(rel_path)
+    change_feed.touch(rel_path)
+    try:
+        stats = os.stat(os.path.join(UPLOAD_DIR, normalize_path(rel_path)))
+        recent_files.update_stats(normalize_path(rel_path), stats.st_size, stats.st_mtime)
+    except OSError:
+        pass
+
+def on_path_removed(rel_path, size):
+    listing_cache.invalidate(rel_path)
+    size_index.path_removed(rel_path, size)
+    search_index.path_removed(rel_path)
+    content_index.path_removed(rel_path)
+    storage_analytics.path_removed(rel_path)
+    change_feed.touch(rel_path)
+    recent_files.remove(normalize_path(rel_path))
+
+def on_path_moved(src_rel_path, dst_rel_path, size):
+    listing_cache.invalidate(src_rel_path)
+    listing_cache.invalidate(dst_rel_path)
+    size_index.path_moved(src_rel_path, dst_rel_path, size)
+    search_index.path_moved(src_rel_path, dst_rel_path)
+    content_index.path_moved(src_rel_path, dst_rel_path)
+    storage_analytics.path_moved(src_rel_path, dst_rel_path)
+    version_store.path_moved(src_rel_path, dst_rel_path)
+    change_feed.touch(src_rel_path)
+    change_feed.touch(dst_rel_path)
+    recent_files.move(normalize_path(src_rel_path), normalize_path(dst_rel_path))
+
+def existing_size(full_path):
+    """Size of a file about to be overwritten, 0 if there is nothing there."""
+    try:
+        return os.path.getsize(full_path) if os.path.isfile(full_path) else 0
+    except OSError:
+        return 0
+
+def move_to_recycle_bin(file_path, copy_function=shutil.copy2):
+    """Move one item into RECYCLE_DIR and return the entry to record in recycle_index."""
+    file_path = normalize_path(file_path)
+    full_path = os.path.join(UPLOAD_DIR, file_path)
+    timestamp = int(time.time())
+    original_name = os.path.basename(file_path)
+    with recycle_names_lock:
+        recycled_name = f"{timestamp}_{original_name}"
+        # Same name deleted twice within a second
+        suffix = 1
+        while (recycled_name in reserved_recycle_names
+               or os.path.lexists(os.path.join(RECYCLE_DIR, recycled_name))
+               or recycle_index.exists(recycled_name)):
+            recycled_name = f"{timestamp}_{suffix}_{original_name}"
+            suffix += 1
+        reserved_recycle_names.add(recycled_name)
+
+    try:
+        is_dir = os.path.isdir(full_path)
+        size = size_index.size_of(file_path)
+        try:
+            shutil.move(full_path, os.path.join(RECYCLE_DIR, recycled_name), copy_function=copy_function)
+        except BaseException:
+            # A cross-device move stopped halfway; the original is still in place
+            if os.path.lexists(full_path):
+                remove_recycled(recycled_name)
+            raise
+        on_path_removed(file_path, size)
+    finally:
+        with recycle_names_lock:
+            reserved_recycle_names.discard(recycled_name)
+    return {
+        "recycled_name": recycled_name,
+        "original_path": file_path,
+        "original_name": original_name,
+        "deleted_at": timestamp,
+        "size": size,
+        "type": "directory" if is_dir else "file"
+    }
+
+def remove_recycled(recycled_name):
+    recycle_path = os.path.join(RECYCLE_DIR, recycled_name)
+    if os.path.isdir(recycle_path) and not os.path.islink(recycle_path):
+        shutil.rmtree(recycle_path)
+    elif os.path.lexists(recycle_path):
+        os.remove(recycle_path)
+
+# Per-item work of file jobs; each gets the item's progress tracker and one source path
+
+def copy_item(progress, file_path, destination):
+    src_path = os.path.join(UPLOAD_DIR, file_path.strip("/"))
+    filename = os.path.basename(file_path)
+    dst_path = os.path.join(UPLOAD_DIR, destination.strip("/"), filename)
+    dst_rel_path = os.path.join(destination, filename)
+    
+    replaced_size = existing_size(dst_path)
+    existed = os.path.lexists(dst_path)
+    copy_function = lambda src, dst: copy_file(progress, src, dst)
+    try:
+        if os.path.isdir(src_path):
+            shutil.copytree(src_path, dst_path, copy_function=copy_function)
+        else:
+            copy_function(src_path, dst_path)
+    except JobCancelled:
+        if not existed and os.path.isdir(dst_path):
+            shutil.rmtree(dst_path, ignore_errors=True)
+        raise
+    on_path_added(dst_rel_path, replaced_size)
+    return dst_rel_path
+
+def move_item(progress, file_path, destination):
+    src_path = os.path.join(UPLOAD_DIR, file_path.strip("/"))
+    dst_path = os.path.join(UPLOAD_DIR, destination.strip("/"), os.path.basename(file_path))
+    
+    # shutil.move nests the source inside an existing destination directory
+    target = os.path.join(dst_path, os.path.basename(src_path)) if os.path.isdir(dst_path) else dst_path
+    existed = os.path.lexists(target)
+    size = size_index.size_of(file_path)
+    try:
+        moved_to = shutil.move(src_path, dst_path, copy_function=lambda src, dst: copy_file(progress, src, dst))
+    except JobCancelled:
+        # Cancelled halfway through a cross-device copy; the source is untouched
+        if not existed and os.path.lexists(src_path):
+            if os.path.isdir(target):
+                shutil.rmtree(target, ignore_errors=True)
+            elif os.path.lexists(target):
+                os.remove(target)
+        raise
+    on_path_moved(file_path, os.path.relpath(moved_to, UPLOAD_DIR), size)
+    return os.path.relpath(moved_to, UPLOAD_DIR)
+
+def delete_item(progress, file_path):
+    if not os.path.lexists(os.path.join(UPLOAD_DIR, file_path.strip("/"))):
+        return None
+    entry = move_to_recycle_bin(file_path, lambda src, dst: copy_file(progress, src, dst))
+    # Recorded per item, so what a cancelled or interrupted job already moved stays restorable
+    recycle_index.add_many([entry])
+    return entry
+
+def submit_file_job(operation, files, destination=None):
+    if operation == "copy":
+        run_item = lambda progress, file_path: copy_item(progress, file_path, destination)
+    elif operation == "move":
+        run_item = lambda progress, file_path: move_item(progress, file_path, destination)
+    elif operation == "delete":
+        run_item = delete_item
+    else:
+        raise HTTPException(status_code=400, detail=f"Unknown operation: {operation}")
+    
+    if operation in ("copy", "move"):
+        if destination is None:
+            raise HTTPException(status_code=400, detail="Destination required")
+        os.makedirs(os.path.join(UPLOAD_DIR, destination.strip("/")), exist_ok=True)
+    
+    measure = lambda file_path: measure_tree(os.path.join(UPLOAD_DIR, file_path.strip("/")))
+    return jobs.submit(operation, files, run_item, destination=destination, measure=measure)
+
 class FileContent(BaseModel):
     content: str
+    base_version: Optional[str] = None  # when set, the save is rejected if the file has changed since
+
+class FilePatch(BaseModel):
+    patch: str  # unified diff against the version the editor loaded
+    base_version: str
 
 class CreateFolder(BaseModel):
     name: str
@@ -102,73 +524,193 @@ class FileOperation(BaseModel):
 class BulkDelete(BaseModel):
     files: List[str]
 
+class FileJob(BaseModel):
+    files: List[str]
+    operation: str  # "copy", "move" or "delete"
+    destination: Optional[str] = None
+
 class RestoreFiles(BaseModel):
     files: List[str]
 
-@app.get("/files")
-async def list_files(
-    path: str = Query("", description="Folder path"),
-    search: str = Query("", description="Search query"),
-    sort_by: str = Query("name", description="Sort by: name, size, modified"),
-    sort_order: str = Query("asc", description="Sort order: asc or desc")
-):
-    base_path = os.path.join(UPLOAD_DIR, path.strip("/"))
-    if not os.path.exists(base_path):
-        os.makedirs(base_path, exist_ok=True)
-    
-    files = []
-    items = os.listdir(base_path)
-    
-    for filename in items:
+class PurgeFiles(BaseModel):
+    files: List[str]
+
+class LinkDuplicates(BaseModel):
+    files: List[str]  # the first file is kept, the others become links to it
+    mode: str = "hardlink"  # "hardlink" or "reflink"
+
+class CreateUploadSession(BaseModel):
+    filename: str
+    size: int
+    path: Optional[str] = ""
+    chunk_size: Optional[int] = 0
+    sha256: Optional[str] = None
+
+class Descending:
+    """Sort key wrapper that inverts ordering, so mixed asc/desc tuples stay comparable."""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+def listing_entries(rel_path, search, sort_by, sort_order):
+    """Return (sort_key, CachedEntry) pairs for a folder in listing order.
+
+    Directories always come first and the name breaks ties, so the order is stable across
+    requests. Entries come from listing_cache, so an unchanged folder costs one stat.
+    """
+    keyed = []
+    for entry in folder_entries(rel_path):
         # Skip if search query doesn't match
-        if search and search.lower() not in filename.lower():
+        if search and search.lower() not in entry.name.lower():
             continue
-            
-        item_path = os.path.join(base_path, filename)
-        stats = os.stat(item_path)
-        is_dir = os.path.isdir(item_path)
-        
-        # Calculate size - for directories, get total size of all contents
-        if is_dir:
-            folder_size = calculate_folder_size(item_path)
-        else:
-            folder_size = stats.st_size
-        
-        file_info = {
-            "name": filename,
-            "size": folder_size,
-            "modified": stats.st_mtime,
-            "type": "directory" if is_dir else "file",
-            "path": os.path.join(path, filename).replace("\\", "/"),
-        }
-        
-        if not is_dir:
-            mime_type, _ = mimetypes.guess_type(filename)
-            file_info["mimeType"] = mime_type or "application/octet-stream"
-            ext = os.path.splitext(filename)[1].lower()
-            file_info["isImage"] = ext in IMAGE_EXTENSIONS
-            file_info["isEditable"] = ext in EDITABLE_EXTENSIONS
-        
-        files.append(file_info)
+        if sort_by == "size":
+            if entry.is_dir:
+                primary = get_folder_size(os.path.join(rel_path, entry.name), entry.mtime_ns)
+            else:
+                primary = entry.size
+        elif sort_by == "modified":
+            primary = entry.mtime
+        else:  # name
+            primary = entry.name.lower()
+        keyed.append(((0 if entry.is_dir else 1, primary, entry.name), entry))
+    
+    if sort_order == "desc":
+        wrap = lambda key: (key[0], Descending(key[1]), Descending(key[2]))
+    else:
+        wrap = lambda key: key
+    keyed = [(wrap(key), key, entry) for key, entry in keyed]
+    keyed.sort(key=lambda x: x[0])
+    return keyed, wrap
+
+def listing_page(keyed, wrap, cursor, limit):
+    """Slice the entries that come after ``cursor``; returns (page, next_cursor)."""
+    start = 0
+    if cursor:
+        try:
+            last = tuple(json.loads(base64.urlsafe_b64decode(cursor.encode()).decode()))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        keys = [k for k, _, _ in keyed]
+        try:
+            start = bisect.bisect_right(keys, wrap(last))
+        except TypeError:
+            # The cursor came from a listing with a different sort_by
+            raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+    end = start + limit if limit > 0 else len(keyed)
+    page = keyed[start:end]
+    next_cursor = None
+    if end < len(keyed) and page:
+        next_cursor = base64.urlsafe_b64encode(json.dumps(list(page[-1][1])).encode()).decode()
+    return page, next_cursor
+
+def listing_file_info(entry, path):
+    """Build the /files entry for a CachedEntry."""
+    # Calculate size - for directories, get total size of all contents
+    if entry.is_dir:
+        folder_size = get_folder_size(os.path.join(path, entry.name), entry.mtime_ns)
+    else:
+        folder_size = entry.size
+    
+    file_info = {
+        "name": entry.name,
+        "size": folder_size,
+        "modified": entry.mtime,
+        "type": "directory" if entry.is_dir else "file",
+        "path": os.path.join(path, entry.name).replace("\\", "/"),
+    }
     
-    # Sorting
-    reverse = sort_order == "desc"
-    if sort_by == "size":
-        files.sort(key=lambda x: x["size"], reverse=reverse)
-    elif sort_by == "modified":
-        files.sort(key=lambda x: x["modified"], reverse=reverse)
-    else:  # name
-        files.sort(key=lambda x: x["name"].lower(), reverse=reverse)
+    if not entry.is_dir:
+        file_info["mimeType"] = entry.mime_type or "application/octet-stream"
+        file_info["isImage"] = entry.is_image
+        file_info["isEditable"] = entry.is_editable
     
-    # Always put directories first
-    files.sort(key=lambda x: x["type"] != "directory")
+    return file_info
+
+def describe_entry(path, name):
+    """The /files entry for ``name`` in folder ``path``, or None if it is gone."""
+    if is_temp_name(name):
+        return None
+    # Stat'ed directly: the change feed is what notices changes the cache doesn't know about yet
+    try:
+        stats = os.stat(os.path.join(UPLOAD_DIR, path, name))
+    except OSError:
+        return None
+    return listing_file_info(listing_cache.entry_from_stat(name, stats), path)
+
+def folder_entries(path):
+    """Cached entries of a folder; like the listing always has, a missing folder is created."""
+    try:
+        return listing_cache.listing(path)
+    except FileNotFoundError:
+        os.makedirs(os.path.join(UPLOAD_DIR, path.strip("/")), exist_ok=True)
+        return listing_cache.listing(path)
+
+def folder_listing(path, search, sort_by, sort_order, limit, cursor):
+    keyed, wrap = listing_entries(path, search, sort_by, sort_order)
+    page, next_cursor = listing_page(keyed, wrap, cursor, limit)
+    
+    files = [listing_file_info(entry, path) for _, _, entry in page]
     
     return {
         "files": files,
         "currentPath": path,
-        "breadcrumbs": path.split("/") if path else []
+        "breadcrumbs": path.split("/") if path else [],
+        "total": len(keyed),
+        "nextCursor": next_cursor
     }
 
+@app.get("/files")
+async def list_files(
+    path: str = Query("", description="Folder path"),
+    search: str = Query("", description="Search query"),
+    sort_by: str = Query("name", description="Sort by: name, size, modified"),
+    sort_order: str = Query("asc", description="Sort order: asc or desc"),
+    limit: int = Query(0, description="Page size (0 = return the whole folder)"),
+    cursor: str = Query("", description="nextCursor from the previous page")
+):
+    return await metadata_pool.run(folder_listing, path, search, sort_by, sort_order, limit, cursor)
+
+@app.get("/files/stream")
+async def stream_files(
+    path: str = Query("", description="Folder path"),
+    search: str = Query("", description="Search query"),
+    sort_by: str = Query("name", description="Sort by: name, size, modified"),
+    sort_order: str = Query("asc", description="Sort order: asc or desc"),
+    limit: int = Query(0, description="Page size (0 = stream the whole folder)"),
+    cursor: str = Query("", description="nextCursor from the previous page")
+):
+    """Same listing as /files as NDJSON: a header line, one {"file": ...} line per entry,
+    then a {"nextCursor": ...} line, so clients can render rows as they arrive."""
+    def scan():
+        keyed, wrap = listing_entries(path, search, sort_by, sort_order)
+        return (keyed,) + listing_page(keyed, wrap, cursor, limit)
+    keyed, page, next_cursor = await metadata_pool.run(scan)
+    
+    def generate():
+        yield json.dumps({
+            "currentPath": path,
+            "breadcrumbs": path.split("/") if path else [],
+            "total": len(keyed)
+        }) + "\n"
+        batch = []
+        for _, _, entry in page:
+            batch.append(json.dumps({"file": listing_file_info(entry, path)}))
+            if len(batch) >= LISTING_STREAM_BATCH:
+                yield "\n".join(batch) + "\n"
+                batch = []
+        if batch:
+            yield "\n".join(batch) + "\n"
+        yield json.dumps({"nextCursor": next_cursor}) + "\n"
+    
+    return StreamingResponse(metadata_pool.iterate(generate()), media_type="application/x-ndjson")
+
 @app.get("/search")
 async def advanced_search(
     query: str = Query("", description="Search query"),
@@ -180,151 +722,133 @@ async def advanced_search(
     path: str = Query("", description="Search within specific path"),
     recursive: bool = Query(True, description="Search subdirectories"),
     sort_by: str = Query("name", description="Sort by: name, size, modified"),
-    sort_order: str = Query("asc", description="Sort order: asc or desc")
+    sort_order: str = Query("asc", description="Sort order: asc or desc"),
+    limit: int = Query(0, description="Maximum number of results (0 = no limit)"),
+    offset: int = Query(0, description="Number of results to skip")
 ):
-    import datetime
+    # Parse the date bounds once instead of per file
+    mtime_from, mtime_to = date_range_bounds(date_from, date_to)
     
-    def matches_file_type(filename, mime_type, target_type):
-        if not target_type:
-            return True
-            
-        ext = filename.lower().split('.')[-1] if '.' in filename else ''
-        
-        type_mappings = {
-            'image': (['jpg', 'jpeg', 'png', 'gif', 'bmp', 'svg', 'webp'], ['image/']),
-            'video': (['mp4', 'avi', 'mov', 'wmv', 'flv', 'webm', 'mkv'], ['video/']),
-            'audio': (['mp3', 'wav', 'ogg', 'aac', 'flac', 'm4a', 'wma'], ['audio/']),
-            'document': (['pdf', 'doc', 'docx', 'txt', 'rtf', 'odt'], ['application/pdf', 'text/']),
-            'archive': (['zip', 'rar', '7z', 'tar', 'gz'], ['application/zip', 'application/x-'])
-        }
+    def search_directory(relative_path=""):
+        results = []
         
-        if target_type in type_mappings:
-            extensions, mime_prefixes = type_mappings[target_type]
-            return (ext in extensions or 
-                   any(mime_type.startswith(prefix) for prefix in mime_prefixes if mime_type))
+        try:
+            entries = listing_cache.listing(relative_path)
+        except (OSError, PermissionError):
+            return results
         
-        return True
-    
-    def matches_date_range(file_time, date_from_str, date_to_str):
-        if not date_from_str and not date_to_str:
-            return True
+        for entry in entries:
+            item = entry.name
+            if item.startswith('.'):
+                continue
             
-        try:
-            file_date = datetime.datetime.fromtimestamp(file_time).date()
+            item_relative = os.path.join(relative_path, item) if relative_path else item
+            is_dir = entry.is_dir
             
-            if date_from_str:
-                date_from = datetime.datetime.strptime(date_from_str, '%Y-%m-%d').date()
-                if file_date < date_from:
-                    return False
-                    
-            if date_to_str:
-                date_to = datetime.datetime.strptime(date_to_str, '%Y-%m-%d').date()
-                if file_date > date_to:
-                    return False
-                    
-            return True
-        except (ValueError, OSError):
-            return True
-    
-    def search_directory(dir_path, relative_path=""):
-        results = []
-        
-        try:
-            for item in os.listdir(dir_path):
-                if item.startswith('.'):
+            # MIME type comes with the cached entry
+            mime_type = entry.mime_type
+            
+            # Check search query match
+            if query and query.lower() not in item.lower():
+                if recursive and is_dir:
+                    results.extend(search_directory(item_relative))
+                continue
+            
+            # Check file type filter (only for files)
+            if not is_dir and file_type in FILE_TYPES and file_type not in file_type_classes(item, mime_type).split():
+                continue
+            
+            # Check size filter (only for files)
+            if not is_dir:
+                if min_size > 0 and entry.size < min_size:
                     continue
-                    
-                item_path = os.path.join(dir_path, item)
-                item_relative = os.path.join(relative_path, item) if relative_path else item
-                
-                try:
-                    stats = os.stat(item_path)
-                    is_dir = os.path.isdir(item_path)
-                    
-                    # Get MIME type
-                    mime_type, _ = mimetypes.guess_type(item_path)
-                    
-                    # Check search query match
-                    if query and query.lower() not in item.lower():
-                        if recursive and is_dir:
-                            results.extend(search_directory(item_path, item_relative))
-                        continue
-                    
-                    # Check file type filter (only for files)
-                    if not is_dir and not matches_file_type(item, mime_type, file_type):
-                        continue
-                    
-                    # Check size filter (only for files)
-                    if not is_dir:
-                        if min_size > 0 and stats.st_size < min_size:
-                            continue
-                        if max_size > 0 and stats.st_size > max_size:
-                            continue
-                    
-                    # Check date filter
-                    if not matches_date_range(stats.st_mtime, date_from, date_to):
-                        continue
-                    
-                    # Calculate size
-                    if is_dir:
-                        size = calculate_folder_size(item_path)
-                    else:
-                        size = stats.st_size
-                    
-                    # Check if it's an image
-                    is_image = False
-                    if not is_dir and mime_type:
-                        is_image = mime_type.startswith('image/')
-                    
-                    file_info = {
-                        "name": item,
-                        "path": item_relative.replace("\\", "/"),
-                        "type": "directory" if is_dir else "file",
-                        "size": size,
-                        "modified": stats.st_mtime,
-                        "isImage": is_image,
-                        "mimeType": mime_type
-                    }
-                    
-                    results.append(file_info)
-                    
-                    # Recursively search subdirectories
-                    if recursive and is_dir:
-                        results.extend(search_directory(item_path, item_relative))
-                        
-                except (OSError, PermissionError):
+                if max_size > 0 and entry.size > max_size:
                     continue
-                    
-        except (OSError, PermissionError):
-            pass
+            
+            # Check date filter
+            if mtime_from is not None and entry.mtime < mtime_from:
+                continue
+            if mtime_to is not None and entry.mtime >= mtime_to:
+                continue
+            
+            # Calculate size
+            if is_dir:
+                size = get_folder_size(item_relative, entry.mtime_ns)
+            else:
+                size = entry.size
+            
+            # Check if it's an image
+            is_image = False
+            if not is_dir and mime_type:
+                is_image = mime_type.startswith('image/')
+            
+            file_info = {
+                "name": item,
+                "path": item_relative.replace("\\", "/"),
+                "type": "directory" if is_dir else "file",
+                "size": size,
+                "modified": entry.mtime,
+                "isImage": is_image,
+                "mimeType": mime_type
+            }
+            
+            results.append(file_info)
+            
+            # Recursively search subdirectories
+            if recursive and is_dir:
+                results.extend(search_directory(item_relative))
             
         return results
     
-    # Set up search path
-    search_path = os.path.join(UPLOAD_DIR, path.strip("/")) if path else UPLOAD_DIR
-    if not os.path.exists(search_path):
-        return {"files": [], "query": query, "total": 0}
-    
-    # Perform search
-    files = search_directory(search_path)
-    
-    # Sort results
-    reverse = sort_order == "desc"
-    if sort_by == "size":
-        files.sort(key=lambda x: x["size"], reverse=reverse)
-    elif sort_by == "modified":
-        files.sort(key=lambda x: x["modified"], reverse=reverse)
-    else:  # name
-        files.sort(key=lambda x: x["name"].lower(), reverse=reverse)
+    def search():
+        # Set up search path
+        search_path = os.path.join(UPLOAD_DIR, path.strip("/")) if path else UPLOAD_DIR
+        if not os.path.exists(search_path):
+            return None
+        
+        if search_index.available():
+            with timed("search_index_query"):
+                files, total = search_index.query(
+                    query=query, file_type=file_type, min_size=min_size, max_size=max_size,
+                    mtime_from=mtime_from, mtime_to=mtime_to, path=path, recursive=recursive,
+                    sort_by=sort_by, sort_order=sort_order, limit=limit, offset=offset,
+                    dir_size=get_folder_size
+                )
+            for file_info in files:
+                if file_info["type"] == "directory" and sort_by != "size":
+                    file_info["size"] = get_folder_size(file_info["path"])
+        else:
+            # The index hasn't finished its first build yet, so walk the tree
+            with timed("search_directory"):
+                files = search_directory(normalize_path(path))
+        
+            # Sort results
+            reverse = sort_order == "desc"
+            if sort_by == "size":
+                files.sort(key=lambda x: x["size"], reverse=reverse)
+            elif sort_by == "modified":
+                files.sort(key=lambda x: x["modified"], reverse=reverse)
+            else:  # name
+                files.sort(key=lambda x: x["name"].lower(), reverse=reverse)
+        
+            # Always put directories first when sorting by name
+            if sort_by == "name":
+                files.sort(key=lambda x: x["type"] != "directory")
+        
+            total = len(files)
+            files = files[offset:offset + limit] if limit > 0 else files[offset:]
+        
+        return files, total
     
-    # Always put directories first when sorting by name
-    if sort_by == "name":
-        files.sort(key=lambda x: x["type"] != "directory")
+    found = await metadata_pool.run(search)
+    if found is None:
+        return {"files": [], "query": query, "total": 0}
+    files, total = found
     
     return {
         "files": files,
         "query": query,
-        "total": len(files),
+        "total": total,
         "filters": {
             "file_type": file_type,
             "min_size": min_size,
@@ -333,9 +857,74 @@ async def advanced_search(
             "date_to": date_to,
             "path": path,
             "recursive": recursive
-        }
+        },
+        "limit": limit,
+        "offset": offset
+    }
+
+@app.get("/search/content")
+async def search_content(
+    query: str = Query(..., description="Text to find inside editable files"),
+    path: str = Query("", description="Search within specific path"),
+    limit: int = Query(20, description="Maximum number of files (0 = no limit)"),
+    offset: int = Query(0, description="Number of files to skip"),
+    max_lines: int = Query(5, description="Matching lines returned per file")
+):
+    """Ranked files whose contents contain the query, with line-numbered snippets"""
+    if not query.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+    results, total = await metadata_pool.run(
+        content_index.query, query, path, limit, offset, max(min(max_lines, 100), 0)
+    )
+    return {
+        "results": results,
+        "query": query,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        # False while the first background build is still running
+        "complete": content_index.available()
     }
 
+async def save_upload(file, dest_path, budget=0):
+    """Copy an UploadFile to ``dest_path`` in UPLOAD_CHUNK_SIZE pieces.
+
+    Data goes to a hidden temp file next to the destination which is renamed into
+    place once complete, so readers never see a partial file. The SHA-256 is computed
+    in the same pass, on data_pool. ``budget`` is the number of bytes this file may still use
+    (0 = unlimited); exceeding it or MAX_UPLOAD_FILE_SIZE aborts with 413.
+    Returns (size, sha256 hex digest).
+    """
+    limits = [l for l in (MAX_UPLOAD_FILE_SIZE, budget) if l > 0]
+    limit = min(limits) if limits else 0
+    hasher = hashlib.sha256()
+    size = 0
+    
+    def write(f, chunk):
+        hasher.update(chunk)
+        f.write(chunk)
+    
+    tmp_path = temp_path(dest_path, "upload")
+    try:
+        f = await data_pool.run(open, tmp_path, 'xb')
+        try:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if limit and size > limit:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds the size limit of {limit} bytes")
+                await data_pool.run(write, f, chunk)
+        finally:
+            await data_pool.run(f.close)
+        await metadata_pool.run(os.replace, tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size, hasher.hexdigest()
+
 @app.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
@@ -343,13 +932,19 @@ async def upload_file(
 ):
     try:
         upload_path = os.path.join(UPLOAD_DIR, path.strip("/"))
-        os.makedirs(upload_path, exist_ok=True)
+        await metadata_pool.run(os.makedirs, upload_path, exist_ok=True)
         
         file_path = os.path.join(upload_path, file.filename)
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
-        return {"message": f"Successfully uploaded {file.filename}"}
+        replaced_size = await metadata_pool.run(existing_size, file_path)
+        size, sha256 = await save_upload(file, file_path, MAX_UPLOAD_REQUEST_SIZE)
+        await metadata_pool.run(on_path_added, os.path.join(path, file.filename), replaced_size)
+        return {
+            "message": f"Successfully uploaded {file.filename}",
+            "size": size,
+            "sha256": sha256
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -360,10 +955,12 @@ async def upload_folder(
 ):
     try:
         base_upload_path = os.path.join(UPLOAD_DIR, path.strip("/"))
-        os.makedirs(base_upload_path, exist_ok=True)
+        await metadata_pool.run(os.makedirs, base_upload_path, exist_ok=True)
         
         uploaded_files = []
         created_folders = set()
+        checksums = {}
+        request_bytes = 0
         
         for file in files:
             # Extract relative path from filename (browsers include folder structure)
@@ -377,366 +974,809 @@ async def upload_folder(
             # Create directory structure if it doesn't exist
             file_dir = os.path.dirname(full_file_path)
             if file_dir and file_dir not in created_folders:
-                os.makedirs(file_dir, exist_ok=True)
+                await metadata_pool.run(os.makedirs, file_dir, exist_ok=True)
                 created_folders.add(file_dir)
             
-            # Write the file
-            async with aiofiles.open(full_file_path, 'wb') as f:
-                content = await file.read()
-                await f.write(content)
+            # Write the file; the request size limit is shared by all files in the request
+            replaced_size = await metadata_pool.run(existing_size, full_file_path)
+            budget = 0
+            if MAX_UPLOAD_REQUEST_SIZE > 0:
+                budget = MAX_UPLOAD_REQUEST_SIZE - request_bytes
+                if budget <= 0:
+                    raise HTTPException(
+                        status_code=413, detail=f"Upload exceeds the size limit of {MAX_UPLOAD_REQUEST_SIZE} bytes"
+                    )
+            size, sha256 = await save_upload(file, full_file_path, budget)
+            request_bytes += size
+            await metadata_pool.run(on_path_added, os.path.join(path, relative_path), replaced_size)
             
             uploaded_files.append(relative_path)
+            checksums[relative_path] = sha256
         
         return {
             "message": f"Successfully uploaded {len(uploaded_files)} files",
             "uploaded_files": uploaded_files,
-            "created_folders": list(created_folders)
+            "created_folders": list(created_folders),
+            "checksums": checksums,
+            "total_size": request_bytes
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Resumable chunked uploads: create a session, PUT chunks in any order, then complete it
+@app.post("/uploads")
+async def create_upload_session(upload: CreateUploadSession):
+    if MAX_UPLOAD_FILE_SIZE > 0 and upload.size > MAX_UPLOAD_FILE_SIZE:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the size limit of {MAX_UPLOAD_FILE_SIZE} bytes")
+    try:
+        return await metadata_pool.run(
+            upload_sessions.create, upload.path, upload.filename, upload.size, upload.chunk_size, upload.sha256
+        )
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_session(upload_id: str):
+    """Chunks and byte ranges received so far, for resuming an interrupted upload"""
+    try:
+        return upload_sessions.status(upload_id)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.put("/uploads/{upload_id}/chunks/{index}")
+async def upload_chunk(upload_id: str, index: int, request: Request):
+    """Store one chunk; the raw request body is written at the chunk's offset"""
+    try:
+        status = await upload_sessions.write_chunk(upload_id, index, request.stream())
+        return {
+            "upload_id": upload_id,
+            "index": index,
+            "received_bytes": status["received_bytes"],
+            "missing_chunks": len(status["missing_chunks"])
+        }
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload_session(upload_id: str):
+    def complete():
+        session = upload_sessions.get(upload_id)
+        upload_path = os.path.join(UPLOAD_DIR, session["path"].strip("/"))
+        os.makedirs(upload_path, exist_ok=True)
+        file_path = os.path.join(upload_path, session["filename"])
+        replaced_size = existing_size(file_path)
+        sha256 = upload_sessions.complete(upload_id, file_path)
+        on_path_added(os.path.join(session["path"], session["filename"]), replaced_size)
+        return {
+            "message": f"Successfully uploaded {session['filename']}",
+            "size": session["size"],
+            "sha256": sha256
+        }
+    
+    try:
+        # Hashes and possibly copies the whole file
+        return await data_pool.run(complete)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload_session(upload_id: str):
+    try:
+        await metadata_pool.run(upload_sessions.abort, upload_id)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return {"message": f"Upload session {upload_id} aborted"}
+
 @app.delete("/files/{file_path:path}")
 async def delete_file(file_path: str):
     full_path = os.path.join(UPLOAD_DIR, file_path)
-    if os.path.exists(full_path):
-        # Move to recycle bin instead of permanent deletion
-        import time
-        timestamp = int(time.time())
-        recycled_name = f"{timestamp}_{os.path.basename(file_path)}"
-        recycle_path = os.path.join(RECYCLE_DIR, recycled_name)
-        
-        # Store original path info
-        metadata = {
-            "original_path": file_path,
-            "deleted_at": timestamp,
-            "original_name": os.path.basename(file_path)
-        }
-        
-        shutil.move(full_path, recycle_path)
-        
-        # Save metadata
-        metadata_path = f"{recycle_path}.meta"
-        with open(metadata_path, 'w') as f:
-            import json
-            json.dump(metadata, f)
-        
+    if await metadata_pool.run(os.path.exists, full_path):
+        # Move to recycle bin instead of permanent deletion; may copy if it's on another device
+        entry = await data_pool.run(move_to_recycle_bin, file_path)
+        await metadata_pool.run(recycle_index.add_many, [entry])
         return {"message": f"Successfully moved {file_path} to recycle bin"}
     raise HTTPException(status_code=404, detail="File not found")
 
+def archive_response(entries, name, archive_format):
+    """Stream ``entries`` ((path, arcname) pairs) as a ZIP or tar archive named ``name``."""
+    if archive_format == "zip":
+        return StreamingResponse(
+            data_pool.iterate(timed_iter("zip_stream", stream_zip(entries, ZIP_STREAM_CHUNK_SIZE))),
+            media_type='application/zip',
+            headers={'Content-Disposition': f'attachment; filename="{name}.zip"'}
+        )
+    if archive_format not in TAR_FORMATS or not tar_format_available(archive_format):
+        raise HTTPException(status_code=400, detail=f"Unsupported archive format: {archive_format}")
+    media_type, extension, compression = TAR_FORMATS[archive_format]
+    archive = stream_tar(
+        entries, compression, executor=archive_pool, parallelism=ARCHIVE_WORKERS * 2,
+        block_size=ARCHIVE_BLOCK_SIZE, read_ahead=ARCHIVE_READ_AHEAD
+    )
+    return StreamingResponse(
+        data_pool.iterate(timed_iter("tar_stream", archive)),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{name}{extension}"'}
+    )
+
 @app.get("/download/{file_path:path}")
-async def download_file(file_path: str):
+async def download_file(
+    file_path: str,
+    request: Request,
+    archive_format: str = Query("zip", alias="format", description="Folder archive format: zip, tar, tar.gz or tar.zst")
+):
     full_path = os.path.join(UPLOAD_DIR, file_path)
-    if not os.path.exists(full_path):
+    if not await metadata_pool.run(os.path.exists, full_path):
         raise HTTPException(status_code=404, detail="File or folder not found")
     
-    # If it's a file, return it directly
-    if os.path.isfile(full_path):
-        return FileResponse(full_path, filename=os.path.basename(file_path))
+    # If it's a file, return it directly (with validators and byte-range support)
+    if await metadata_pool.run(os.path.isfile, full_path):
+        return await metadata_pool.run(
+            file_response, request, full_path, filename=os.path.basename(file_path), pool=data_pool,
+            precompressed=precompressed_cache, offload=download_offload
+        )
     
-    # If it's a directory, create a ZIP file
-    elif os.path.isdir(full_path):
-        zip_buffer = io.BytesIO()
-        folder_name = os.path.basename(file_path)
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for root, dirs, files in os.walk(full_path):
-                for file in files:
-                    file_full_path = os.path.join(root, file)
-                    # Create relative path from the folder being zipped
-                    arc_name = os.path.relpath(file_full_path, full_path)
-                    zip_file.write(file_full_path, arc_name)
+    # If it's a directory, stream an archive as it is built
+    elif await metadata_pool.run(os.path.isdir, full_path):
+        folder_name = os.path.basename(file_path.rstrip("/"))
         
-        zip_buffer.seek(0)
-        return StreamingResponse(
-            io.BytesIO(zip_buffer.read()),
-            media_type='application/zip',
-            headers={'Content-Disposition': f'attachment; filename="{folder_name}.zip"'}
-        )
+        # Archive names are relative to the folder being archived
+        return archive_response(walk_files(full_path, full_path), folder_name, archive_format)
     
     raise HTTPException(status_code=404, detail="Invalid file or folder")
 
-@app.get("/files/{file_path:path}/content")
-async def get_file_content(file_path: str):
+def read_file_content(request, file_path, raw, offset, length, start_line, lines, tail):
     path = os.path.join(UPLOAD_DIR, file_path)
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail="File not found")
     
     # Add to recent files
-    add_to_recent_files(file_path, os.path.basename(file_path), "file")
+    add_to_recent_files(file_path, os.path.basename(file_path), "file", os.stat(path))
     
     mime_type, _ = mimetypes.guess_type(file_path)
     file_ext = os.path.splitext(file_path)[1].lower()
     
+    if raw:
+        return file_response(
+            request, path, media_type=mime_type, pool=data_pool, precompressed=precompressed_cache,
+            offload=download_offload
+        )
+    
     # Check if it's a text file that can be edited
     is_text = file_ext in EDITABLE_EXTENSIONS or (mime_type and mime_type.startswith('text/'))
     
     try:
-        if is_text:
-            async with aiofiles.open(path, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                return {
-                    "content": content,
-                    "type": "text",
-                    "editable": True,
-                    "mimeType": mime_type
-                }
+        if not is_text:
+            # Binary previews are fetched as raw bytes from the url instead of inline base64
+            return {
+                "type": "binary",
+                "editable": False,
+                "mimeType": mime_type,
+                "size": os.path.getsize(path),
+                "url": f"/files/{file_path}/content?raw=true"
+            }
+        
+        size = os.path.getsize(path)
+        paged = offset > 0 or length > 0 or start_line > 0 or tail > 0
+        if not paged and size > TEXT_PREVIEW_MAX_BYTES:
+            # Large files get a page instead of the whole thing; logs open at the end
+            if file_ext == '.log':
+                tail = TEXT_TAIL_LINES
+            else:
+                length = TEXT_PREVIEW_MAX_BYTES
+        
+        result = {"type": "text", "mimeType": mime_type, "size": size}
+        if tail > 0:
+            content, start, size = read_tail(path, min(tail, TEXT_MAX_LINES), TEXT_MAX_PAGE_BYTES)
+            result.update(offset=start, nextOffset=size)
+        elif start_line > 0:
+            content, start, next_offset, total_lines = line_index.read_lines(
+                path, start_line, min(lines or TEXT_DEFAULT_LINES, TEXT_MAX_LINES)
+            )
+            result.update(offset=start, nextOffset=next_offset, startLine=start_line, totalLines=total_lines)
+        elif paged or length > 0:
+            content, next_offset, size = read_window(path, offset, min(length or TEXT_PREVIEW_MAX_BYTES, TEXT_MAX_PAGE_BYTES))
+            result.update(offset=offset, nextOffset=next_offset)
         else:
-            # For binary files (images, etc), return base64 encoded content
-            async with aiofiles.open(path, 'rb') as f:
-                content = await f.read()
-                base64_content = base64.b64encode(content).decode('utf-8')
-                return {
-                    "content": base64_content,
-                    "type": "binary",
-                    "editable": False,
-                    "mimeType": mime_type
-                }
+            with open(path, 'rb') as f:
+                data = f.read()
+            content = decode_text(data)
+            # Saves send this back so a stale editor can't overwrite newer changes
+            result.update(offset=0, nextOffset=size, version=content_version(data))
+        
+        # Only a complete file can be edited, otherwise a save would drop the rest
+        truncated = result["offset"] > 0 or result["nextOffset"] < size
+        result.update(content=content, truncated=truncated, editable=not truncated)
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.put("/files/{file_path:path}/content")
-async def update_file_content(file_path: str, file_content: FileContent):
+@app.get("/files/{file_path:path}/content")
+async def get_file_content(
+    request: Request,
+    file_path: str,
+    raw: bool = Query(False, description="Stream the raw bytes instead of JSON"),
+    offset: int = Query(0, description="Byte offset to start reading text at"),
+    length: int = Query(0, description="Bytes of text to return (0 = default page size)"),
+    start_line: int = Query(0, description="First line (1-based) of a line window"),
+    lines: int = Query(0, description="Number of lines in the line window"),
+    tail: int = Query(0, description="Return only the last N lines")
+):
+    return await data_pool.run(read_file_content, request, file_path, raw, offset, length, start_line, lines, tail)
+
+def check_editable(file_path, must_exist=True):
     path = os.path.join(UPLOAD_DIR, file_path)
-    if not os.path.exists(path):
+    if must_exist and not os.path.exists(path):
         raise HTTPException(status_code=404, detail="File not found")
     
     file_ext = os.path.splitext(file_path)[1].lower()
     if file_ext not in EDITABLE_EXTENSIONS:
         raise HTTPException(status_code=400, detail="File type not editable")
+    return path
+
+# Saves re-check and replace the file in one step; edits are rare enough to serialize that step
+save_lock = threading.Lock()
+
+def read_for_save(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        # Only restores get here: bringing back a file that was deleted
+        return None
+
+def save_text(file_path, path, base_version, edit, source="save"):
+    """Write ``edit(current bytes)`` to ``path`` atomically, if ``base_version`` still matches.
+    
+    Both the replaced and the new content go into the version history. The edit and
+    the version deltas are computed before taking save_lock; under the lock the file
+    is re-read, and if another save changed it in the meantime the work is redone.
+    """
+    while True:
+        data = read_for_save(path)
+        if base_version is not None and content_version(data or b"") != base_version:
+            raise HTTPException(status_code=409, detail={
+                "message": "File has changed since it was loaded",
+                "version": content_version(data or b"")
+            })
+        new_data = edit(data)
+        old_version = version_store.prepare(file_path, data) if data is not None else None
+        new_version = version_store.prepare(file_path, new_data, after=old_version)
+        with save_lock:
+            if read_for_save(path) != data:
+                continue
+            if data is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            else:
+                version_store.record(file_path, data, prepared=old_version)
+            atomic_write(path, new_data)
+            version_store.record(file_path, new_data, source, prepared=new_version)
+        break
+    on_path_added(file_path, len(data or b""))
+    return {
+        "message": f"Successfully updated {os.path.basename(file_path)}",
+        "size": len(new_data),
+        "version": content_version(new_data)
+    }
+
+@app.put("/files/{file_path:path}/content")
+async def update_file_content(file_path: str, file_content: FileContent):
+    """Replace the whole file; the fallback when the editor has no version to patch against"""
+    path = await metadata_pool.run(check_editable, file_path)
+    
+    try:
+        return await data_pool.run(
+            save_text, file_path, path, file_content.base_version, lambda data: file_content.content.encode('utf-8')
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.patch("/files/{file_path:path}/content")
+async def patch_file_content(file_path: str, file_patch: FilePatch):
+    """Apply a unified diff to the version of the file the editor loaded"""
+    path = await metadata_pool.run(check_editable, file_path)
+    
+    def edit(data):
+        try:
+            return apply_patch(decode_text(data), file_patch.patch).encode('utf-8')
+        except PatchError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    
+    try:
+        return await data_pool.run(save_text, file_path, path, file_patch.base_version, edit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def load_version(file_path, version_id):
+    found = version_store.get(file_path, version_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return found
+
+@app.get("/files/{file_path:path}/versions")
+async def list_versions(file_path: str):
+    """Saved versions of a file, newest first"""
+    def versions():
+        items = version_store.list(file_path)
+        path = os.path.join(UPLOAD_DIR, file_path)
+        current = None
+        if items and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                current = content_version(f.read())
+        for item in items:
+            item["current"] = item["version"] == current
+        return items
+    
+    return {"path": normalize_path(file_path), "versions": await data_pool.run(versions)}
+
+@app.get("/files/{file_path:path}/versions/{version_id}/diff")
+async def diff_version(
+    file_path: str,
+    version_id: int,
+    against: str = Query("current", description="Version id to compare with, or 'current' for the file on disk"),
+    context: int = Query(3, description="Unchanged lines shown around each change")
+):
+    """Unified diff from a saved version to another version or the current file"""
+    def diff():
+        info, data = load_version(file_path, version_id)
+        if against == "current":
+            path = os.path.join(UPLOAD_DIR, file_path)
+            if not os.path.isfile(path):
+                raise HTTPException(status_code=404, detail="File not found")
+            with open(path, 'rb') as f:
+                other = f.read()
+            other_label = "current"
+        else:
+            try:
+                other_info, other = load_version(file_path, int(against))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="against must be a version id or 'current'")
+            other_label = f"version {other_info['id']}"
+        try:
+            lines = difflib.unified_diff(
+                decode_text(data).splitlines(keepends=True), decode_text(other).splitlines(keepends=True),
+                f"version {info['id']}", other_label, n=max(context, 0)
+            )
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="Version is not UTF-8 text")
+        return {"from": info, "to": against, "diff": "".join(lines)}
+    
+    return await data_pool.run(diff)
+
+@app.post("/files/{file_path:path}/versions/{version_id}/restore")
+async def restore_version(file_path: str, version_id: int):
+    """Make a saved version the current content again; recorded as a new version"""
+    path = await metadata_pool.run(check_editable, file_path, False)
+    info, data = await data_pool.run(load_version, file_path, version_id)
     
     try:
-        async with aiofiles.open(path, 'w', encoding='utf-8') as f:
-            await f.write(file_content.content)
-        return {"message": f"Successfully updated {filename}"}
+        result = await data_pool.run(save_text, file_path, path, None, lambda current: data, "restore")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    result["message"] = f"Restored version {info['id']} of {os.path.basename(file_path)}"
+    return result
 
 # New endpoints for enhanced functionality
 
 @app.post("/folders")
 async def create_folder(folder: CreateFolder):
     folder_path = os.path.join(UPLOAD_DIR, folder.path.strip("/"), folder.name)
-    if os.path.exists(folder_path):
+    if await metadata_pool.run(os.path.exists, folder_path):
         raise HTTPException(status_code=400, detail="Folder already exists")
     try:
-        os.makedirs(folder_path)
+        await metadata_pool.run(os.makedirs, folder_path)
+        await metadata_pool.run(on_path_added, os.path.join(folder.path, folder.name))
         return {"message": f"Successfully created folder {folder.name}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/files/bulk-delete")
 async def bulk_delete(bulk: BulkDelete):
-    deleted = []
-    errors = []
-    
-    for file_path in bulk.files:
-        full_path = os.path.join(UPLOAD_DIR, file_path.strip("/"))
-        try:
-            if os.path.exists(full_path):
-                # Move to recycle bin instead of permanent deletion
-                import time
-                timestamp = int(time.time())
-                recycled_name = f"{timestamp}_{os.path.basename(file_path.strip('/'))}"
-                recycle_path = os.path.join(RECYCLE_DIR, recycled_name)
-                
-                # Store original path info
-                metadata = {
-                    "original_path": file_path.strip("/"),
-                    "deleted_at": timestamp,
-                    "original_name": os.path.basename(file_path.strip("/"))
-                }
-                
-                shutil.move(full_path, recycle_path)
-                
-                # Save metadata
-                metadata_path = f"{recycle_path}.meta"
-                with open(metadata_path, 'w') as f:
-                    import json
-                    json.dump(metadata, f)
-                
-                deleted.append(file_path)
-        except Exception as e:
-            errors.append({"file": file_path, "error": str(e)})
+    # Runs as a delete job so the event loop stays free; the response waits for it
+    job = await metadata_pool.run(submit_file_job, "delete", bulk.files)
+    result = await asyncio.wrap_future(job.future)
     
     return {
-        "deleted": deleted,
-        "errors": errors,
-        "message": f"Moved {len(deleted)} items to recycle bin"
+        "deleted": result["processed"],
+        "errors": result["errors"],
+        "job_id": job.id,
+        "message": f"Moved {len(result['processed'])} items to recycle bin"
     }
 
 @app.post("/files/operation")
 async def file_operation(operation: FileOperation):
-    results = []
-    errors = []
+    if operation.operation not in ("copy", "move"):
+        raise HTTPException(status_code=400, detail=f"Unknown operation: {operation.operation}")
+    # Runs as a job so the event loop stays free; the response waits for it
+    job = await metadata_pool.run(submit_file_job, operation.operation, operation.files, operation.destination)
+    result = await asyncio.wrap_future(job.future)
+    
+    return {
+        "processed": result["processed"],
+        "errors": result["errors"],
+        "job_id": job.id,
+        "message": f"{operation.operation.capitalize()}d {len(result['processed'])} items"
+    }
+
+# Background Job Endpoints
+@app.post("/jobs", status_code=202)
+async def create_job(file_job: FileJob):
+    """Start a copy, move or delete job and return immediately"""
+    job = await metadata_pool.run(submit_file_job, file_job.operation, file_job.files, file_job.destination)
+    return job.snapshot()
+
+@app.get("/jobs")
+async def list_jobs():
+    return {"jobs": jobs.list()}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.snapshot()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent progress events until the job finishes"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
     
-    dest_path = os.path.join(UPLOAD_DIR, operation.destination.strip("/"))
-    os.makedirs(dest_path, exist_ok=True)
+    async def events():
+        last = None
+        while True:
+            done = job.future.done()
+            snapshot = job.snapshot()
+            # elapsed and eta move on every tick; only send when the work itself moved
+            state = (snapshot["state"], snapshot["bytes_done"], snapshot["files_done"], len(snapshot["errors"]))
+            if state != last:
+                last = state
+                yield f"event: progress\ndata: {json.dumps(snapshot)}\n\n"
+            if done:
+                break
+            await asyncio.sleep(JOB_EVENT_INTERVAL)
     
-    for file_path in operation.files:
-        src_path = os.path.join(UPLOAD_DIR, file_path.strip("/"))
-        filename = os.path.basename(file_path)
-        dst_path = os.path.join(dest_path, filename)
-        
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/events")
+async def change_events(path: List[str] = Query([""], description="Folders to watch (repeatable)")):
+    """Server-sent listing deltas for the given folders.
+    
+    A "ready" event comes first; load /files after it and apply each "change" event
+    (added/modified entries, removed names) to that listing. "resync" means events were
+    dropped and the listing should be loaded again.
+    """
+    try:
+        subscription = await metadata_pool.run(change_feed.subscribe, path, asyncio.get_running_loop())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def events():
         try:
-            if operation.operation == "copy":
-                if os.path.isdir(src_path):
-                    shutil.copytree(src_path, dst_path)
-                else:
-                    shutil.copy2(src_path, dst_path)
-            elif operation.operation == "move":
-                shutil.move(src_path, dst_path)
-            results.append(file_path)
-        except Exception as e:
-            errors.append({"file": file_path, "error": str(e)})
+            yield f"event: ready\ndata: {json.dumps({'paths': subscription.paths, 'mode': change_feed.mode})}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), CHANGE_FEED_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            change_feed.unsubscribe(subscription)
     
-    return {
-        "processed": results,
-        "errors": errors,
-        "message": f"{operation.operation.capitalize()}d {len(results)} items"
-    }
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.snapshot()
+
+# Duplicate Finder Endpoints
+@app.get("/duplicates")
+async def find_duplicates(
+    path: str = Query("", description="Folder to search for duplicates"),
+    min_size: int = Query(1, description="Ignore files smaller than this many bytes")
+):
+    """Groups of identical files as NDJSON, largest files first, then a summary line"""
+    folder_path = os.path.join(UPLOAD_DIR, path.strip("/"))
+    if not await metadata_pool.run(os.path.isdir, folder_path):
+        raise HTTPException(status_code=404, detail="Folder not found")
+    
+    def generate():
+        for group in duplicate_finder.find(path, min_size):
+            yield json.dumps(group) + "\n"
+    
+    return StreamingResponse(data_pool.iterate(generate()), media_type="application/x-ndjson")
+
+@app.post("/duplicates/link")
+async def link_duplicates(link: LinkDuplicates):
+    """Replace duplicates of the first file with hardlinks or reflinks to it.
+
+    Hardlinked files share one inode, so editing one changes all of them; reflinks
+    share storage only until one copy is written to.
+    """
+    if link.mode not in ("hardlink", "reflink"):
+        raise HTTPException(status_code=400, detail=f"Unknown mode: {link.mode}")
+    if len(link.files) < 2:
+        raise HTTPException(status_code=400, detail="Need the file to keep and at least one duplicate")
+    
+    def deduplicate():
+        keep_path = os.path.join(UPLOAD_DIR, link.files[0].strip("/"))
+        if not os.path.isfile(keep_path):
+            raise HTTPException(status_code=404, detail="File not found")
+        keep_stats = os.stat(keep_path)
+        keep_hash = None
+        linked = []
+        errors = []
+        reclaimed = 0
+        
+        for file_path in link.files[1:]:
+            full_path = os.path.join(UPLOAD_DIR, file_path.strip("/"))
+            try:
+                stats = os.stat(full_path)
+                if (stats.st_dev, stats.st_ino) == (keep_stats.st_dev, keep_stats.st_ino):
+                    continue
+                # Never trust the caller: only byte-identical files get replaced
+                if stats.st_size != keep_stats.st_size:
+                    raise ValueError("Size differs from the kept file")
+                if keep_hash is None:
+                    keep_hash = full_hash(keep_path)
+                if full_hash(full_path) != keep_hash:
+                    raise ValueError("Content differs from the kept file")
+                link_file(keep_path, full_path, link.mode)
+                on_path_added(file_path, stats.st_size)
+                linked.append(file_path)
+                reclaimed += stats.st_size
+            except Exception as e:
+                errors.append({"file": file_path, "error": str(e)})
+        
+        return {
+            "kept": link.files[0],
+            "linked": linked,
+            "errors": errors,
+            "reclaimed": reclaimed,
+            "message": f"Linked {len(linked)} duplicates"
+        }
+    
+    return await data_pool.run(deduplicate)
+
+@app.get("/stats/fs")
+async def filesystem_pool_stats():
+    """Queue depth and activity of the filesystem thread pools, and listing cache hit rates"""
+    return {"metadata": metadata_pool.stats(), "data": data_pool.stats(), "listing_cache": listing_cache.stats()}
+
+@app.get("/stats/storage")
+async def storage_stats(
+    path: str = Query("", description="Folder to build the treemap for"),
+    top: int = Query(10, description="Entries in the largest files, folders and extensions lists"),
+    depth: int = Query(1, description="Treemap levels below the folder")
+):
+    """Storage usage by file type, extension and age, the largest files and folders, and a folder treemap"""
+    top = min(max(top, 0), STORAGE_ANALYTICS_MAX_TOP)
+    depth = min(max(depth, 0), STORAGE_ANALYTICS_MAX_DEPTH)
+    summary = await metadata_pool.run(storage_analytics.summary, path, top, depth)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Folder not found")
+    return summary
+
+@app.get("/metrics")
+async def metrics():
+    """Request, hot-spot and pool metrics in the Prometheus text format"""
+    return Response(REGISTRY.render(), media_type=REGISTRY.content_type)
 
 @app.get("/files/download-multiple")
-async def download_multiple(files: str = Query(..., description="Comma-separated file paths")):
+async def download_multiple(
+    files: str = Query(..., description="Comma-separated file paths"),
+    archive_format: str = Query("zip", alias="format", description="Archive format: zip, tar, tar.gz or tar.zst")
+):
     file_paths = [f.strip() for f in files.split(",")]
     
-    # Create a zip file in memory
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+    def entries():
         for file_path in file_paths:
             full_path = os.path.join(UPLOAD_DIR, file_path.strip("/"))
             if os.path.exists(full_path):
                 if os.path.isdir(full_path):
                     # Add directory recursively
-                    for root, dirs, files in os.walk(full_path):
-                        for file in files:
-                            file_full_path = os.path.join(root, file)
-                            arc_name = os.path.relpath(file_full_path, UPLOAD_DIR)
-                            zip_file.write(file_full_path, arc_name)
+                    yield from walk_files(full_path, UPLOAD_DIR)
                 else:
                     # Add single file
-                    arc_name = os.path.relpath(full_path, UPLOAD_DIR)
-                    zip_file.write(full_path, arc_name)
+                    yield full_path, os.path.relpath(full_path, UPLOAD_DIR)
     
-    zip_buffer.seek(0)
-    return StreamingResponse(
-        zip_buffer,
-        media_type='application/zip',
-        headers={'Content-Disposition': 'attachment; filename="files.zip"'}
-    )
+    # Stream the archive as it is built instead of assembling it in memory
+    return archive_response(entries(), "files", archive_format)
 
 @app.get("/files/{file_path:path}/thumbnail")
-async def get_thumbnail(file_path: str, size: int = Query(200, description="Thumbnail size")):
+async def get_thumbnail(request: Request, file_path: str, size: int = Query(200, description="Thumbnail size")):
     full_path = os.path.join(UPLOAD_DIR, file_path)
-    if not os.path.exists(full_path):
+    if not await metadata_pool.run(os.path.exists, full_path):
         raise HTTPException(status_code=404, detail="File not found")
     
     ext = os.path.splitext(file_path)[1].lower()
     if ext not in IMAGE_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Not an image file")
     
-    # For now, return the original image
-    # In production, you'd want to use PIL/Pillow to create actual thumbnails
-    return FileResponse(full_path, media_type=f"image/{ext[1:]}")
+    # Vector images, or no Pillow installed: the original is the best we can do
+    if not thumbnail_cache.available or ext in PASSTHROUGH_EXTENSIONS:
+        return await metadata_pool.run(file_response, request, full_path, pool=data_pool)
+    
+    size = min(max(size, THUMBNAIL_MIN_SIZE), THUMBNAIL_MAX_SIZE)
+    try:
+        thumbnail_path = await thumbnail_cache.get(full_path, size)
+    except Exception:
+        # Pillow can't decode this file; serve it unchanged rather than failing the grid
+        return await metadata_pool.run(file_response, request, full_path, pool=data_pool)
+    return await metadata_pool.run(
+        file_response, request, thumbnail_path, media_type=thumbnail_cache.media_type, pool=data_pool
+    )
+
+@app.post("/thumbnails/batch")
+async def generate_thumbnails(
+    path: str = Query("", description="Folder whose images should get thumbnails"),
+    size: int = Query(200, description="Thumbnail size")
+):
+    """Pre-generate thumbnails for every image directly inside a folder"""
+    folder_path = os.path.join(UPLOAD_DIR, path.strip("/"))
+    if not await metadata_pool.run(os.path.isdir, folder_path):
+        raise HTTPException(status_code=404, detail="Folder not found")
+    if not thumbnail_cache.available:
+        raise HTTPException(status_code=501, detail="Thumbnail generation requires Pillow")
+    
+    def find_images():
+        images = []
+        for entry in os.scandir(folder_path):
+            ext = os.path.splitext(entry.name)[1].lower()
+            if entry.is_file() and ext in IMAGE_EXTENSIONS and ext not in PASSTHROUGH_EXTENSIONS:
+                images.append(entry.path)
+        return images
+    
+    size = min(max(size, THUMBNAIL_MIN_SIZE), THUMBNAIL_MAX_SIZE)
+    images = await metadata_pool.run(find_images)
+    
+    results = await asyncio.gather(*(thumbnail_cache.get(image, size) for image in images), return_exceptions=True)
+    errors = [
+        {"file": os.path.relpath(image, UPLOAD_DIR), "error": str(result)}
+        for image, result in zip(images, results) if isinstance(result, Exception)
+    ]
+    return {
+        "generated": len(images) - len(errors),
+        "errors": errors,
+        "cache": thumbnail_cache.stats()
+    }
 
 # Recycle Bin Endpoints
 @app.get("/recycle-bin")
-async def list_recycle_bin():
-    """List all files in recycle bin"""
+async def list_recycle_bin(
+    sort_by: str = Query("deleted_at", description="Sort by: deleted_at, name, size"),
+    sort_order: str = Query("desc", description="Sort order: asc, desc"),
+    limit: int = Query(0, ge=0),
+    offset: int = Query(0, ge=0)
+):
+    """List files in recycle bin, a page at a time when limit is given"""
     try:
-        recycled_items = []
-        for item in os.listdir(RECYCLE_DIR):
-            if item.endswith('.meta'):
-                continue
-                
-            item_path = os.path.join(RECYCLE_DIR, item)
-            meta_path = f"{item_path}.meta"
-            
-            if os.path.exists(meta_path):
-                with open(meta_path, 'r') as f:
-                    import json
-                    metadata = json.load(f)
-                
-                stats = os.stat(item_path)
-                recycled_items.append({
-                    "recycled_name": item,
-                    "original_name": metadata["original_name"],
-                    "original_path": metadata["original_path"],
-                    "deleted_at": metadata["deleted_at"],
-                    "size": stats.st_size,
-                    "type": "directory" if os.path.isdir(item_path) else "file"
-                })
-        
-        # Sort by deletion time (newest first)
-        recycled_items.sort(key=lambda x: x["deleted_at"], reverse=True)
-        return {"items": recycled_items}
+        items, total, total_size = await metadata_pool.run(recycle_index.list, sort_by, sort_order, limit, offset)
+        return {
+            "items": items,
+            "total": total,
+            "total_size": total_size,
+            "limit": limit,
+            "offset": offset
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/recycle-bin/restore")
 async def restore_files(restore_data: RestoreFiles):
     """Restore files from recycle bin"""
-    restored = []
-    errors = []
+    def restore():
+        restored = []
+        errors = []
+        finished = []
+        
+        entries = recycle_index.get_many(restore_data.files)
+        try:
+            for recycled_name in restore_data.files:
+                try:
+                    metadata = entries.get(recycled_name)
+                    recycle_path = os.path.join(RECYCLE_DIR, recycled_name)
+                    
+                    if metadata is None or not os.path.lexists(recycle_path):
+                        if metadata is not None:
+                            # The item vanished from disk; drop its stale entry
+                            finished.append(recycled_name)
+                        errors.append({"file": recycled_name, "error": "File not found in recycle bin"})
+                        continue
+                    
+                    # Restore to original location
+                    original_path = os.path.join(UPLOAD_DIR, metadata["original_path"])
+                    original_dir = os.path.dirname(original_path)
+                    
+                    # Create directories if they don't exist
+                    if original_dir:
+                        os.makedirs(original_dir, exist_ok=True)
+                    
+                    # Check if file already exists at original location
+                    if os.path.exists(original_path):
+                        # Add timestamp to avoid conflicts
+                        base, ext = os.path.splitext(original_path)
+                        timestamp = int(time.time())
+                        original_path = f"{base}_restored_{timestamp}{ext}"
+                    
+                    shutil.move(recycle_path, original_path)
+                    finished.append(recycled_name)
+                    on_path_added(os.path.relpath(original_path, UPLOAD_DIR))
+                    
+                    restored.append({
+                        "recycled_name": recycled_name,
+                        "restored_to": os.path.relpath(original_path, UPLOAD_DIR)
+                    })
+                    
+                except Exception as e:
+                    errors.append({"file": recycled_name, "error": str(e)})
+        finally:
+            recycle_index.remove_many(finished)
+        
+        return {
+            "restored": restored,
+            "errors": errors,
+            "message": f"Restored {len(restored)} items"
+        }
     
-    for recycled_name in restore_data.files:
+    # Moving items back may copy them across devices
+    return await data_pool.run(restore)
+
+@app.post("/recycle-bin/purge")
+async def purge_files(purge: PurgeFiles):
+    """Permanently delete several files from recycle bin"""
+    def purge_items():
+        purged = []
+        errors = []
+        
+        entries = recycle_index.get_many(purge.files)
         try:
-            recycle_path = os.path.join(RECYCLE_DIR, recycled_name)
-            meta_path = f"{recycle_path}.meta"
-            
-            if not os.path.exists(recycle_path) or not os.path.exists(meta_path):
-                errors.append({"file": recycled_name, "error": "File not found in recycle bin"})
-                continue
-            
-            with open(meta_path, 'r') as f:
-                import json
-                metadata = json.load(f)
-            
-            # Restore to original location
-            original_path = os.path.join(UPLOAD_DIR, metadata["original_path"])
-            original_dir = os.path.dirname(original_path)
-            
-            # Create directories if they don't exist
-            if original_dir:
-                os.makedirs(original_dir, exist_ok=True)
-            
-            # Check if file already exists at original location
-            if os.path.exists(original_path):
-                # Add timestamp to avoid conflicts
-                base, ext = os.path.splitext(original_path)
-                import time
-                timestamp = int(time.time())
-                original_path = f"{base}_restored_{timestamp}{ext}"
-            
-            shutil.move(recycle_path, original_path)
-            os.remove(meta_path)  # Remove metadata file
-            
-            restored.append({
-                "recycled_name": recycled_name,
-                "restored_to": os.path.relpath(original_path, UPLOAD_DIR)
-            })
-            
-        except Exception as e:
-            errors.append({"file": recycled_name, "error": str(e)})
+            for recycled_name in purge.files:
+                if recycled_name not in entries:
+                    errors.append({"file": recycled_name, "error": "File not found in recycle bin"})
+                    continue
+                try:
+                    remove_recycled(recycled_name)
+                    purged.append(recycled_name)
+                except Exception as e:
+                    errors.append({"file": recycled_name, "error": str(e)})
+        finally:
+            recycle_index.remove_many(purged)
+        
+        return {
+            "purged": purged,
+            "errors": errors,
+            "message": f"Permanently deleted {len(purged)} items"
+        }
     
-    return {
-        "restored": restored,
-        "errors": errors,
-        "message": f"Restored {len(restored)} items"
-    }
+    return await metadata_pool.run(purge_items)
 
 @app.delete("/recycle-bin/empty")
 async def empty_recycle_bin():
     """Permanently delete all files in recycle bin"""
-    try:
+    def empty():
         deleted_count = 0
         for item in os.listdir(RECYCLE_DIR):
-            item_path = os.path.join(RECYCLE_DIR, item)
-            if os.path.isdir(item_path):
-                shutil.rmtree(item_path)
-            else:
-                os.remove(item_path)
+            remove_recycled(item)
             deleted_count += 1
-        
+        recycle_index.clear()
+        return deleted_count
+    
+    try:
+        deleted_count = await metadata_pool.run(empty)
         return {"message": f"Permanently deleted {deleted_count} items from recycle bin"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -745,21 +1785,15 @@ async def empty_recycle_bin():
 async def permanently_delete(recycled_name: str):
     """Permanently delete a specific file from recycle bin"""
     try:
-        recycle_path = os.path.join(RECYCLE_DIR, recycled_name)
-        meta_path = f"{recycle_path}.meta"
-        
-        if not os.path.exists(recycle_path):
+        if not await metadata_pool.run(recycle_index.get_many, [recycled_name]):
             raise HTTPException(status_code=404, detail="File not found in recycle bin")
         
-        if os.path.isdir(recycle_path):
-            shutil.rmtree(recycle_path)
-        else:
-            os.remove(recycle_path)
-        
-        if os.path.exists(meta_path):
-            os.remove(meta_path)
+        await metadata_pool.run(remove_recycled, recycled_name)
+        await metadata_pool.run(recycle_index.remove_many, [recycled_name])
         
         return {"message": f"Permanently deleted {recycled_name}"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -767,34 +1801,21 @@ async def permanently_delete(recycled_name: str):
 @app.get("/recent-files")
 async def get_recent_files():
     """Get list of recently accessed files"""
-    try:
-        recent_files = load_recent_files()
-        
-        # Filter out files that no longer exist
+    # Served from memory; the existence check catches files removed outside the API
+    def existing():
         valid_files = []
-        for file_info in recent_files:
-            file_path = os.path.join(UPLOAD_DIR, file_info['path'])
-            if os.path.exists(file_path):
-                # Add current file stats
-                stats = os.stat(file_path)
-                file_info['size'] = stats.st_size
-                file_info['modified'] = stats.st_mtime
+        for file_info in recent_files.list():
+            if os.path.exists(os.path.join(UPLOAD_DIR, file_info['path'])):
                 file_info['exists'] = True
                 valid_files.append(file_info)
-        
-        # Update the recent files list to remove non-existent files
-        if len(valid_files) != len(recent_files):
-            save_recent_files(valid_files)
-        
-        return {"recent_files": valid_files}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+            else:
+                recent_files.remove(file_info['path'])
+        return valid_files
+
+    return {"recent_files": await metadata_pool.run(existing)}
 
 @app.delete("/recent-files")
 async def clear_recent_files():
     """Clear all recent files history"""
-    try:
-        save_recent_files([])
-        return {"message": "Recent files history cleared"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+    recent_files.clear()
+    return {"message": "Recent files history cleared"}
@@ -0,0 +1,339 @@
+import time
+import logging
+import threading
+import contextlib
+import contextvars
+
+# Seconds; spans everything from a cached stat to a multi-GB ZIP
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Bytes, powers of four from 1 KiB to 16 GiB
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(13))
+
+PREFIX = "filemanager"
+
+logger = logging.getLogger("filemanager.slow_requests")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (made cumulative when rendered), then sum and count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+        lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Metrics plus collector callbacks, rendered in the Prometheus text format (0.0.4)."""
+
+    # Starlette appends "; charset=utf-8" to text responses
+    content_type = "text/plain; version=0.0.4"
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(f"{PREFIX}_{name}", documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(f"{PREFIX}_{name}", documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(f"{PREFIX}_{name}", documentation, labelnames, buckets))
+
+    def collector(self, collect):
+        """Register ``collect()``, returning fresh gauges at scrape time.
+
+        It yields (name, documentation, labelnames, [(label values, value), ...]).
+        """
+        self._collectors.append(collect)
+        return collect
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, documentation, labelnames, samples in collect():
+                gauge = Gauge(f"{PREFIX}_{name}", documentation, labelnames)
+                for values, value in samples:
+                    gauge.set(value, **dict(zip(labelnames, values)))
+                lines.extend(gauge.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+http_requests = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by route and status.", ("method", "route", "status")
+)
+http_duration = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time from request start to the last response byte.", ("method", "route")
+)
+http_response_size = REGISTRY.histogram(
+    "http_response_size_bytes", "Response body size.", ("method", "route"), SIZE_BUCKETS
+)
+http_in_progress = REGISTRY.gauge(
+    "http_requests_in_progress", "Requests currently being handled.", ("method",)
+)
+operation_duration = REGISTRY.histogram(
+    "operation_duration_seconds", "Time spent in internal hot spots.", ("operation",)
+)
+operation_bytes = REGISTRY.counter(
+    "operation_bytes_total", "Bytes produced by streamed internal operations.", ("operation",)
+)
+
+
+# Per-request phase breakdown for the slow-request log
+
+class RequestPhases:
+    """Seconds and call counts per phase for one request; filled from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.totals.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def summary(self):
+        with self._lock:
+            items = sorted(self.totals.items(), key=lambda item: item[1][0], reverse=True)
+        return " ".join(
+            f"{name}={seconds:.3f}s" + (f"(x{count})" if count > 1 else "")
+            for name, (seconds, count) in items
+        )
+
+
+_current_phases = contextvars.ContextVar("request_phases", default=None)
+
+
+def current_phases():
+    """Phases of the request being handled in this context, or None outside a request."""
+    return _current_phases.get()
+
+
+class timed(contextlib.ContextDecorator):
+    """Time a hot spot into ``operation_duration_seconds`` and the current request's phases.
+
+    Works as ``with timed("name"):`` or as a ``@timed("name")`` decorator.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self._started = threading.local()
+
+    def __enter__(self):
+        stack = getattr(self._started, "stack", None)
+        if stack is None:
+            stack = self._started.stack = []
+        stack.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._started.stack.pop()
+        operation_duration.observe(seconds, operation=self.operation)
+        phases = current_phases()
+        if phases is not None:
+            phases.add(self.operation, seconds)
+        return False
+
+
+def timed_iter(operation, iterator):
+    """Pass ``iterator`` through, timing the work done between items and counting bytes.
+
+    For generators such as ZIP streams, where the work happens lazily while the
+    response body is sent. The total is recorded once the iterator is exhausted or closed.
+    """
+    iterator = iter(iterator)
+    seconds = 0.0
+    produced = 0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                seconds += time.perf_counter() - started
+                return
+            seconds += time.perf_counter() - started
+            produced += len(item)
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+        operation_duration.observe(seconds, operation=operation)
+        operation_bytes.inc(produced, operation=operation)
+        phases = current_phases()
+        if phases is not None:
+            phases.add(operation, seconds)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, response size and in-flight requests.
+
+    Routes are labelled by their template (``/download/{file_path:path}``), never
+    the raw URL, to keep label cardinality bounded. When ``slow_request_seconds``
+    is set, slower requests are logged with their phase breakdown: time to the
+    response headers, time streaming the body, and every ``timed`` hot spot and
+    pool wait that ran on their behalf.
+    """
+
+    def __init__(self, app, slow_request_seconds=0):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        phases = RequestPhases()
+        token = _current_phases.set(phases)
+        started = time.perf_counter()
+        headers_at = None
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal headers_at, status, size
+            if message["type"] == "http.response.start":
+                headers_at = time.perf_counter()
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopy":
+                size += message.get("count", 0)
+            await send(message)
+
+        http_in_progress.inc(method=method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finished = time.perf_counter()
+            duration = finished - started
+            http_in_progress.dec(method=method)
+            # FastAPI stores the matched route in the scope; unmatched URLs share one label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_requests.inc(method=method, route=route, status=status)
+            http_duration.observe(duration, method=method, route=route)
+            http_response_size.observe(size, method=method, route=route)
+            _current_phases.reset(token)
+
+            if self.slow_request_seconds and duration >= self.slow_request_seconds:
+                if headers_at is not None:
+                    phases.add("headers", headers_at - started)
+                    phases.add("body", finished - headers_at)
+                path = scope.get("path", "")
+                query = scope.get("query_string", b"").decode("latin-1")
+                logger.warning(
+                    "Slow request: %s %s%s -> %s in %.3fs (%d bytes) %s",
+                    method, path, f"?{query}" if query else "", status, duration, size, phases.summary()
+                )
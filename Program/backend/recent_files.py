@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from metrics import timed
+
+
+class RecentFiles:
+    """Recently viewed files, kept in memory and snapshotted to disk in the background.
+
+    The in-memory OrderedDict (most recent last) is authoritative: recording an
+    access and listing are pure memory operations. Changes mark the store dirty and
+    a flusher thread writes an atomic JSON snapshot at most every ``flush_interval``
+    seconds, plus once more on shutdown.
+    """
+
+    def __init__(self, db_path, limit, flush_interval):
+        self.db_path = db_path
+        self.limit = limit
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def load(self):
+        try:
+            with open(self.db_path, 'r') as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            records = []
+        with self._lock:
+            self._entries.clear()
+            # The snapshot is stored newest first
+            for record in reversed(records[:self.limit]):
+                if isinstance(record, dict) and 'path' in record:
+                    self._entries[record['path']] = record
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name="recent-files-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._dirty.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._dirty.wait()
+            # Debounce: collect further changes for a moment before writing
+            self._stopped.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write the current list atomically if it changed since the last write."""
+        with self._lock:
+            if not self._dirty.is_set():
+                return
+            self._dirty.clear()
+            records = list(reversed(self._entries.values()))
+        tmp_path = f"{self.db_path}.tmp"
+        try:
+            with timed("recent_files_flush"):
+                with open(tmp_path, 'w') as f:
+                    json.dump(records, f)
+                os.replace(tmp_path, self.db_path)
+        except OSError:
+            self._dirty.set()
+
+    def add(self, path, name, file_type, size=None, modified=None):
+        with self._lock:
+            self._entries.pop(path, None)
+            self._entries[path] = {
+                'path': path,
+                'name': name,
+                'type': file_type,
+                'accessed_at': int(time.time()),
+                'size': size,
+                'modified': modified
+            }
+            while len(self._entries) > self.limit:
+                self._entries.popitem(last=False)
+            self._dirty.set()
+
+    def list(self):
+        with self._lock:
+            return [dict(record) for record in reversed(self._entries.values())]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty.set()
+
+    # Mutation hooks keep paths and stats current without re-reading each entry
+
+    def update_stats(self, path, size, modified):
+        with self._lock:
+            record = self._entries.get(path)
+            if record is not None:
+                record['size'] = size
+                record['modified'] = modified
+                self._dirty.set()
+
+    def remove(self, path):
+        """Forget ``path`` and anything below it."""
+        prefix = f"{path}/"
+        with self._lock:
+            gone = [p for p in self._entries if p == path or p.startswith(prefix)]
+            for p in gone:
+                del self._entries[p]
+            if gone:
+                self._dirty.set()
+
+    def move(self, src, dst):
+        prefix = f"{src}/"
+        with self._lock:
+            if not any(p == src or p.startswith(prefix) for p in self._entries):
+                return
+            # Rebuild to keep the access order while renaming keys
+            renamed = OrderedDict()
+            for p, record in self._entries.items():
+                if p == src or p.startswith(prefix):
+                    p = dst + p[len(src):]
+                    record = dict(record, path=p, name=os.path.basename(p))
+                renamed[p] = record
+            self._entries = renamed
+            self._dirty.set()
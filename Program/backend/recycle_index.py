@@ -0,0 +1,172 @@
+import os
+import re
+import json
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger("filemanager.recycle_index")
+
+# "<timestamp>_<name>"; a same-second collision's extra "<n>_" is kept, as names may start with digits
+RECYCLED_NAME = re.compile(r"^(\d+)_(.+)$")
+SORT_COLUMNS = {"deleted_at": "deleted_at", "name": "original_name COLLATE NOCASE", "size": "size"}
+
+
+class RecycleIndex:
+    """All recycle bin entries in one SQLite table.
+
+    Replaces the per-item ``.meta`` files: listing is a single indexed query and
+    bulk deletes, restores and purges are one transaction each.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS recycled (
+                recycled_name TEXT PRIMARY KEY,
+                original_path TEXT NOT NULL,
+                original_name TEXT NOT NULL,
+                deleted_at INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                type TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS recycled_deleted_at ON recycled (deleted_at);
+            CREATE INDEX IF NOT EXISTS recycled_size ON recycled (size);
+        """)
+        self._conn.commit()
+
+    def migrate_meta_files(self, recycle_dir, size_of):
+        """Import ``.meta`` files written by older versions, then delete them.
+
+        ``size_of`` computes the recursive size of a recycled item, which the old
+        listing got wrong for directories.
+        """
+        items = []
+        meta_paths = []
+        for name in os.listdir(recycle_dir):
+            if not name.endswith('.meta'):
+                continue
+            meta_path = os.path.join(recycle_dir, name)
+            item_path = meta_path[:-len('.meta')]
+            try:
+                with open(meta_path, 'r') as f:
+                    metadata = json.load(f)
+            except OSError:
+                continue
+            except ValueError:
+                logger.warning("Skipping unreadable recycle bin metadata %s", meta_path)
+                continue
+            if not os.path.exists(item_path):
+                meta_paths.append(meta_path)
+                continue
+            try:
+                item = {
+                    "recycled_name": os.path.basename(item_path),
+                    "original_path": metadata["original_path"],
+                    "original_name": metadata["original_name"],
+                    "deleted_at": int(metadata["deleted_at"]),
+                    "size": size_of(item_path),
+                    "type": "directory" if os.path.isdir(item_path) else "file"
+                }
+            except (KeyError, TypeError, ValueError, OSError):
+                # Left in place; adopt_unindexed still indexes the item itself
+                logger.warning("Skipping malformed recycle bin metadata %s", meta_path)
+                continue
+            items.append(item)
+            meta_paths.append(meta_path)
+        self.add_many(items)
+        for meta_path in meta_paths:
+            os.remove(meta_path)
+        return len(items)
+
+    def adopt_unindexed(self, recycle_dir, size_of):
+        """Index items found in ``recycle_dir`` that have no entry.
+
+        The original location is lost with the entry, so they restore to the top
+        level under their recycled name minus the ``<timestamp>_`` prefix.
+        """
+        with self._lock:
+            known = {row[0] for row in self._conn.execute("SELECT recycled_name FROM recycled")}
+        items = []
+        for name in os.listdir(recycle_dir):
+            if name in known or name.startswith('.') or name.endswith('.meta'):
+                continue
+            item_path = os.path.join(recycle_dir, name)
+            match = RECYCLED_NAME.match(name)
+            try:
+                deleted_at = int(match.group(1)) if match else int(os.lstat(item_path).st_mtime)
+                size = size_of(item_path)
+            except OSError:
+                continue
+            original_name = match.group(2) if match else name
+            items.append({
+                "recycled_name": name,
+                "original_path": original_name,
+                "original_name": original_name,
+                "deleted_at": deleted_at,
+                "size": size,
+                "type": "directory" if os.path.isdir(item_path) else "file"
+            })
+        self.add_many(items)
+        return len(items)
+
+    def add_many(self, items):
+        if not items:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO recycled (recycled_name, original_path, original_name, deleted_at, size, type) "
+                "VALUES (:recycled_name, :original_path, :original_name, :deleted_at, :size, :type)",
+                items,
+            )
+
+    def exists(self, recycled_name):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM recycled WHERE recycled_name = ?", (recycled_name,)
+            ).fetchone() is not None
+
+    def get_many(self, recycled_names):
+        """Entries for the given names, keyed by recycled_name; unknown names are left out."""
+        found = {}
+        names = list(recycled_names)
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(names), 500):
+                batch = names[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT * FROM recycled WHERE recycled_name IN ({','.join('?' * len(batch))})", batch
+                )
+                columns = [d[0] for d in rows.description]
+                for row in rows:
+                    item = dict(zip(columns, row))
+                    found[item["recycled_name"]] = item
+        return found
+
+    def remove_many(self, recycled_names):
+        names = [(name,) for name in recycled_names]
+        if not names:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM recycled WHERE recycled_name = ?", names)
+
+    def list(self, sort_by="deleted_at", sort_order="desc", limit=0, offset=0):
+        """One page of entries plus the total count and size of the bin."""
+        column = SORT_COLUMNS.get(sort_by, "deleted_at")
+        direction = "ASC" if sort_order == "asc" else "DESC"
+        with self._lock:
+            total, total_size = self._conn.execute("SELECT count(*), coalesce(sum(size), 0) FROM recycled").fetchone()
+            rows = self._conn.execute(
+                f"SELECT * FROM recycled ORDER BY {column} {direction}, recycled_name LIMIT ? OFFSET ?",
+                (limit if limit > 0 else -1, max(offset, 0)),
+            )
+            columns = [d[0] for d in rows.description]
+            items = [dict(zip(columns, row)) for row in rows]
+        return items, total, total_size
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM recycled")
@@ -0,0 +1,364 @@
+import os
+import sqlite3
+import threading
+import mimetypes
+
+from size_index import normalize_path, parent_of
+
+# Extension and mime prefix lists behind the /search file_type filter
+FILE_TYPES = {
+    'image': (['jpg', 'jpeg', 'png', 'gif', 'bmp', 'svg', 'webp'], ['image/']),
+    'video': (['mp4', 'avi', 'mov', 'wmv', 'flv', 'webm', 'mkv'], ['video/']),
+    'audio': (['mp3', 'wav', 'ogg', 'aac', 'flac', 'm4a', 'wma'], ['audio/']),
+    'document': (['pdf', 'doc', 'docx', 'txt', 'rtf', 'odt'], ['application/pdf', 'text/']),
+    'archive': (['zip', 'rar', '7z', 'tar', 'gz'], ['application/zip', 'application/x-'])
+}
+
+
+def file_type_classes(filename, mime_type):
+    """All FILE_TYPES classes a file belongs to, as a space separated string."""
+    ext = filename.lower().split('.')[-1] if '.' in filename else ''
+    classes = []
+    for name, (extensions, mime_prefixes) in FILE_TYPES.items():
+        if ext in extensions or (mime_type and any(mime_type.startswith(p) for p in mime_prefixes)):
+            classes.append(name)
+    return " ".join(classes)
+
+
+def is_hidden(path):
+    return any(part.startswith('.') for part in path.split("/") if part)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    mime_type TEXT,
+    mime_class TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    scan_gen INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (is_dir, name_lower);
+CREATE INDEX IF NOT EXISTS entries_size ON entries (size);
+CREATE INDEX IF NOT EXISTS entries_mtime ON entries (mtime);
+CREATE INDEX IF NOT EXISTS entries_ext ON entries (ext);
+CREATE TABLE IF NOT EXISTS index_state (key TEXT PRIMARY KEY, value INTEGER);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    name_lower, content='entries', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts (rowid, name_lower) VALUES (new.id, new.name_lower);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, name_lower) VALUES ('delete', old.id, old.name_lower);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_au AFTER UPDATE OF name_lower ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, name_lower) VALUES ('delete', old.id, old.name_lower);
+    INSERT INTO entries_fts (rowid, name_lower) VALUES (new.id, new.name_lower);
+END;
+"""
+
+UPSERT = """
+INSERT INTO entries (path, parent, name, name_lower, ext, mime_type, mime_class, is_dir, size, mtime, scan_gen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (path) DO UPDATE SET
+    mime_type = excluded.mime_type, mime_class = excluded.mime_class, is_dir = excluded.is_dir,
+    size = excluded.size, mtime = excluded.mtime, scan_gen = excluded.scan_gen
+"""
+
+SORT_COLUMNS = {"size": "size", "modified": "mtime", "name": "name_lower"}
+
+
+class SearchIndex:
+    """SQLite (WAL) metadata index of UPLOAD_DIR answering /search without walking the tree.
+
+    Name substring matches go through an FTS5 trigram index when SQLite provides one;
+    size and date filters use plain B-tree indexes. Rows are kept current by the API
+    mutation hooks and reconciled by a background rescan at startup.
+    """
+
+    def __init__(self, root, db_path):
+        self.root = root
+        self.db_path = db_path
+        self.ready = False
+        self._lock = threading.Lock()
+        # Paths removed or moved away while a rebuild runs; its batches must not resurrect them
+        self._removed = None
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5/trigram: substring matches fall back to instr()
+            self.has_fts = False
+        self._conn.commit()
+        self._gen = self._get_state("scan_gen")
+
+    def _get_state(self, key):
+        row = self._conn.execute("SELECT value FROM index_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def available(self):
+        """True once the index can answer queries (built now or by a previous run)."""
+        if self.ready:
+            return True
+        with self._lock:
+            return self._get_state("complete") == 1
+
+    def _row(self, rel_path, stats, is_dir):
+        name = rel_path.rsplit("/", 1)[-1]
+        mime_type, _ = mimetypes.guess_type(name)
+        ext = os.path.splitext(name)[1].lower()
+        return (
+            rel_path, parent_of(rel_path), name, name.lower(), ext, mime_type,
+            "" if is_dir else file_type_classes(name, mime_type),
+            1 if is_dir else 0, 0 if is_dir else stats.st_size, stats.st_mtime, self._gen,
+        )
+
+    def rebuild(self):
+        """Rescan the tree one directory at a time, then drop rows that were not seen."""
+        with self._lock:
+            self._gen += 1
+            gen = self._gen
+            self._conn.execute("INSERT OR REPLACE INTO index_state VALUES ('scan_gen', ?)", (gen,))
+            self._conn.commit()
+            self._removed = []
+
+        try:
+            pending = [("", self.root)]
+            count = 0
+            while pending:
+                rel_dir, abs_dir = pending.pop()
+                with self._lock:
+                    mark = len(self._removed)
+                rows = []
+                try:
+                    with os.scandir(abs_dir) as it:
+                        for entry in it:
+                            if entry.name.startswith('.'):
+                                continue
+                            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                            try:
+                                is_dir = entry.is_dir(follow_symlinks=False)
+                                rows.append(self._row(rel_path, entry.stat(), is_dir))
+                            except OSError:
+                                continue
+                            if is_dir:
+                                pending.append((rel_path, entry.path))
+                except OSError:
+                    continue
+                with self._lock, self._conn:
+                    # Drop rows for anything a hook removed after this directory was listed
+                    gone = self._removed[mark:]
+                    if gone:
+                        rows = [row for row in rows if not any(
+                            row[0] == g or row[0].startswith(f"{g}/") for g in gone
+                        )]
+                    self._conn.executemany(UPSERT, rows)
+                count += len(rows)
+
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM entries WHERE scan_gen < ?", (gen,))
+                self._conn.execute("INSERT OR REPLACE INTO index_state VALUES ('complete', 1)")
+        finally:
+            with self._lock:
+                self._removed = None
+        self.ready = True
+        return count
+
+    # Mutation hooks called by the API endpoints
+
+    def path_added(self, path):
+        """Insert or refresh ``path`` and, for a directory, everything below it."""
+        path = normalize_path(path)
+        if not path or is_hidden(path):
+            return
+        abs_path = os.path.join(self.root, path)
+        rows = []
+        try:
+            is_dir = os.path.isdir(abs_path)
+            rows.append(self._row(path, os.stat(abs_path), is_dir))
+        except OSError:
+            return
+        if is_dir:
+            for dirpath, dirnames, filenames in os.walk(abs_path):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                rel_dir = normalize_path(os.path.relpath(dirpath, self.root))
+                for name in dirnames + [f for f in filenames if not f.startswith('.')]:
+                    try:
+                        full = os.path.join(dirpath, name)
+                        rows.append(self._row(f"{rel_dir}/{name}", os.stat(full), name in dirnames))
+                    except OSError:
+                        continue
+        rows.extend(self._parent_rows(path))
+        with self._lock, self._conn:
+            self._conn.executemany(UPSERT, rows)
+
+    def _parent_rows(self, path):
+        """Rows for the ancestors of ``path``; their mtimes changed and some may be new."""
+        rows = []
+        parent = parent_of(path)
+        while parent:
+            try:
+                rows.append(self._row(parent, os.stat(os.path.join(self.root, parent)), True))
+            except OSError:
+                pass
+            parent = parent_of(parent)
+        return rows
+
+    def path_removed(self, path):
+        path = normalize_path(path)
+        if not path:
+            return
+        with self._lock, self._conn:
+            if self._removed is not None:
+                self._removed.append(path)
+            # '0' sorts right after '/', so this range is exactly the subtree below path
+            self._conn.execute(
+                "DELETE FROM entries WHERE path = ? OR (path >= ? AND path < ?)",
+                (path, f"{path}/", f"{path}0"),
+            )
+        self._refresh_parents(path)
+
+    def path_moved(self, src, dst):
+        """Rewrite the paths of a moved subtree in place instead of rescanning it."""
+        src = normalize_path(src)
+        dst = normalize_path(dst)
+        if is_hidden(dst):
+            self.path_removed(src)
+            return
+        n = len(src)
+        name = dst.rsplit("/", 1)[-1]
+        with self._lock, self._conn:
+            if self._removed is not None:
+                self._removed.append(src)
+            self._conn.execute(
+                "DELETE FROM entries WHERE path = ? OR (path >= ? AND path < ?)",
+                (dst, f"{dst}/", f"{dst}0"),
+            )
+            # Moved rows join the current scan generation so a running rebuild keeps them
+            self._conn.execute(
+                "UPDATE entries SET path = ? || substr(path, ?), parent = ? || substr(parent, ?), scan_gen = ? "
+                "WHERE path >= ? AND path < ?",
+                (dst, n + 1, dst, n + 1, self._gen, f"{src}/", f"{src}0"),
+            )
+            moved = self._conn.execute(
+                "UPDATE entries SET path = ?, parent = ?, name = ?, name_lower = ?, scan_gen = ? WHERE path = ?",
+                (dst, parent_of(dst), name, name.lower(), self._gen, src),
+            ).rowcount
+        self._refresh_parents(src)
+        if moved:
+            self._refresh_parents(dst)
+        else:
+            # The source was never indexed (e.g. a hidden name), so index the destination fresh
+            self.path_added(dst)
+
+    def _refresh_parents(self, path):
+        rows = self._parent_rows(path)
+        if rows:
+            with self._lock, self._conn:
+                self._conn.executemany(UPSERT, rows)
+
+    # Queries
+
+    def query(self, query="", file_type="", min_size=0, max_size=0, mtime_from=None, mtime_to=None,
+              path="", recursive=True, sort_by="name", sort_order="asc", limit=0, offset=0,
+              dir_size=None):
+        """Run a /search query and return ``(rows, total)`` for the requested page.
+
+        Directories are only subject to the name and date filters, like the original
+        tree walk. ``dir_size`` resolves recursive directory sizes for sorting by size.
+        """
+        path = normalize_path(path)
+        where = []
+        params = []
+        if path:
+            if recursive:
+                where.append("(parent = ? OR (parent >= ? AND parent < ?))")
+                params += [path, f"{path}/", f"{path}0"]
+            else:
+                where.append("parent = ?")
+                params.append(path)
+        elif not recursive:
+            where.append("parent = ''")
+        if query:
+            q = query.lower()
+            if self.has_fts and len(q) >= 3:
+                where.append("id IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?)")
+                params.append('"' + q.replace('"', '""') + '"')
+            else:
+                where.append("instr(name_lower, ?) > 0")
+                params.append(q)
+        if file_type in FILE_TYPES:
+            where.append("(is_dir = 1 OR (' ' || mime_class || ' ') LIKE ?)")
+            params.append(f"% {file_type} %")
+        if min_size > 0:
+            where.append("(is_dir = 1 OR size >= ?)")
+            params.append(min_size)
+        if max_size > 0:
+            where.append("(is_dir = 1 OR size <= ?)")
+            params.append(max_size)
+        if mtime_from is not None:
+            where.append("mtime >= ?")
+            params.append(mtime_from)
+        if mtime_to is not None:
+            where.append("mtime < ?")
+            params.append(mtime_to)
+
+        columns = "path, name, is_dir, size, mtime, mime_type"
+        sql = f"SELECT {columns} FROM entries"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        direction = "DESC" if sort_order == "desc" else "ASC"
+
+        with self._lock:
+            if sort_by == "size" and dir_size is not None:
+                rows = self._conn.execute(sql, params).fetchall()
+            else:
+                if sort_by == "name":
+                    order = f"is_dir DESC, name_lower {direction}, path"
+                else:
+                    order = f"{SORT_COLUMNS.get(sort_by, 'name_lower')} {direction}, path"
+                total = self._conn.execute(f"SELECT count(*) FROM ({sql})", params).fetchone()[0]
+                page = sql + f" ORDER BY {order}"
+                page_params = list(params)
+                if limit > 0 or offset > 0:
+                    page += " LIMIT ? OFFSET ?"
+                    page_params += [limit if limit > 0 else -1, offset]
+                rows = self._conn.execute(page, page_params).fetchall()
+
+        results = [self._result(row) for row in rows]
+        if sort_by == "size" and dir_size is not None:
+            # Directory sizes live in the folder size index, so this ordering happens here
+            for item in results:
+                if item["type"] == "directory":
+                    item["size"] = dir_size(item["path"])
+            results.sort(key=lambda x: (x["size"], x["path"]), reverse=sort_order == "desc")
+            total = len(results)
+            results = results[offset:offset + limit] if limit > 0 else results[offset:]
+        return results, total
+
+    def _result(self, row):
+        path, name, is_dir, size, mtime, mime_type = row
+        return {
+            "name": name,
+            "path": path,
+            "type": "directory" if is_dir else "file",
+            "size": size,
+            "modified": mtime,
+            "isImage": bool(not is_dir and mime_type and mime_type.startswith('image/')),
+            "mimeType": mime_type
+        }
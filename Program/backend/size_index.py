@@ -0,0 +1,338 @@
+import os
+import sqlite3
+import threading
+
+from temp_files import is_temp_name
+
+
+def normalize_path(path):
+    """Normalize an UPLOAD_DIR-relative path to the index key format ("a/b", root is "")."""
+    path = (path or "").replace("\\", "/").strip("/")
+    parts = [p for p in path.split("/") if p and p != "."]
+    return "/".join(parts)
+
+
+def parent_of(path):
+    if not path:
+        return None
+    return path.rsplit("/", 1)[0] if "/" in path else ""
+
+
+class FolderSizeIndex:
+    """Per-directory size rollups for UPLOAD_DIR.
+
+    Every directory is stored as ``path -> [own, total, mtime_ns]`` where ``own`` is
+    the size of the files directly inside it and ``total`` includes all
+    subdirectories. Lookups are a dict access plus an mtime check of the directory
+    itself; the API mutation hooks keep the rollups current without re-walking.
+    """
+
+    def __init__(self, root, db_path):
+        self.root = root
+        self.db_path = db_path
+        self.ready = False
+        self._entries = {}
+        self._children = {}  # path -> set of child directory paths
+        # Bumped by every change to the entries, so a refresh that raced one is not applied
+        self._generation = 0
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS folder_sizes ("
+            "path TEXT PRIMARY KEY, own INTEGER NOT NULL, "
+            "total INTEGER NOT NULL, mtime_ns INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _abs(self, path):
+        return os.path.join(self.root, path) if path else self.root
+
+    def load(self):
+        """Load rollups persisted by a previous run so lookups work before the rebuild finishes."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, own, total, mtime_ns FROM folder_sizes").fetchall()
+            self._replace({path: [own, total, mtime_ns] for path, own, total, mtime_ns in rows})
+        return len(self._entries)
+
+    def rebuild(self):
+        """Walk the whole tree bottom-up and replace the index with fresh rollups."""
+        entries = self._scan(self._abs(""), "")
+        with self._lock:
+            self._replace(entries)
+            self._conn.execute("DELETE FROM folder_sizes")
+            self._persist(entries.keys())
+            self.ready = True
+        return len(entries)
+
+    def _scan(self, abs_path, rel_path):
+        """Build entries for a subtree; the directory mtime is taken before listing it."""
+        entries = {}
+
+        def visit(abs_dir, rel_dir):
+            try:
+                mtime_ns = os.stat(abs_dir).st_mtime_ns
+                own = 0
+                total = 0
+                with os.scandir(abs_dir) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                child = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                                total += visit(entry.path, child)
+                            elif entry.is_file() and not is_temp_name(entry.name):
+                                own += entry.stat().st_size
+                        except OSError:
+                            continue
+            except OSError:
+                return 0
+            entries[rel_dir] = [own, own + total, mtime_ns]
+            return own + total
+
+        visit(abs_path, rel_path)
+        return entries
+
+    def get(self, path, mtime_ns=None):
+        """Return the recursive size of a directory, or None if it is not indexed yet.
+
+        ``mtime_ns`` can be passed when the caller already has a stat result for the
+        directory. A changed mtime means entries were added or removed outside the API,
+        so that single directory is re-listed and the difference rolled up. The
+        filesystem work happens outside the lock; its result is dropped if the index
+        changed in the meantime, and the next lookup tries again.
+        """
+        path = normalize_path(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            total, known_mtime_ns = entry[1], entry[2]
+        if mtime_ns is None:
+            try:
+                mtime_ns = os.stat(self._abs(path)).st_mtime_ns
+            except OSError:
+                return total
+        if mtime_ns == known_mtime_ns:
+            return total
+        with self._lock:
+            generation = self._generation
+            known = set(self._children.get(path, ()))
+        listing = self._list(path, known)
+        with self._lock:
+            if listing is not None and generation == self._generation and path in self._entries:
+                self._apply_refresh(path, known, *listing)
+            return self._entries[path][1] if path in self._entries else total
+
+    def _list(self, path, known):
+        """(mtime_ns, own, children, scanned) for one directory, scanning child directories not in ``known``."""
+        try:
+            mtime_ns = os.stat(self._abs(path)).st_mtime_ns
+            own = 0
+            children = set()
+            with os.scandir(self._abs(path)) as it:
+                for item in it:
+                    try:
+                        if item.is_dir(follow_symlinks=False):
+                            children.add(f"{path}/{item.name}" if path else item.name)
+                        elif item.is_file() and not is_temp_name(item.name):
+                            own += item.stat().st_size
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        scanned = {}
+        for new in children - known:
+            scanned.update(self._scan(self._abs(new), new))
+        return mtime_ns, own, children, scanned
+
+    def _apply_refresh(self, path, known, mtime_ns, own, children, scanned):
+        """Reconcile one directory's direct files and child directories with a fresh listing."""
+        changed = [path]
+        for gone in known - children:
+            changed.extend(self._drop_subtree(gone))
+        for new_path, new_entry in scanned.items():
+            self._put(new_path, new_entry)
+        changed.extend(scanned.keys())
+
+        total = own + sum(self._entries[c][1] for c in children if c in self._entries)
+        delta = total - self._entries[path][1]
+        self._entries[path] = [own, total, mtime_ns]
+        changed.extend(self._propagate(parent_of(path), delta))
+        self._persist(changed)
+
+    def _replace(self, entries):
+        self._generation += 1
+        self._entries = {}
+        self._children = {}
+        for path, entry in entries.items():
+            self._put(path, entry)
+
+    def _put(self, path, entry):
+        self._entries[path] = entry
+        parent = parent_of(path)
+        if parent is not None:
+            self._children.setdefault(parent, set()).add(path)
+
+    def _subtree(self, path):
+        """``path`` and every indexed directory below it."""
+        found = []
+        stack = [path] if path in self._entries else []
+        while stack:
+            current = stack.pop()
+            found.append(current)
+            stack.extend(self._children.get(current, ()))
+        return found
+
+    def _drop_subtree(self, path):
+        dropped = self._subtree(path)
+        for p in dropped:
+            del self._entries[p]
+            self._children.pop(p, None)
+        siblings = self._children.get(parent_of(path))
+        if siblings is not None:
+            siblings.discard(path)
+        return dropped
+
+    def _propagate(self, path, delta):
+        """Add ``delta`` to the totals of ``path`` and all of its ancestors."""
+        touched = []
+        while path is not None:
+            entry = self._entries.get(path)
+            if entry is not None and delta:
+                entry[1] += delta
+                touched.append(path)
+            path = parent_of(path)
+        return touched
+
+    def _touch_mtime(self, path):
+        """Record the current mtime of a directory the API itself just changed."""
+        entry = self._entries.get(path)
+        if entry is None:
+            return
+        try:
+            entry[2] = os.stat(self._abs(path)).st_mtime_ns
+        except OSError:
+            pass
+
+    def _persist(self, paths):
+        rows = []
+        deleted = []
+        for path in set(paths):
+            entry = self._entries.get(path)
+            if entry is None:
+                deleted.append((path,))
+            else:
+                rows.append((path, entry[0], entry[1], entry[2]))
+        with self._conn:
+            if deleted:
+                self._conn.executemany("DELETE FROM folder_sizes WHERE path = ?", deleted)
+            if rows:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO folder_sizes (path, own, total, mtime_ns) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+
+    # Mutation hooks called by the API endpoints
+
+    def size_of(self, path):
+        """Size of a file or directory as the index sees it; used before removing an item."""
+        path = normalize_path(path)
+        abs_path = self._abs(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                return entry[1]
+        try:
+            if os.path.isdir(abs_path):
+                return self._scan(abs_path, path).get(path, [0, 0, 0])[1]
+            return os.path.getsize(abs_path)
+        except OSError:
+            return 0
+
+    def path_added(self, path, replaced_size=0):
+        """Account for a file or directory that now exists at ``path``.
+
+        ``replaced_size`` is the size of whatever was overwritten at the same path.
+        """
+        path = normalize_path(path)
+        abs_path = self._abs(path)
+        # A directory's subtree is walked before taking the lock; only the merge holds it
+        scanned = self._scan(abs_path, path) if os.path.isdir(abs_path) else None
+        if scanned is None:
+            try:
+                size = os.path.getsize(abs_path)
+            except OSError:
+                return
+        with self._lock:
+            self._generation += 1
+            changed = self._ensure_parents(path)
+            parent = parent_of(path)
+            if scanned is not None:
+                if path in self._entries:
+                    replaced_size = self._entries[path][1]
+                changed.extend(self._drop_subtree(path))
+                for new_path, new_entry in scanned.items():
+                    self._put(new_path, new_entry)
+                changed.extend(scanned.keys())
+                size = scanned.get(path, [0, 0, 0])[1]
+            elif parent in self._entries:
+                self._entries[parent][0] += size - replaced_size
+            changed.extend(self._propagate(parent, size - replaced_size))
+            self._touch_mtime(parent_of(path))
+            self._persist(changed)
+
+    def path_removed(self, path, size):
+        """Account for an item of ``size`` bytes that no longer exists at ``path``."""
+        path = normalize_path(path)
+        with self._lock:
+            self._generation += 1
+            was_dir = path in self._entries
+            changed = self._drop_subtree(path)
+            parent = parent_of(path)
+            if not was_dir and parent in self._entries:
+                self._entries[parent][0] -= size
+            changed.extend(self._propagate(parent, -size))
+            self._touch_mtime(parent)
+            self._persist(changed)
+
+    def path_moved(self, src, dst, size):
+        """Re-key an item moved within the tree without re-walking it."""
+        src = normalize_path(src)
+        dst = normalize_path(dst)
+        with self._lock:
+            self._generation += 1
+            if src not in self._entries:
+                self.path_removed(src, size)
+                self.path_added(dst)
+                return
+            moved = {p: self._entries[p] for p in self._subtree(src)}
+            changed = self._drop_subtree(src)
+            changed.extend(self._drop_subtree(dst))
+            for p, e in moved.items():
+                new = dst + p[len(src):]
+                self._put(new, e)
+                changed.append(new)
+            changed.extend(self._propagate(parent_of(src), -size))
+            changed.extend(self._ensure_parents(dst))
+            changed.extend(self._propagate(parent_of(dst), size))
+            self._touch_mtime(parent_of(src))
+            self._touch_mtime(parent_of(dst))
+            self._persist(changed)
+
+    def _ensure_parents(self, path):
+        """Index directories created implicitly (e.g. by os.makedirs in an upload)."""
+        created = []
+        parent = parent_of(path)
+        missing = []
+        while parent is not None and parent not in self._entries:
+            missing.append(parent)
+            parent = parent_of(parent)
+        for p in reversed(missing):
+            try:
+                mtime_ns = os.stat(self._abs(p)).st_mtime_ns
+            except OSError:
+                mtime_ns = 0
+            self._put(p, [0, 0, mtime_ns])
+            created.append(p)
+        for p in missing:
+            self._touch_mtime(parent_of(p))
+        return created
@@ -0,0 +1,466 @@
+import os
+import time
+import queue
+import heapq
+import bisect
+import logging
+import mimetypes
+import threading
+
+from search_index import file_type_classes
+from size_index import normalize_path
+from temp_files import is_temp_name
+
+logger = logging.getLogger("filemanager.storage_analytics")
+
+DAY = 86400
+# Age buckets by modification time: (name, newer than this many days); the last one takes the rest
+AGE_BUCKETS = (("day", 1), ("week", 7), ("month", 30), ("year", 365), ("older", None))
+# Each top-N list keeps this many times N candidates, so removals rarely force a full refill
+TOP_RESERVE = 4
+
+
+class _Folder:
+    __slots__ = ("files", "folders", "size", "count")
+
+    def __init__(self):
+        self.files = {}    # name -> (size, mtime, ext, file_type)
+        self.folders = {}  # name -> _Folder
+        self.size = 0      # bytes in the whole subtree
+        self.count = 0     # files in the whole subtree
+
+
+class _Largest:
+    """The ``capacity`` largest (size, path) items out of a changing set.
+
+    Nothing outside the list is larger than its smallest member, so the list
+    stays exact as items come and go; removals only shrink it. Once it is
+    shorter than a query needs while more items exist, the owner refills it
+    from scratch with ``reset()``.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = []  # ascending
+
+    def reset(self, items):
+        self.items = sorted(heapq.nlargest(self.capacity, items))
+
+    def add(self, size, path, total):
+        """Offer an item; ``total`` is how many items exist, this one included."""
+        item = (size, path)
+        if len(self.items) < total - 1 and not (self.items and item > self.items[0]):
+            return
+        bisect.insort(self.items, item)
+        if len(self.items) > self.capacity:
+            del self.items[0]
+
+    def discard(self, size, path):
+        index = bisect.bisect_left(self.items, (size, path))
+        if index < len(self.items) and self.items[index] == (size, path):
+            del self.items[index]
+
+    def rename(self, src, dst):
+        prefix = f"{src}/"
+        self.items = sorted(
+            (size, dst + path[len(src):] if path == src or path.startswith(prefix) else path)
+            for size, path in self.items
+        )
+
+
+class _Rollups:
+    """Folder tree of file records plus the totals derived from it."""
+
+    def __init__(self, top):
+        self.root = _Folder()
+        self.folder_count = 0
+        self.types = {}       # file_type -> [bytes, files]
+        self.extensions = {}  # ext -> [bytes, files]
+        self.days = {}        # day of mtime -> [bytes, files]
+        self.largest_files = _Largest(top * TOP_RESERVE)
+        self.largest_folders = _Largest(top * TOP_RESERVE)
+
+    def chain(self, path, create=False):
+        """[(path, folder), ...] from the root down to the folder ``path``, or None if it's unknown."""
+        node = self.root
+        chain = [("", node)]
+        if not path:
+            return chain
+        current = ""
+        for name in path.split("/"):
+            current = f"{current}/{name}" if current else name
+            child = node.folders.get(name)
+            if child is None:
+                if not create:
+                    return None
+                if name in node.files:
+                    # A file is being replaced by a folder of the same name
+                    self.drop(current)
+                child = node.folders[name] = _Folder()
+                self.folder_count += 1
+                self.largest_folders.add(0, current, self.folder_count)
+            node = child
+            chain.append((current, node))
+        return chain
+
+    def find(self, path):
+        """The folder or file record at ``path``, or None."""
+        if not path:
+            return self.root
+        parent, _, name = path.rpartition("/")
+        chain = self.chain(parent)
+        if chain is None:
+            return None
+        folder = chain[-1][1]
+        return folder.folders.get(name) or folder.files.get(name)
+
+    def _resize(self, chain, size, count):
+        for path, node in chain:
+            if path:
+                self.largest_folders.discard(node.size, path)
+            node.size += size
+            node.count += count
+            if path:
+                self.largest_folders.add(node.size, path, self.folder_count)
+
+    def _tally(self, record, sign):
+        size, mtime, ext, file_type = record
+        for table, key in ((self.types, file_type), (self.extensions, ext), (self.days, int(mtime // DAY))):
+            totals = table.setdefault(key, [0, 0])
+            totals[0] += sign * size
+            totals[1] += sign
+            if not totals[1]:
+                del table[key]
+
+    def put_file(self, path, record):
+        parent, _, name = path.rpartition("/")
+        existing = self.chain(parent)
+        if existing is not None and name in existing[-1][1].folders:
+            self.drop(path)
+        chain = self.chain(parent, create=True)
+        folder = chain[-1][1]
+        old = folder.files.get(name)
+        size, count = record[0], 1
+        if old is not None:
+            self._tally(old, -1)
+            self.largest_files.discard(old[0], path)
+            size -= old[0]
+            count = 0
+        folder.files[name] = record
+        self._tally(record, 1)
+        self.largest_files.add(record[0], path, self.root.count + count)
+        self._resize(chain, size, count)
+
+    def put_folder(self, path):
+        self.chain(path, create=True)
+
+    def drop(self, path):
+        if not path:
+            return
+        parent, _, name = path.rpartition("/")
+        chain = self.chain(parent)
+        if chain is None:
+            return
+        folder = chain[-1][1]
+        record = folder.files.pop(name, None)
+        if record is not None:
+            self._tally(record, -1)
+            self.largest_files.discard(record[0], path)
+            self._resize(chain, -record[0], -1)
+            return
+        subtree = folder.folders.pop(name, None)
+        if subtree is None:
+            return
+        stack = [(path, subtree)]
+        while stack:
+            current, node = stack.pop()
+            self.folder_count -= 1
+            self.largest_folders.discard(node.size, current)
+            for child_name, child_record in node.files.items():
+                self._tally(child_record, -1)
+                self.largest_files.discard(child_record[0], f"{current}/{child_name}")
+            stack.extend((f"{current}/{child_name}", child) for child_name, child in node.folders.items())
+        self._resize(chain, -subtree.size, -subtree.count)
+
+    def move(self, src, dst):
+        """Re-key ``src`` as ``dst``; returns False if ``src`` isn't known."""
+        src_parent, _, src_name = src.rpartition("/")
+        src_chain = self.chain(src_parent)
+        if src_chain is None or not src_name:
+            return False
+        src_folder = src_chain[-1][1]
+        if src_name in src_folder.files:
+            record = src_folder.files.pop(src_name)
+            self.largest_files.discard(record[0], src)
+            self._resize(src_chain, -record[0], -1)
+            self._tally(record, -1)
+            self.put_file(dst, record)
+            return True
+        subtree = src_folder.folders.pop(src_name, None)
+        if subtree is None:
+            return False
+        self.largest_folders.discard(subtree.size, src)
+        self._resize(src_chain, -subtree.size, -subtree.count)
+        self.drop(dst)
+        self.largest_files.rename(src, dst)
+        self.largest_folders.rename(src, dst)
+        dst_parent, _, dst_name = dst.rpartition("/")
+        dst_chain = self.chain(dst_parent, create=True)
+        dst_chain[-1][1].folders[dst_name] = subtree
+        self.largest_folders.add(subtree.size, dst, self.folder_count)
+        self._resize(dst_chain, subtree.size, subtree.count)
+        return True
+
+    def walk(self):
+        """(path, folder) for every folder, root first."""
+        stack = [("", self.root)]
+        while stack:
+            path, node = stack.pop()
+            yield path, node
+            stack.extend(
+                (f"{path}/{name}" if path else name, child) for name, child in node.folders.items()
+            )
+
+    def refill(self, top):
+        """Rebuild a top-N list that removals have shrunk below ``top`` items."""
+        if len(self.largest_files.items) < min(top, self.root.count):
+            self.largest_files.reset(
+                (record[0], f"{path}/{name}" if path else name)
+                for path, node in self.walk() for name, record in node.files.items()
+            )
+        if len(self.largest_folders.items) < min(top, self.folder_count):
+            self.largest_folders.reset((node.size, path) for path, node in self.walk() if path)
+
+
+class StorageAnalytics:
+    """Storage usage rollups over ``root``, ready to serve without walking the tree.
+
+    Every file is held in memory as (size, mtime, extension, type), in a tree
+    of folders that carry their subtree totals. From it the aggregator keeps
+    bytes and file counts per file type (the /search FILE_TYPES classes, first
+    match, else "other"), per extension and per day of modification, plus the
+    largest files and folders. Age buckets are summed from the per-day totals
+    at query time, so they never drift as files get older.
+
+    A single background thread builds the rollups at startup, rebuilds them
+    every ``reconcile_interval`` seconds to pick up changes made outside the
+    API, and in between applies the changes queued by the API mutation hooks,
+    like the content index.
+    """
+
+    def __init__(self, root, reconcile_interval, top):
+        self.root = root
+        self.reconcile_interval = reconcile_interval
+        self.top = top
+        self.ready = False
+        self.scanned_at = None
+        self.scan_seconds = None
+        self._rollups = _Rollups(top)
+        self._types = {}  # ext -> file type, mimetypes is slow enough to matter on a full scan
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def _abs(self, path):
+        return os.path.join(self.root, path) if path else self.root
+
+    def _record(self, name, stats):
+        ext = os.path.splitext(name)[1].lower()
+        file_type = self._types.get(ext)
+        if file_type is None:
+            classes = file_type_classes(name, mimetypes.guess_type(name)[0]).split()
+            file_type = self._types[ext] = classes[0] if classes else "other"
+        return stats.st_size, stats.st_mtime, ext, file_type
+
+    def _scan(self, abs_path, rel_path):
+        """(folders, files) under ``rel_path``; files are (path, record) pairs."""
+        folders, files = [], []
+        stack = [(abs_path, rel_path)]
+        while stack:
+            abs_dir, rel_dir = stack.pop()
+            folders.append(rel_dir)
+            try:
+                with os.scandir(abs_dir) as it:
+                    for entry in it:
+                        child = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append((entry.path, child))
+                            elif entry.is_file() and not is_temp_name(entry.name):
+                                files.append((child, self._record(entry.name, entry.stat())))
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return folders, files
+
+    # Background worker
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="storage-analytics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        next_scan = 0
+        while True:
+            if time.monotonic() >= next_scan:
+                try:
+                    self.rebuild()
+                except Exception:
+                    logger.exception("Storage analytics scan failed")
+                next_scan = time.monotonic() + self.reconcile_interval
+            try:
+                op = self._queue.get(timeout=max(next_scan - time.monotonic(), 0))
+            except queue.Empty:
+                continue
+            if op is None:
+                return
+            try:
+                getattr(self, f"_apply_{op[0]}")(*op[1:])
+            except Exception:
+                # Keep the worker alive; the next reconciliation scan corrects the rollups
+                logger.exception("Storage analytics failed to apply %s", op)
+
+    def rebuild(self):
+        """Scan the whole tree and replace the rollups."""
+        started = time.monotonic()
+        folders, files = self._scan(self._abs(""), "")
+        rollups = _Rollups(self.top)
+        for path in folders:
+            rollups.put_folder(path)
+        for path, record in files:
+            rollups.put_file(path, record)
+        with self._lock:
+            self._rollups = rollups
+            self.ready = True
+            self.scanned_at = time.time()
+            self.scan_seconds = time.monotonic() - started
+
+    # Mutation hooks: queued, applied by the worker thread
+
+    def path_added(self, path):
+        self._queue.put(("added", normalize_path(path)))
+
+    def path_removed(self, path):
+        self._queue.put(("removed", normalize_path(path)))
+
+    def path_moved(self, src, dst):
+        self._queue.put(("moved", normalize_path(src), normalize_path(dst)))
+
+    def _apply_added(self, path):
+        abs_path = self._abs(path)
+        if os.path.isdir(abs_path):
+            folders, files = self._scan(abs_path, path)
+            with self._lock:
+                self._rollups.drop(path)
+                for folder in folders:
+                    self._rollups.put_folder(folder)
+                for file_path, record in files:
+                    self._rollups.put_file(file_path, record)
+            return
+        try:
+            record = self._record(os.path.basename(path), os.stat(abs_path))
+        except OSError:
+            record = None
+        with self._lock:
+            if record is None:
+                self._rollups.drop(path)
+            else:
+                self._rollups.put_file(path, record)
+
+    def _apply_removed(self, path):
+        with self._lock:
+            self._rollups.drop(path)
+
+    def _apply_moved(self, src, dst):
+        if src == dst:
+            return
+        with self._lock:
+            moved = self._rollups.move(src, dst)
+        if not moved:
+            self._apply_added(dst)
+
+    # Queries
+
+    def summary(self, path="", top=10, depth=1, max_children=50):
+        """Rollups for the whole store and a treemap of ``path``, or None if ``path`` isn't a known folder."""
+        top = min(top, self.top)
+        path = normalize_path(path)
+        today = int(time.time() // DAY)
+        with self._lock:
+            rollups = self._rollups
+            folder = rollups.find(path)
+            if not isinstance(folder, _Folder):
+                return None
+            rollups.refill(top)
+
+            ages = [{"bucket": name, "size": 0, "files": 0} for name, _ in AGE_BUCKETS]
+            for day, (size, count) in rollups.days.items():
+                age = today - day
+                index = next(
+                    (i for i, (_, days) in enumerate(AGE_BUCKETS) if days is None or age < days), -1
+                )
+                ages[index]["size"] += size
+                ages[index]["files"] += count
+
+            largest_files = []
+            for size, file_path in reversed(rollups.largest_files.items[-top:] if top else []):
+                record = rollups.find(file_path)
+                largest_files.append({
+                    "path": file_path, "size": size, "modified": record[1] if isinstance(record, tuple) else None
+                })
+            largest_folders = []
+            for size, folder_path in reversed(rollups.largest_folders.items[-top:] if top else []):
+                node = rollups.find(folder_path)
+                largest_folders.append({
+                    "path": folder_path, "size": size, "files": node.count if isinstance(node, _Folder) else 0
+                })
+
+            return {
+                "ready": self.ready,
+                "scanned_at": self.scanned_at,
+                "scan_seconds": self.scan_seconds,
+                "total": {
+                    "size": rollups.root.size, "files": rollups.root.count, "folders": rollups.folder_count
+                },
+                "by_type": self._ranked(rollups.types, "type"),
+                "by_extension": self._ranked(rollups.extensions, "extension", top),
+                "extensions": len(rollups.extensions),
+                "by_age": ages,
+                "largest_files": largest_files,
+                "largest_folders": largest_folders,
+                "tree": self._tree(path, folder, depth, max_children),
+            }
+
+    @staticmethod
+    def _ranked(table, key, limit=None):
+        rows = sorted(table.items(), key=lambda item: item[1][0], reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+        return [{key: name, "size": size, "files": count} for name, (size, count) in rows]
+
+    def _tree(self, path, folder, depth, max_children):
+        """Treemap node: subtree totals, with ``rest_size`` covering direct files and unlisted subfolders."""
+        node = {
+            "name": path.rpartition("/")[2], "path": path, "size": folder.size,
+            "files": folder.count, "folders": len(folder.folders),
+        }
+        if depth <= 0:
+            return node
+        children = heapq.nlargest(max_children, folder.folders.items(), key=lambda item: item[1].size)
+        node["children"] = [
+            self._tree(f"{path}/{name}" if path else name, child, depth - 1, max_children)
+            for name, child in children
+        ]
+        node["rest_size"] = folder.size - sum(child.size for _, child in children)
+        return node
+
+    def type_totals(self):
+        with self._lock:
+            return {file_type: tuple(totals) for file_type, totals in self._rollups.types.items()}
@@ -0,0 +1,200 @@
+import os
+import stat
+import zlib
+import queue
+import tarfile
+import threading
+from collections import deque
+
+from zip_stream import STORED_EXTENSIONS
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; without it tar.zst isn't offered
+    zstandard = None
+
+# format -> (media type, file extension, compression)
+TAR_FORMATS = {
+    "tar": ("application/x-tar", ".tar", None),
+    "tar.gz": ("application/gzip", ".tar.gz", "gzip"),
+    "tar.zst": ("application/zstd", ".tar.zst", "zstd"),
+}
+COMPRESS_LEVELS = {"gzip": 6, "zstd": 3}
+# Used for blocks made only of already-compressed files: deflate's stored mode, zstd's fastest level
+STORE_LEVELS = {"gzip": 0, "zstd": 1}
+
+
+def tar_format_available(archive_format):
+    compression = TAR_FORMATS[archive_format][2]
+    return compression != "zstd" or zstandard is not None
+
+
+def _pad(length, chunk_size):
+    while length > 0:
+        size = min(length, chunk_size)
+        yield bytes(size)
+        length -= size
+
+
+def _tar_pieces(entries, chunk_size):
+    """Yield the uncompressed tar stream of ``entries`` as (bytes, stored) pieces.
+
+    ``stored`` marks headers and data of files that are already compressed. A
+    file that shrinks while it is read is zero-padded to the size its header
+    announced, and one that grows is cut off there, so the stream stays valid.
+    """
+    written = 0
+    for file_path, arc_name in entries:
+        try:
+            stats = os.stat(file_path)
+            # Skips FIFOs and sockets too, which would block on open
+            if not stat.S_ISREG(stats.st_mode):
+                continue
+            src = open(file_path, 'rb')
+        except OSError:
+            # The file vanished or can't be read; leave it out of the archive
+            continue
+        with src:
+            info = tarfile.TarInfo(arc_name.replace(os.sep, "/"))
+            info.size = stats.st_size
+            info.mtime = stats.st_mtime
+            info.mode = stats.st_mode & 0o7777
+            # PAX headers take long names, non-ASCII names and sizes over 8 GB
+            header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+            stored = os.path.splitext(file_path)[1].lower() in STORED_EXTENSIONS
+            yield header, stored
+            remaining = stats.st_size
+            while remaining > 0:
+                try:
+                    block = src.read(min(chunk_size, remaining))
+                except OSError:
+                    block = b""
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block, stored
+            for block in _pad(remaining + (-stats.st_size % tarfile.BLOCKSIZE), chunk_size):
+                yield block, stored
+        written += len(header) + stats.st_size + (-stats.st_size % tarfile.BLOCKSIZE)
+    # Two zero blocks end the archive; pad to a whole record like tar(1) does
+    end = 2 * tarfile.BLOCKSIZE
+    end += -(written + end) % tarfile.RECORDSIZE
+    yield bytes(end), False
+
+
+def _read_ahead(pieces, depth):
+    """Run the ``pieces`` generator on its own thread, up to ``depth`` pieces ahead.
+
+    Disk reads then overlap with compression and sending instead of alternating
+    with them. Closing the returned generator stops the reader.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for piece in pieces:
+                if not put(("piece", piece)):
+                    return
+            put(("done", None))
+        except BaseException as exc:
+            put(("error", exc))
+        finally:
+            pieces.close()
+
+    threading.Thread(target=produce, name="tar-read-ahead", daemon=True).start()
+    try:
+        while True:
+            kind, value = buffer.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        stopped.set()
+
+
+def compress_block(data, compression, stored, level=None):
+    """One block as a self-contained gzip member or zstd frame.
+
+    Concatenated members (and frames) decode as a single stream, so blocks can
+    be compressed independently and in parallel.
+    """
+    if stored:
+        level = STORE_LEVELS[compression]
+    elif level is None:
+        level = COMPRESS_LEVELS[compression]
+    if compression == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _blocks(pieces, block_size):
+    """Regroup (bytes, stored) pieces into blocks of ``block_size``; a block never mixes stored and other data."""
+    chunks = []
+    length = 0
+    block_stored = False
+    for data, stored in pieces:
+        if length and stored != block_stored:
+            yield b"".join(chunks), block_stored
+            chunks, length = [], 0
+        block_stored = stored
+        view = memoryview(data)
+        while view:
+            take = view[:block_size - length]
+            chunks.append(bytes(take))
+            length += len(take)
+            view = view[len(take):]
+            if length >= block_size:
+                yield b"".join(chunks), block_stored
+                chunks, length = [], 0
+    if length:
+        yield b"".join(chunks), block_stored
+
+
+def stream_tar(entries, compression=None, executor=None, parallelism=1,
+               block_size=1024 * 1024, read_ahead=8, level=None):
+    """Generate a tar archive of ``entries`` ((path, arcname) pairs), optionally compressed.
+
+    Files are read on a separate thread, up to ``read_ahead`` chunks ahead.
+    With ``compression`` ("gzip" or "zstd") the stream is cut into
+    ``block_size`` blocks that are compressed on ``executor`` with up to
+    ``parallelism`` blocks in flight, and yielded in order. Blocks holding only
+    already-compressed files (STORED_EXTENSIONS) are stored rather than
+    compressed again. Like stream_zip, this is meant to be iterated from a
+    worker thread.
+    """
+    pieces = _read_ahead(_tar_pieces(entries, block_size), read_ahead)
+    blocks = _blocks(pieces, block_size)
+    pending = deque()
+    try:
+        if compression is None:
+            for data, _ in blocks:
+                yield data
+            return
+        if executor is None:
+            for data, stored in blocks:
+                yield compress_block(data, compression, stored, level)
+            return
+        for data, stored in blocks:
+            pending.append(executor.submit(compress_block, data, compression, stored, level))
+            while len(pending) >= max(parallelism, 1):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        blocks.close()
+        pieces.close()
@@ -0,0 +1,36 @@
+import os
+import re
+import uuid
+
+# ".<kind>-<uuid hex>.part": written next to the target, then renamed over it
+TEMP_NAME = re.compile(r"^\.(?:upload|copy|save|link)-[0-9a-f]{32}\.part$")
+
+
+def temp_path(target, kind):
+    """A unique temporary path in the directory of ``target``, so the final rename stays atomic."""
+    return os.path.join(os.path.dirname(target), f".{kind}-{uuid.uuid4().hex}.part")
+
+
+def is_temp_name(name):
+    """True for a file name made by temp_path; listings and indexes leave these out."""
+    return name.startswith('.') and TEMP_NAME.match(name) is not None
+
+
+def sweep_temp_files(root, before):
+    """Remove temporary files under ``root`` last modified before ``before``; returns the count.
+
+    Anything older than the current process was left behind by a crash mid-write.
+    """
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            if not is_temp_name(name):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                if os.lstat(path).st_mtime < before:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+    return removed
@@ -0,0 +1,121 @@
+import os
+import re
+import hashlib
+
+from temp_files import temp_path
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+NO_NEWLINE = "\\ No newline at end of file"
+
+
+class PatchError(ValueError):
+    """The patch is malformed or does not apply to the base text."""
+
+
+def content_version(data):
+    """Version tag of a file's bytes; clients send it back as the base of their next save."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def decode_text(data):
+    """Decode file bytes the way the editor sees them: UTF-8 with universal newlines."""
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+def _parse_hunks(patch):
+    """[(old_start, old_count, new_count, [(op, line), ...]), ...] from a unified diff.
+
+    Lines keep their trailing newline unless the patch marks them with
+    "\\ No newline at end of file", so they compare exactly against the base.
+    """
+    hunks = []
+    lines = patch.splitlines(keepends=True)
+    i = 0
+    while i < len(lines):
+        match = HUNK_HEADER.match(lines[i])
+        i += 1
+        if not match:
+            if hunks and lines[i - 1].strip():
+                raise PatchError(f"Unexpected line outside a hunk: {lines[i - 1].rstrip()!r}")
+            # File headers (---/+++, diff, index) before the first hunk
+            continue
+        old_start = int(match.group(1))
+        old_count = int(match.group(2)) if match.group(2) is not None else 1
+        new_count = int(match.group(4)) if match.group(4) is not None else 1
+        body = []
+        seen_old = seen_new = 0
+        while i < len(lines) and (seen_old < old_count or seen_new < new_count):
+            line = lines[i]
+            op = line[:1]
+            if op not in (" ", "-", "+"):
+                raise PatchError(f"Bad line in hunk: {line.rstrip()!r}")
+            text = line[1:]
+            i += 1
+            if i < len(lines) and lines[i].rstrip("\n") == NO_NEWLINE:
+                text = text[:-1] if text.endswith("\n") else text
+                i += 1
+            body.append((op, text))
+            seen_old += op != "+"
+            seen_new += op != "-"
+        if seen_old != old_count or seen_new != new_count:
+            raise PatchError("Hunk is shorter than its header says")
+        hunks.append((old_start, old_count, new_count, body))
+    if not hunks:
+        raise PatchError("Patch contains no hunks")
+    return hunks
+
+
+def apply_patch(text, patch):
+    """Apply a unified diff to ``text``, strictly: every context and removed line must match."""
+    source = text.splitlines(keepends=True)
+    result = []
+    cursor = 0
+    for old_start, old_count, _, body in _parse_hunks(patch):
+        # An empty old range names the line the hunk goes after
+        position = old_start - 1 if old_count else old_start
+        if position < cursor or position > len(source):
+            raise PatchError(f"Hunk at line {old_start} is out of order or past the end")
+        result.extend(source[cursor:position])
+        for op, line in body:
+            if op == "+":
+                result.append(line)
+                continue
+            if position >= len(source) or source[position] != line:
+                raise PatchError(f"Patch does not match line {position + 1}")
+            if op == " ":
+                result.append(line)
+            position += 1
+        cursor = position
+    result.extend(source[cursor:])
+    return "".join(result)
+
+
+def atomic_write(path, data):
+    """Replace ``path`` with ``data`` so readers and crashes only ever see the old or new file.
+
+    The bytes go to a temp file in the same directory, are fsynced, and then
+    renamed over the target; the directory is fsynced so the rename is durable too.
+    """
+    directory = os.path.dirname(path) or "."
+    tmp_path = temp_path(path, "save")
+    try:
+        with open(tmp_path, 'xb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
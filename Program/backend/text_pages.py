@@ -0,0 +1,152 @@
+import os
+import bisect
+import threading
+from collections import OrderedDict
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def _trim_utf8(data, at_start, at_end):
+    """Drop partial UTF-8 sequences cut off by a byte window.
+
+    Returns (text, bytes skipped at the front, bytes consumed) so the next page can
+    start exactly where this one stopped.
+    """
+    start = 0
+    if not at_start:
+        while start < len(data) and start < 3 and (data[start] & 0xC0) == 0x80:
+            start += 1
+    end = len(data)
+    if not at_end:
+        # Walk back over a trailing sequence that is missing continuation bytes
+        i = end - 1
+        while i >= start and end - i <= 4 and (data[i] & 0xC0) == 0x80:
+            i -= 1
+        if i >= start and data[i] >= 0xC0:
+            needed = 2 if data[i] < 0xE0 else 3 if data[i] < 0xF0 else 4
+            if end - i < needed:
+                end = i
+    return data[start:end].decode('utf-8', errors='replace'), start, end
+
+
+def read_window(path, offset, length):
+    """Read ``length`` bytes from ``offset`` as text; returns (text, next_offset, size)."""
+    size = os.path.getsize(path)
+    offset = min(max(offset, 0), size)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    text, _, consumed = _trim_utf8(data, offset == 0, offset + len(data) >= size)
+    return text, offset + consumed, size
+
+
+def read_tail(path, lines, max_bytes=None):
+    """Last ``lines`` lines of a file, reading backwards block by block.
+
+    At most ``max_bytes`` are read: when the lines are longer than that, the
+    text starts at the first line boundary inside the window (or mid-line if
+    there is none). Returns (text, start_offset, size).
+    """
+    size = os.path.getsize(path)
+    limit = size if max_bytes is None else min(size, max_bytes)
+    blocks = []
+    newlines = 0
+    read = 0
+    # A trailing newline ends the last line rather than starting an empty one
+    wanted = lines + 1 if size else lines
+    with open(path, 'rb') as f:
+        while read < limit and newlines < wanted:
+            step = min(READ_BLOCK_SIZE, limit - read)
+            read += step
+            f.seek(size - read)
+            block = f.read(step)
+            blocks.append(block)
+            newlines += block.count(b"\n")
+    data = b"".join(reversed(blocks))
+    if data.endswith(b"\n"):
+        body = data[:-1].split(b"\n")
+        kept = b"\n".join(body[-lines:]) + b"\n"
+    else:
+        kept = b"\n".join(data.split(b"\n")[-lines:])
+    if len(kept) == len(data) and read < size:
+        # Cut off by max_bytes: drop the partial first line if there is a whole one after it
+        cut = kept.find(b"\n")
+        if 0 <= cut < len(kept) - 1:
+            kept = kept[cut + 1:]
+    start = size - len(kept)
+    text, skipped, _ = _trim_utf8(kept, start == 0, True)
+    return text, start + skipped, size
+
+
+class LineIndex:
+    """Sparse line-number -> byte-offset checkpoints, cached per file version.
+
+    The first line-window request for a file scans it once, counting newlines a
+    block at a time; later pages seek to the nearest checkpoint (at most one block
+    before the wanted line) instead of reading from the start.
+    """
+
+    def __init__(self, max_files=64):
+        self.max_files = max_files
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _checkpoints(self, path):
+        stats = os.stat(path)
+        key = (os.path.abspath(path), stats.st_mtime_ns, stats.st_size)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        # Parallel lists: lines[i] full lines precede byte offset offsets[i]
+        lines = [0]
+        offsets = [0]
+        line = 0
+        offset = 0
+        last_byte = b"\n"
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+                count = block.count(b"\n")
+                if count:
+                    line += count
+                    lines.append(line)
+                    offsets.append(offset + block.rfind(b"\n") + 1)
+                offset += len(block)
+                last_byte = block[-1:]
+        # A final line without a trailing newline still counts
+        total_lines = line + (0 if last_byte == b"\n" else 1)
+        result = (lines, offsets, total_lines)
+
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.max_files:
+                self._cache.popitem(last=False)
+        return result
+
+    def read_lines(self, path, start_line, count):
+        """Lines ``start_line`` (1-based) to ``start_line + count - 1``.
+
+        Returns (text, start_offset, next_offset, total_lines).
+        """
+        lines, offsets, total_lines = self._checkpoints(path)
+        start_line = max(start_line, 1)
+        slot = bisect.bisect_right(lines, start_line - 1) - 1
+        skip = start_line - 1 - lines[slot]
+        with open(path, 'rb') as f:
+            f.seek(offsets[slot])
+            for _ in range(skip):
+                if not f.readline():
+                    break
+            start_offset = f.tell()
+            chunks = []
+            for _ in range(count):
+                line = f.readline()
+                if not line:
+                    break
+                chunks.append(line)
+            next_offset = f.tell()
+        return b"".join(chunks).decode('utf-8', errors='replace'), start_offset, next_offset, total_lines
@@ -0,0 +1,145 @@
+import os
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional; without it thumbnails fall back to the original image
+    Image = None
+
+# Formats Pillow can't rasterize; these are always served as the original file
+PASSTHROUGH_EXTENSIONS = {'.svg'}
+
+
+def render_thumbnail(src_path, dest_path, size, fmt, quality):
+    """Decode, downscale and encode one thumbnail. Runs inside a pool worker process."""
+    with Image.open(src_path) as img:
+        # Let the JPEG decoder skip detail we are about to throw away
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+        if fmt == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        elif img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            img = img.convert('RGBA')
+        tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+        img.save(tmp_path, fmt, quality=quality)
+    os.replace(tmp_path, dest_path)
+    return os.path.getsize(dest_path)
+
+
+class ThumbnailCache:
+    """On-disk thumbnail cache with coalesced generation in a process pool.
+
+    Thumbnails are keyed by source path, mtime and requested size, so an edited
+    image gets a new entry and the stale one ages out. The cache is bounded by
+    total bytes and evicts least recently used entries.
+    """
+
+    def __init__(self, cache_dir, max_bytes, workers, quality=80, executor=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.quality = quality
+        # Source stats and cache hit checks run here; None means the event loop's default executor
+        self.executor = executor
+        self.available = Image is not None
+        self.format = 'WEBP' if self.available and features.check('webp') else 'JPEG'
+        self.media_type = 'image/webp' if self.format == 'WEBP' else 'image/jpeg'
+        self._ext = '.webp' if self.format == 'WEBP' else '.jpg'
+        self._pool = None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total = 0
+        self._inflight = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Rebuild the LRU order from the cache directory, oldest access first."""
+        found = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            try:
+                stats = os.stat(path)
+            except OSError:
+                continue
+            found.append((stats.st_atime, name, stats.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+
+    def _pool_executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def cache_name(self, src_path, stats, size):
+        key = f"{os.path.abspath(src_path)}|{stats.st_mtime_ns}|{stats.st_size}|{size}"
+        return hashlib.sha256(key.encode()).hexdigest() + self._ext
+
+    def _touch(self, name):
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                return True
+        return False
+
+    def _add(self, name, nbytes):
+        with self._lock:
+            self._total += nbytes - self._entries.get(name, 0)
+            self._entries[name] = nbytes
+            self._entries.move_to_end(name)
+            evicted = []
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.cache_dir, old))
+            except OSError:
+                pass
+
+    async def get(self, src_path, size):
+        """Path of a cached thumbnail for ``src_path``, generating it if needed.
+
+        Concurrent requests for the same uncached thumbnail share one render.
+        """
+        loop = asyncio.get_running_loop()
+        stats = await loop.run_in_executor(self.executor, os.stat, src_path)
+        name = self.cache_name(src_path, stats, size)
+        dest_path = os.path.join(self.cache_dir, name)
+        if self._touch(name) and await loop.run_in_executor(self.executor, os.path.exists, dest_path):
+            return dest_path
+
+        future = self._inflight.get(name)
+        if future is None:
+            future = loop.run_in_executor(
+                self._pool_executor(), render_thumbnail, src_path, dest_path, size, self.format, self.quality
+            )
+            self._inflight[name] = future
+            future.add_done_callback(lambda done: self._finished(name, done))
+        # Shielded so one cancelled request does not cancel the render for everyone sharing it
+        await asyncio.shield(future)
+        return dest_path
+
+    def _finished(self, name, future):
+        self._inflight.pop(name, None)
+        if not future.cancelled() and future.exception() is None:
+            self._add(name, future.result())
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._total, "max_bytes": self.max_bytes}
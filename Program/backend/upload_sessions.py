@@ -0,0 +1,271 @@
+import os
+import json
+import errno
+import asyncio
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+
+from temp_files import temp_path
+
+
+class UploadSessionError(Exception):
+    """Raised for invalid session operations; ``status_code`` maps onto the HTTP response."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UploadSessionStore:
+    """Resumable chunked uploads.
+
+    A session owns a sparse ``<id>.part`` file preallocated to the final size and a
+    ``<id>.json`` manifest recording which chunks have arrived. Chunks are written at
+    their own offsets, so they can be sent in any order and in parallel; once every
+    chunk is present the part file is moved into place atomically.
+    """
+
+    def __init__(self, sessions_dir, default_chunk_size, max_chunk_size, ttl, executor=None):
+        self.sessions_dir = sessions_dir
+        # Chunk writes run here; None means the event loop's default executor
+        self.executor = executor
+        self.default_chunk_size = default_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._completing = set()  # ids whose part file is being verified and moved into place
+        os.makedirs(sessions_dir, exist_ok=True)
+        self._load()
+
+    def _manifest_path(self, upload_id):
+        return os.path.join(self.sessions_dir, f"{upload_id}.json")
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.sessions_dir, f"{upload_id}.part")
+
+    def _load(self):
+        """Pick up sessions left by a previous run so clients can resume after a restart."""
+        for name in os.listdir(self.sessions_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.sessions_dir, name), 'r') as f:
+                    session = json.load(f)
+                session["received"] = set(session["received"])
+                self._sessions[session["id"]] = session
+            except (OSError, ValueError, KeyError):
+                continue
+
+    def _save(self, session):
+        data = dict(session, received=sorted(session["received"]))
+        tmp_path = self._manifest_path(session["id"]) + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._manifest_path(session["id"]))
+
+    def create(self, path, filename, size, chunk_size=0, sha256=None):
+        if size < 0:
+            raise UploadSessionError(400, "Size must not be negative")
+        chunk_size = chunk_size or self.default_chunk_size
+        if chunk_size <= 0 or chunk_size > self.max_chunk_size:
+            raise UploadSessionError(400, f"Chunk size must be between 1 and {self.max_chunk_size} bytes")
+
+        upload_id = uuid.uuid4().hex
+        now = time.time()
+        session = {
+            "id": upload_id,
+            "path": path,
+            "filename": filename,
+            "size": size,
+            "chunk_size": chunk_size,
+            "total_chunks": max(1, -(-size // chunk_size)),
+            "sha256": sha256.lower() if sha256 else None,
+            "created_at": now,
+            "expires_at": now + self.ttl,
+            "received": set(),
+        }
+        # Registered before the part file exists, so collect_expired never takes it for an orphan
+        with self._lock:
+            self._sessions[upload_id] = session
+            self._save(session)
+        try:
+            # truncate() extends without writing data, so the file stays sparse until chunks land
+            with open(self._part_path(upload_id), 'wb') as f:
+                f.truncate(size)
+        except OSError:
+            self.discard(upload_id)
+            raise
+        return self.status(upload_id)
+
+    def get(self, upload_id):
+        with self._lock:
+            session = self._sessions.get(upload_id)
+        if session is None or session["expires_at"] < time.time():
+            raise UploadSessionError(404, "Upload session not found or expired")
+        return session
+
+    def _check_not_completing(self, upload_id):
+        with self._lock:
+            if upload_id in self._completing:
+                raise UploadSessionError(409, "Upload session is already being completed")
+
+    def chunk_range(self, upload_id, index):
+        """Byte offset and exact length expected for chunk ``index``."""
+        session = self.get(upload_id)
+        if index < 0 or index >= session["total_chunks"]:
+            raise UploadSessionError(400, f"Chunk index must be between 0 and {session['total_chunks'] - 1}")
+        offset = index * session["chunk_size"]
+        return offset, min(session["chunk_size"], session["size"] - offset)
+
+    async def write_chunk(self, upload_id, index, stream):
+        """Write an async stream of byte strings at the offset of chunk ``index``.
+
+        Uses its own file descriptor and pwrite, so parallel chunk requests for the
+        same session don't interfere with each other. Opening, writing and closing
+        run in ``self.executor``.
+        """
+        offset, length = self.chunk_range(upload_id, index)
+        self._check_not_completing(upload_id)
+        loop = asyncio.get_running_loop()
+        written = 0
+        fd = await loop.run_in_executor(self.executor, os.open, self._part_path(upload_id), os.O_WRONLY)
+        try:
+            async for piece in stream:
+                if not piece:
+                    continue
+                if written + len(piece) > length:
+                    raise UploadSessionError(400, f"Chunk {index} must be exactly {length} bytes")
+                await loop.run_in_executor(self.executor, os.pwrite, fd, piece, offset + written)
+                written += len(piece)
+            if written != length:
+                raise UploadSessionError(400, f"Chunk {index} must be exactly {length} bytes, got {written}")
+        except BaseException:
+            # Whatever was there before may have been partly overwritten, so it must be resent
+            self._set_received(upload_id, index, False)
+            raise
+        finally:
+            await loop.run_in_executor(self.executor, os.close, fd)
+        return self._set_received(upload_id, index, True)
+
+    def _set_received(self, upload_id, index, received):
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is None:
+                raise UploadSessionError(404, "Upload session not found or expired")
+            if received:
+                session["received"].add(index)
+            else:
+                session["received"].discard(index)
+            session["expires_at"] = time.time() + self.ttl
+            self._save(session)
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        session = self.get(upload_id)
+        with self._lock:
+            received = sorted(session["received"])
+        # Collapse received chunks into contiguous [start, end) byte ranges
+        ranges = []
+        for index in received:
+            start = index * session["chunk_size"]
+            end = min(start + session["chunk_size"], session["size"])
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        received_set = set(received)
+        return {
+            "upload_id": upload_id,
+            "path": session["path"],
+            "filename": session["filename"],
+            "size": session["size"],
+            "chunk_size": session["chunk_size"],
+            "total_chunks": session["total_chunks"],
+            "received_chunks": received,
+            "received_ranges": ranges,
+            "received_bytes": sum(end - start for start, end in ranges),
+            "missing_chunks": [i for i in range(session["total_chunks"]) if i not in received_set],
+            "expires_at": session["expires_at"],
+        }
+
+    def complete(self, upload_id, dest_path):
+        """Verify the session and move the assembled file to ``dest_path``; returns its sha256.
+
+        Only one call per session gets past the check; a concurrent one gets a 409.
+        """
+        session = self.get(upload_id)
+        with self._lock:
+            if upload_id in self._completing:
+                raise UploadSessionError(409, "Upload session is already being completed")
+            missing = session["total_chunks"] - len(session["received"])
+            if missing:
+                raise UploadSessionError(409, f"{missing} chunks have not been uploaded yet")
+            self._completing.add(upload_id)
+        try:
+            part_path = self._part_path(upload_id)
+            hasher = hashlib.sha256()
+            with open(part_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(block)
+            digest = hasher.hexdigest()
+            if session["sha256"] and session["sha256"] != digest:
+                raise UploadSessionError(422, "Checksum mismatch, the assembled file does not match sha256")
+
+            try:
+                os.replace(part_path, dest_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # The sessions directory is on another filesystem: copy next to the target, then rename
+                tmp_path = temp_path(dest_path, "upload")
+                try:
+                    shutil.copyfile(part_path, tmp_path)
+                    os.replace(tmp_path, dest_path)
+                except OSError:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+            self.discard(upload_id)
+            return digest
+        finally:
+            with self._lock:
+                self._completing.discard(upload_id)
+
+    def abort(self, upload_id):
+        """Drop a live session and its data; raises 404 for unknown or expired ids."""
+        self.get(upload_id)
+        self._check_not_completing(upload_id)
+        self.discard(upload_id)
+
+    def discard(self, upload_id):
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+        for path in (self._part_path(upload_id), self._manifest_path(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def collect_expired(self):
+        """Remove sessions whose TTL ran out and files no session owns; returns how many sessions were dropped."""
+        now = time.time()
+        with self._lock:
+            expired = [
+                i for i, s in self._sessions.items() if s["expires_at"] < now and i not in self._completing
+            ]
+        for upload_id in expired:
+            self.discard(upload_id)
+        # Part files and manifests left behind by a crash or by a manifest that no longer loads
+        for name in os.listdir(self.sessions_dir):
+            upload_id = name.split(".", 1)[0]
+            with self._lock:
+                if upload_id in self._sessions:
+                    continue
+            try:
+                os.remove(os.path.join(self.sessions_dir, name))
+            except OSError:
+                pass
+        return len(expired)
@@ -0,0 +1,313 @@
+import time
+import zlib
+import struct
+import hashlib
+import sqlite3
+import threading
+from collections import namedtuple
+
+from size_index import normalize_path
+
+# A full snapshot is stored at least every MAX_CHAIN versions, so rebuilding any
+# version applies at most MAX_CHAIN - 1 deltas to a snapshot
+MAX_CHAIN = 10
+# Deltas that don't beat the compressed snapshot by this factor are stored as snapshots
+DELTA_MAX_RATIO = 0.5
+COMPRESS_LEVEL = 6
+# Base positions remembered per distinct line; bounds the matching work when lines repeat
+MAX_CANDIDATES = 8
+
+_COPY = b"C"
+_INSERT = b"I"
+# Size of an encoded copy op; runs shorter than this are cheaper to insert
+_COPY_SIZE = 9
+
+# A version encoded by prepare(): ``blob`` is (base hash, payload), or None if the content is stored already
+PreparedVersion = namedtuple("PreparedVersion", "digest data depth blob")
+
+
+def encode_delta(base, data):
+    """Line-level delta turning ``base`` into ``data``: copy runs of base lines, insert new bytes.
+
+    Base lines are hashed into a table of where they occur (the first
+    MAX_CANDIDATES positions of each distinct line). Every line of ``data`` is
+    matched greedily against the line following the previous copy and against
+    those positions, keeping the longest run, so the work stays linear in the
+    input even for files made of the same few lines.
+    """
+    base_lines = base.splitlines(keepends=True)
+    lines = data.splitlines(keepends=True)
+    positions = {}
+    for i, line in enumerate(base_lines):
+        found = positions.setdefault(line, [])
+        if len(found) < MAX_CANDIDATES:
+            found.append(i)
+
+    ops = []
+    inserted = []
+
+    def flush_insert():
+        if inserted:
+            chunk = b"".join(inserted)
+            ops.append(_INSERT + struct.pack(">I", len(chunk)) + chunk)
+            inserted.clear()
+
+    j = 0
+    follow = 0
+    while j < len(lines):
+        best_start, best_count, best_bytes = 0, 0, 0
+        candidates = positions.get(lines[j], [])
+        if follow < len(base_lines) and follow not in candidates:
+            candidates = [follow] + candidates
+        for start in candidates:
+            count = nbytes = 0
+            while (j + count < len(lines) and start + count < len(base_lines)
+                   and base_lines[start + count] == lines[j + count]):
+                nbytes += len(lines[j + count])
+                count += 1
+            if nbytes > best_bytes:
+                best_start, best_count, best_bytes = start, count, nbytes
+        if best_bytes > _COPY_SIZE:
+            flush_insert()
+            ops.append(_COPY + struct.pack(">II", best_start, best_count))
+            j += best_count
+            follow = best_start + best_count
+        else:
+            inserted.append(lines[j])
+            j += 1
+    flush_insert()
+    return b"".join(ops)
+
+
+def apply_delta(base, delta):
+    base_lines = base.splitlines(keepends=True)
+    out = []
+    pos = 0
+    while pos < len(delta):
+        op = delta[pos:pos + 1]
+        if op == _COPY:
+            start, count = struct.unpack_from(">II", delta, pos + 1)
+            out.extend(base_lines[start:start + count])
+            pos += 9
+        elif op == _INSERT:
+            (length,) = struct.unpack_from(">I", delta, pos + 1)
+            out.append(delta[pos + 5:pos + 5 + length])
+            pos += 5 + length
+        else:
+            raise ValueError("Corrupt delta")
+    return b"".join(out)
+
+
+class VersionStore:
+    """Saved versions of edited files, stored compactly in SQLite.
+
+    Content is kept once per distinct SHA-256 (a revert to an earlier text adds a
+    row, not a blob). Each new blob is a zlib-compressed line delta against the
+    file's previous version, with a full snapshot whenever the delta chain would
+    reach MAX_CHAIN or the delta isn't much smaller than a snapshot.
+
+    Eviction keeps the newest ``keep_versions`` per file and drops versions older
+    than ``keep_days``; the newest version of a file is never evicted. Blobs are
+    freed once no version or later delta needs them.
+    """
+
+    def __init__(self, db_path, keep_versions, keep_days, max_file_bytes):
+        self.keep_versions = keep_versions
+        self.keep_days = keep_days
+        self.max_file_bytes = max_file_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                base TEXT,
+                depth INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                data BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS blobs_base ON blobs (base);
+            CREATE TABLE IF NOT EXISTS versions (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                source TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS versions_path ON versions (path, id);
+            CREATE INDEX IF NOT EXISTS versions_hash ON versions (hash);
+        """)
+        self._conn.commit()
+
+    def prepare(self, path, data, after=None):
+        """Encode ``data`` for ``record()`` without holding up other saves.
+
+        The delta is computed against ``after`` (the PreparedVersion it will be
+        recorded after) or else the newest stored version of ``path``. Only the
+        lookup of that base takes the store lock. Returns None for files too
+        large to keep history for.
+        """
+        if len(data) > self.max_file_bytes:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        base_hash = base_data = None
+        base_depth = 0
+        with self._lock:
+            row = self._conn.execute("SELECT depth FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row is not None:
+                return PreparedVersion(digest, data, row[0], None)
+            if after is not None:
+                base_hash, base_data, base_depth = after.digest, after.data, after.depth
+            else:
+                latest = self._conn.execute(
+                    "SELECT v.hash, b.depth FROM versions v JOIN blobs b ON b.hash = v.hash "
+                    "WHERE v.path = ? ORDER BY v.id DESC LIMIT 1", (normalize_path(path),)
+                ).fetchone()
+                if latest is not None and latest[1] + 1 < MAX_CHAIN:
+                    base_hash, base_depth = latest
+                    base_data = self._content(base_hash)
+        snapshot = zlib.compress(data, COMPRESS_LEVEL)
+        if base_hash is not None and base_depth + 1 < MAX_CHAIN:
+            delta = zlib.compress(encode_delta(base_data, data), COMPRESS_LEVEL)
+            if len(delta) < len(snapshot) * DELTA_MAX_RATIO:
+                return PreparedVersion(digest, data, base_depth + 1, (base_hash, delta))
+        return PreparedVersion(digest, data, 0, (None, snapshot))
+
+    def record(self, path, data, source="save", prepared=None):
+        """Add ``data`` as the newest version of ``path`` unless it already is; returns the version id.
+
+        ``prepared`` is the result of ``prepare()`` for the same data, so the
+        delta is not computed while the caller holds its own locks.
+        """
+        if len(data) > self.max_file_bytes:
+            return None
+        if prepared is None:
+            prepared = self.prepare(path, data)
+        path = normalize_path(path)
+        digest = prepared.digest
+        with self._lock, self._conn:
+            latest = self._conn.execute(
+                "SELECT id, hash FROM versions WHERE path = ? ORDER BY id DESC LIMIT 1", (path,)
+            ).fetchone()
+            if latest and latest[1] == digest:
+                return latest[0]
+            if not self._conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone():
+                self._store_blob(prepared)
+            version_id = self._conn.execute(
+                "INSERT INTO versions (path, hash, size, created_at, source) VALUES (?, ?, ?, ?, ?)",
+                (path, digest, len(data), time.time(), source),
+            ).lastrowid
+            self._evict(path)
+        return version_id
+
+    def _store_blob(self, prepared):
+        base_hash, payload = prepared.blob or (None, None)
+        if base_hash is not None:
+            row = self._conn.execute("SELECT depth FROM blobs WHERE hash = ?", (base_hash,)).fetchone()
+            if row is not None and row[0] + 1 == prepared.depth:
+                self._conn.execute(
+                    "INSERT INTO blobs (hash, base, depth, size, data) VALUES (?, ?, ?, ?, ?)",
+                    (prepared.digest, base_hash, prepared.depth, len(prepared.data), payload),
+                )
+                return
+            # The base was evicted (or changed depth) since prepare(): store a snapshot instead
+            payload = None
+        if payload is None:
+            payload = zlib.compress(prepared.data, COMPRESS_LEVEL)
+        self._conn.execute(
+            "INSERT INTO blobs (hash, base, depth, size, data) VALUES (?, NULL, 0, ?, ?)",
+            (prepared.digest, len(prepared.data), payload),
+        )
+
+    def _content(self, digest):
+        """Rebuild a blob: walk back to its snapshot, then apply the deltas forward."""
+        chain = []
+        while digest is not None:
+            row = self._conn.execute("SELECT base, data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row is None:
+                raise KeyError(digest)
+            chain.append(zlib.decompress(row[1]))
+            digest = row[0]
+        data = chain.pop()
+        while chain:
+            data = apply_delta(data, chain.pop())
+        return data
+
+    def _evict(self, path):
+        cutoff = time.time() - self.keep_days * 86400 if self.keep_days > 0 else None
+        rows = self._conn.execute(
+            "SELECT id, created_at FROM versions WHERE path = ? ORDER BY id DESC", (path,)
+        ).fetchall()
+        ids = [
+            version_id for index, (version_id, created_at) in enumerate(rows)
+            if index > 0 and (
+                (self.keep_versions > 0 and index >= self.keep_versions)
+                or (cutoff is not None and created_at < cutoff)
+            )
+        ]
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            self._conn.execute(f"DELETE FROM versions WHERE id IN ({','.join('?' * len(batch))})", batch)
+        if ids:
+            self._collect_blobs()
+
+    def _collect_blobs(self):
+        # Deleting an unused delta can free its base in turn, so repeat until nothing goes
+        while self._conn.execute("""
+            DELETE FROM blobs WHERE
+                NOT EXISTS (SELECT 1 FROM versions v WHERE v.hash = blobs.hash)
+                AND NOT EXISTS (SELECT 1 FROM blobs b WHERE b.base = blobs.hash)
+        """).rowcount:
+            pass
+
+    # Queries
+
+    def list(self, path):
+        path = normalize_path(path)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, hash, size, created_at, source FROM versions WHERE path = ? ORDER BY id DESC", (path,)
+            ).fetchall()
+        return [
+            {"id": version_id, "version": digest, "size": size, "created_at": created_at, "source": source}
+            for version_id, digest, size, created_at, source in rows
+        ]
+
+    def get(self, path, version_id):
+        """(metadata, bytes) of one version of ``path``, or None."""
+        path = normalize_path(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, hash, size, created_at, source FROM versions WHERE path = ? AND id = ?",
+                (path, version_id),
+            ).fetchone()
+            if row is None:
+                return None
+            data = self._content(row[1])
+        info = {"id": row[0], "version": row[1], "size": row[2], "created_at": row[3], "source": row[4]}
+        return info, data
+
+    def evict_all(self):
+        """Apply the age limit to every file, including ones nobody has saved lately."""
+        with self._lock, self._conn:
+            paths = [row[0] for row in self._conn.execute("SELECT DISTINCT path FROM versions")]
+            for path in paths:
+                self._evict(path)
+
+    # Mutation hooks: history follows moves; deleted files keep theirs so a restore can use it
+
+    def path_moved(self, src, dst):
+        src = normalize_path(src)
+        dst = normalize_path(dst)
+        with self._lock, self._conn:
+            replaced = self._conn.execute(
+                "DELETE FROM versions WHERE path = ? OR (path >= ? AND path < ?)", (dst, f"{dst}/", f"{dst}0")
+            ).rowcount
+            self._conn.execute(
+                "UPDATE versions SET path = ? || substr(path, ?) WHERE path = ? OR (path >= ? AND path < ?)",
+                (dst, len(src) + 1, src, f"{src}/", f"{src}0"),
+            )
+            # Re-keying keeps every blob referenced; only an overwritten history can orphan some
+            if replaced:
+                self._collect_blobs()
@@ -0,0 +1,665 @@
+"""Benchmark and load test for the backend API.
+
+Generates a synthetic file tree in a temp directory, then drives the app either
+in-process through ASGI (``asgi``) or over HTTP against a local uvicorn
+(``http``) and records latency percentiles, throughput and peak RSS per
+endpoint. Results are written as JSON; pass an earlier result with
+``--compare`` to flag regressions.
+
+    python benchmarks/api_benchmark.py --output before.json
+    python benchmarks/api_benchmark.py --output after.json --compare before.json
+
+``--offload`` starts the backend with DOWNLOAD_OFFLOAD set, so file downloads
+only measure the backend's share of the work (the reverse proxy would send the
+bytes); comparing against a run without it shows the per-worker gain.
+
+Only the standard library is used, so it runs wherever the backend does.
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import contextlib
+import http.client
+from datetime import datetime
+from urllib.parse import quote, unquote, urlencode
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+MODES = ("asgi", "http")
+RSS_SAMPLE_INTERVAL = 0.02
+SERVER_START_TIMEOUT = 30
+INDEX_READY_TIMEOUT = 300
+
+WORDS = (
+    "alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima mike "
+    "november oscar papa quebec romeo sierra tango uniform victor whiskey xray yankee zulu"
+).split()
+
+
+# Synthetic tree
+
+def generate_tree(root, depth, fanout, files_per_dir, min_size, max_size, text_ratio, seed):
+    """Fill ``root`` with ``fanout`` subfolders per level down to ``depth`` and
+    ``files_per_dir`` files in every folder. Sizes are log-uniform between
+    ``min_size`` and ``max_size``; a ``text_ratio`` share of files are .txt.
+
+    Returns (dirs, files) as relative paths, files as (path, size) pairs.
+    """
+    rng = random.Random(seed)
+    dirs = [("", 0)]
+    files = []
+    os.makedirs(root, exist_ok=True)
+    for rel_dir, level in dirs:
+        for i in range(files_per_dir):
+            size = int(math.exp(rng.uniform(math.log(max(min_size, 1)), math.log(max(max_size, min_size, 1)))))
+            if rng.random() < text_ratio:
+                name = f"doc_{level}_{i}.txt"
+                line = " ".join(rng.choice(WORDS) for _ in range(12)) + "\n"
+                data = (line * (size // len(line) + 1)).encode()[:size]
+            else:
+                name = f"data_{level}_{i}.bin"
+                data = rng.randbytes(size)
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            with open(os.path.join(root, rel_path), 'wb') as f:
+                f.write(data)
+            files.append((rel_path, size))
+        if level < depth:
+            for i in range(fanout):
+                child = f"{rel_dir}/folder_{level + 1}_{i}" if rel_dir else f"folder_{level + 1}_{i}"
+                os.makedirs(os.path.join(root, child))
+                dirs.append((child, level + 1))
+    return dirs, files
+
+
+def generate_large_files(root, count, size, seed):
+    """``count`` incompressible files of exactly ``size`` bytes in ``root``/large, for download throughput."""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(root, "large"), exist_ok=True)
+    files = []
+    for i in range(count):
+        rel_path = f"large/large_{i}.bin"
+        with open(os.path.join(root, rel_path), 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                block = rng.randbytes(min(remaining, 1024 * 1024))
+                f.write(block)
+                remaining -= len(block)
+        files.append((rel_path, size))
+    return files
+
+
+# Scenarios: each builds the i-th request as (method, path, query, headers, body)
+
+def multipart(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return {"content-type": f"multipart/form-data; boundary={boundary}"}, body
+
+
+def build_scenarios(tree, large_files, recycled, args, rng):
+    dirs, files = tree
+    depth_of = dict(dirs)
+    folders = [path for path, _ in dirs if path]
+    # Folders one level above the leaves keep ZIP downloads to a realistic size
+    zip_folders = [path for path in folders if depth_of[path] == max(args.depth - 1, 1)] or folders or [""]
+    file_paths = [path for path, _ in files if path not in recycled]
+    upload_data = rng.randbytes(args.upload_size)
+    upload_tag = uuid.uuid4().hex[:8]
+
+    def pick(items):
+        return items[rng.randrange(len(items))]
+
+    def list_root(i):
+        return "GET", "/files", {"path": ""}, {}, b""
+
+    def list_folder(i):
+        return "GET", "/files", {"path": pick(folders) if folders else ""}, {}, b""
+
+    def search(i):
+        return "GET", "/search", {"query": pick(["doc", "data", "_1_", "folder"])}, {}, b""
+
+    def upload(i):
+        headers, body = multipart("file", f"upload_{upload_tag}_{i}.bin", upload_data)
+        return "POST", "/upload", {"path": "bench_uploads"}, headers, body
+
+    def download_file(i):
+        return "GET", "/download/" + quote(pick(file_paths)), {}, {}, b""
+
+    def download_large(i):
+        return "GET", "/download/" + quote(large_files[i % len(large_files)][0]), {}, {}, b""
+
+    def download_folder(i):
+        return "GET", "/download/" + quote(pick(zip_folders)), {}, {}, b""
+
+    def download_multiple(i):
+        chosen = rng.sample(file_paths, min(args.multiple_files, len(file_paths)))
+        return "GET", "/files/download-multiple", {"files": ",".join(chosen)}, {}, b""
+
+    def recycle_bin(i):
+        return "GET", "/recycle-bin", {}, {}, b""
+
+    # name: (request builder, share of --requests)
+    scenarios = {
+        "list_root": (list_root, 1),
+        "list_folder": (list_folder, 1),
+        "search": (search, 1),
+        "upload": (upload, 1),
+        "download_file": (download_file, 1),
+        "download_large": (download_large, 0.25),
+        "download_folder": (download_folder, 0.1),
+        "download_multiple": (download_multiple, 0.25),
+        "recycle_bin": (recycle_bin, 1),
+    }
+    if not large_files:
+        del scenarios["download_large"]
+    return scenarios
+
+
+def recycle_targets(tree, count, rng):
+    """Files deleted before the run so /recycle-bin has something to list."""
+    files = [path for path, _ in tree[1]]
+    return set(rng.sample(files, min(count, len(files) // 4)))
+
+
+# Measurement
+
+class RssSampler:
+    """Peak resident set size of a process, sampled from /proc while a scenario runs."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        if self.pid == os.getpid():
+            try:
+                import resource
+                # Peak since process start; the best we have without /proc
+                return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            except ImportError:
+                pass
+        return 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(RSS_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(samples, elapsed, concurrency, peak_rss):
+    """samples are (status, seconds, bytes_received) per request."""
+    latencies = sorted(seconds * 1000 for _, seconds, _ in samples)
+    statuses = {}
+    for status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    received = sum(nbytes for _, _, nbytes in samples)
+    return {
+        "requests": len(samples),
+        "concurrency": concurrency,
+        "errors": sum(1 for status, _, _ in samples if not 200 <= status < 400),
+        "status_counts": statuses,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "bytes_received": received,
+        "throughput_mb_s": round(received / elapsed / 1e6, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50), 3),
+            "p90": round(percentile(latencies, 90), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0
+        },
+        "peak_rss_mb": round(peak_rss / 1e6, 1)
+    }
+
+
+# In-process ASGI driver
+
+async def asgi_request(app, method, path, query, headers, body):
+    """Send one request straight into the ASGI app; returns (status, bytes_received)."""
+    response_done = asyncio.Event()
+    request_sent = False
+    status = 0
+    received = 0
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Streaming responses watch for a disconnect; only report one once the body is out
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, received
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            received += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                response_done.set()
+
+    raw_headers = [(b"host", b"benchmark")]
+    raw_headers += [(key.lower().encode(), value.encode()) for key, value in headers.items()]
+    if body:
+        raw_headers.append((b"content-length", str(len(body)).encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": unquote(path),
+        "raw_path": path.encode(),
+        "query_string": urlencode(query).encode(),
+        "root_path": "",
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("benchmark", 80),
+    }
+    await app(scope, receive, send)
+    response_done.set()
+    return status, received
+
+
+@contextlib.asynccontextmanager
+async def asgi_lifespan(app):
+    """Run the app's startup and shutdown handlers around the benchmark."""
+    inbox = asyncio.Queue()
+    outbox = asyncio.Queue()
+    task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}}, inbox.get, outbox.put))
+    await inbox.put({"type": "lifespan.startup"})
+    message = await outbox.get()
+    if message["type"] != "lifespan.startup.complete":
+        raise RuntimeError(f"App startup failed: {message.get('message', message['type'])}")
+    try:
+        yield
+    finally:
+        await inbox.put({"type": "lifespan.shutdown"})
+        await outbox.get()
+        await task
+
+
+async def asgi_scenario(app, build, count, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one(i):
+        async with slots:
+            request = build(i)
+            started = time.perf_counter()
+            try:
+                status, received = await asgi_request(app, *request)
+            except Exception:
+                status, received = 599, 0
+            samples.append((status, time.perf_counter() - started, received))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return samples, time.perf_counter() - started
+
+
+async def wait_for_indexes_asgi(main):
+    deadline = time.monotonic() + INDEX_READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if main.size_index.ready and main.search_index.available() and main.content_index.available():
+            return
+        await asyncio.sleep(0.1)
+
+
+def run_asgi(workdir, recycled, scenarios, args):
+    previous_cwd = os.getcwd()
+    # main.py resolves its storage paths and settings at import time
+    os.chdir(workdir)
+    if args.offload:
+        os.environ["DOWNLOAD_OFFLOAD"] = args.offload
+    sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+    try:
+        import main
+        app = main.app
+
+        async def run():
+            results = {}
+            async with asgi_lifespan(app):
+                await wait_for_indexes_asgi(main)
+                for path in sorted(recycled):
+                    await asgi_request(app, "DELETE", "/files/" + quote(path), {}, {}, b"")
+                for name, (build, share) in scenarios.items():
+                    count = max(int(args.requests * share), 1)
+                    # A short warm-up so first-call costs (imports, page cache) don't skew p99
+                    await asgi_scenario(app, build, min(args.concurrency, count), args.concurrency)
+                    with RssSampler(os.getpid()) as rss:
+                        samples, elapsed = await asgi_scenario(app, build, count, args.concurrency)
+                    results[name] = summarize(samples, elapsed, args.concurrency, rss.peak)
+                    log(name, results[name])
+            return results
+
+        return asyncio.run(run())
+    finally:
+        os.chdir(previous_cwd)
+
+
+# uvicorn over HTTP
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def http_request(conn, method, path, query, headers, body):
+    url = path + ("?" + urlencode(query) if query else "")
+    conn.request(method, url, body=body or None, headers=headers)
+    response = conn.getresponse()
+    received = 0
+    while True:
+        block = response.read(1024 * 1024)
+        if not block:
+            break
+        received += len(block)
+    return response.status, received
+
+
+def http_scenario(port, build, count, concurrency):
+    samples = []
+    samples_lock = threading.Lock()
+    counter = iter(range(count))
+    counter_lock = threading.Lock()
+
+    def worker():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+        try:
+            while True:
+                with counter_lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                request = build(i)
+                started = time.perf_counter()
+                try:
+                    status, received = http_request(conn, *request)
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+                    status, received = 599, 0
+                with samples_lock:
+                    samples.append((status, time.perf_counter() - started, received))
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(concurrency, count))]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def get_json(port, path, query=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request("GET", path + ("?" + urlencode(query) if query else ""))
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+    finally:
+        conn.close()
+
+
+def run_http(workdir, recycled, scenarios, args):
+    port = args.port or free_port()
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(BACKEND_DIR))
+    if args.offload:
+        env["DOWNLOAD_OFFLOAD"] = args.offload
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=env,
+    )
+    try:
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("uvicorn exited before it started serving")
+            try:
+                get_json(port, "/files")
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("uvicorn did not start in time")
+                time.sleep(0.1)
+        # The content index finishes its first build last; wait so /search isn't measured mid-scan
+        deadline = time.monotonic() + INDEX_READY_TIMEOUT
+        while time.monotonic() < deadline:
+            status, body = get_json(port, "/search/content", {"query": "benchmark"})
+            if status != 200 or body.get("complete"):
+                break
+            time.sleep(0.2)
+
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        for path in sorted(recycled):
+            http_request(conn, "DELETE", "/files/" + quote(path), {}, {}, b"")
+        conn.close()
+
+        results = {}
+        for name, (build, share) in scenarios.items():
+            count = max(int(args.requests * share), 1)
+            http_scenario(port, build, min(args.concurrency, count), args.concurrency)
+            with RssSampler(server.pid) as rss:
+                samples, elapsed = http_scenario(port, build, count, args.concurrency)
+            results[name] = summarize(samples, elapsed, args.concurrency, rss.peak)
+            log(name, results[name])
+        return results
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+# Reporting
+
+def log(name, result):
+    latency = result["latency_ms"]
+    print(
+        f"  {name:<18} {result['throughput_rps']:>9.1f} req/s {result['throughput_mb_s']:>8.1f} MB/s  "
+        f"p50 {latency['p50']:>8.2f} ms  "
+        f"p99 {latency['p99']:>8.2f} ms  rss {result['peak_rss_mb']:>7.1f} MB  errors {result['errors']}",
+        flush=True,
+    )
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=10,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Print per-scenario changes against a baseline run; returns the regressions found."""
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('timestamp')} ({baseline['meta'].get('git_revision')}):")
+    for mode, scenarios in current["results"].items():
+        for name, result in scenarios.items():
+            before = baseline.get("results", {}).get(mode, {}).get(name)
+            if before is None:
+                continue
+            checks = [
+                ("p50", before["latency_ms"]["p50"], result["latency_ms"]["p50"], True),
+                ("p99", before["latency_ms"]["p99"], result["latency_ms"]["p99"], True),
+                ("rps", before["throughput_rps"], result["throughput_rps"], False),
+                ("rss", before["peak_rss_mb"], result["peak_rss_mb"], True),
+            ]
+            changes = []
+            for metric, old, new, lower_is_better in checks:
+                if not old:
+                    continue
+                change = (new - old) / old
+                changes.append(f"{metric} {change:+.0%}")
+                worse = change > threshold if lower_is_better else change < -threshold
+                if worse:
+                    regressions.append(f"{mode}/{name} {metric}: {old} -> {new}")
+            print(f"  {mode}/{name:<18} " + "  ".join(changes))
+    if regressions:
+        print(f"\nRegressions beyond {threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the file manager backend API")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated: asgi (in-process), http (uvicorn)")
+    parser.add_argument("--scenarios", default="", help="Comma-separated scenario names (default: all)")
+    parser.add_argument("--depth", type=int, default=3, help="Folder levels below the root")
+    parser.add_argument("--fanout", type=int, default=4, help="Subfolders per folder")
+    parser.add_argument("--files-per-dir", type=int, default=20, help="Files in every folder")
+    parser.add_argument("--min-size", type=int, default=1024, help="Smallest generated file, in bytes")
+    parser.add_argument("--max-size", type=int, default=256 * 1024, help="Largest generated file, in bytes")
+    parser.add_argument("--text-ratio", type=float, default=0.5, help="Share of generated files that are text")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the tree and request mix")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario (ZIP scenarios run fewer)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--upload-size", type=int, default=64 * 1024, help="Bytes per uploaded file")
+    parser.add_argument("--multiple-files", type=int, default=10, help="Files per /files/download-multiple request")
+    parser.add_argument("--large-files", type=int, default=2, help="Files for the download_large scenario (0 = skip it)")
+    parser.add_argument("--large-size", type=int, default=32 * 1024 * 1024, help="Bytes per download_large file")
+    parser.add_argument("--offload", default="", choices=("", "x-accel-redirect", "x-sendfile"),
+                        help="Run the backend with DOWNLOAD_OFFLOAD set to this mode")
+    parser.add_argument("--recycle-items", type=int, default=50, help="Files deleted up front to fill the recycle bin")
+    parser.add_argument("--port", type=int, default=0, help="uvicorn port for the http mode (default: any free port)")
+    parser.add_argument("--workdir", default=None, help="Where to build the trees (default: a temp directory)")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated trees afterwards")
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change reported as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        sys.exit(f"Unknown mode(s): {', '.join(sorted(unknown))}")
+
+    base_dir = tempfile.mkdtemp(prefix="fm-bench-", dir=args.workdir)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args)
+        },
+        "tree": {},
+        "results": {}
+    }
+    try:
+        for mode in modes:
+            # Each mode gets its own tree, indexes and recycle bin so runs don't interfere
+            workdir = os.path.join(base_dir, mode)
+            started = time.perf_counter()
+            tree = generate_tree(
+                os.path.join(workdir, "uploads"), args.depth, args.fanout, args.files_per_dir,
+                args.min_size, args.max_size, args.text_ratio, args.seed,
+            )
+            large_files = generate_large_files(
+                os.path.join(workdir, "uploads"), args.large_files, args.large_size, args.seed
+            )
+            report["tree"] = {
+                "folders": len(tree[0]),
+                "files": len(tree[1]),
+                "bytes": sum(size for _, size in tree[1]),
+                "large_files": len(large_files),
+                "generate_s": round(time.perf_counter() - started, 3)
+            }
+            rng = random.Random(args.seed)
+            recycled = recycle_targets(tree, args.recycle_items, rng)
+            scenarios = build_scenarios(tree, large_files, recycled, args, rng)
+            if args.scenarios:
+                wanted = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+                missing = set(wanted) - set(scenarios)
+                if missing:
+                    sys.exit(f"Unknown scenario(s): {', '.join(sorted(missing))}")
+                scenarios = {name: scenarios[name] for name in wanted}
+
+            print(f"{mode}: {report['tree']['files']} files in {report['tree']['folders']} folders "
+                  f"({report['tree']['bytes'] / 1e6:.1f} MB)", flush=True)
+            runner = run_asgi if mode == "asgi" else run_http
+            results = report["results"][mode] = runner(workdir, recycled, scenarios, args)
+            if args.offload and "download_large" in results:
+                # Offloaded responses have empty bodies; count the bytes the proxy sends for them
+                result = results["download_large"]
+                result["offloaded_mb_s"] = round(result["throughput_rps"] * args.large_size / 1e6, 2)
+                print(f"  download_large authorized {result['offloaded_mb_s']:.1f} MB/s for the proxy to send")
+    finally:
+        if args.keep:
+            print(f"Trees kept in {base_dir}")
+        else:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
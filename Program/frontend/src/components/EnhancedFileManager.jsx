@@ -72,6 +72,18 @@ import { useClipboard } from '../contexts/ClipboardContext'
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
 
+// Same order as the /files endpoint: folders first, then the sort key, then the name
+const compareEntries = (sortBy, sortOrder) => (a, b) => {
+  const typeOrder = (a.type === 'directory' ? 0 : 1) - (b.type === 'directory' ? 0 : 1)
+  if (typeOrder) return typeOrder
+  const byName = (x, y) => (x < y ? -1 : x > y ? 1 : 0)
+  let result = sortBy === 'size' ? a.size - b.size
+    : sortBy === 'modified' ? a.modified - b.modified
+    : byName(a.name.toLowerCase(), b.name.toLowerCase())
+  result = result || byName(a.name, b.name)
+  return sortOrder === 'desc' ? -result : result
+}
+
 export default function EnhancedFileManager() {
   const [files, setFiles] = useState([])
   const [currentPath, setCurrentPath] = useState('')
@@ -107,7 +119,11 @@ export default function EnhancedFileManager() {
   const hoverBg = useColorModeValue('gray.50', 'gray.700')
   const selectedBg = useColorModeValue('blue.100', 'blue.800')
 
+  // Bumped by every fetch, so a listing still streaming for a folder we left stops updating the view
+  const fetchIdRef = useRef(0)
+
   const fetchFiles = useCallback(async () => {
+    const fetchId = ++fetchIdRef.current
     setLoading(true)
     try {
       if (isSearchMode && activeFilters) {
@@ -118,17 +134,49 @@ export default function EnhancedFileManager() {
         setSearchResults(response.data.files)
         setFiles(response.data.files)
       } else {
-        // Use regular file listing
-        const response = await axios.get(`${API_URL}/files`, {
-          params: {
-            path: currentPath,
-            search: searchQuery,
-            sort_by: sortBy,
-            sort_order: sortOrder
-          }
+        // Read the NDJSON listing stream so the first rows render before the folder is fully listed
+        const params = new URLSearchParams({
+          path: currentPath,
+          search: searchQuery,
+          sort_by: sortBy,
+          sort_order: sortOrder
         })
-        setFiles(response.data.files)
-        setBreadcrumbs(response.data.breadcrumbs)
+        const response = await fetch(`${API_URL}/files/stream?${params}`)
+        if (!response.ok) throw new Error(response.statusText)
+
+        const reader = response.body.getReader()
+        const decoder = new TextDecoder()
+        let buffer = ''
+        let received = []
+
+        while (true) {
+          const { done, value } = await reader.read()
+          if (fetchId !== fetchIdRef.current) {
+            reader.cancel()
+            return
+          }
+          if (done) break
+          buffer += decoder.decode(value, { stream: true })
+          const lines = buffer.split('\n')
+          buffer = lines.pop()
+          const batch = []
+          for (const line of lines) {
+            if (!line.trim()) continue
+            const item = JSON.parse(line)
+            if (item.file) {
+              batch.push(item.file)
+            } else if (item.breadcrumbs) {
+              // Header line: show the (still empty) folder right away
+              setBreadcrumbs(item.breadcrumbs)
+              setFiles([])
+              setLoading(false)
+            }
+          }
+          if (batch.length > 0) {
+            received = received.concat(batch)
+            setFiles(received)
+          }
+        }
       }
     } catch (error) {
       toast({
@@ -138,7 +186,7 @@ export default function EnhancedFileManager() {
         duration: 3000,
       })
     } finally {
-      setLoading(false)
+      if (fetchId === fetchIdRef.current) setLoading(false)
     }
   }, [currentPath, searchQuery, sortBy, sortOrder, isSearchMode, activeFilters, toast])
 
@@ -146,6 +194,48 @@ export default function EnhancedFileManager() {
     fetchFiles()
   }, [fetchFiles])
 
+  // Live updates for the open folder: apply server-sent deltas instead of reloading the listing
+  const feedLiveRef = useRef(false)
+  const fetchFilesRef = useRef(fetchFiles)
+  const listingOptionsRef = useRef({ searchQuery, sortBy, sortOrder })
+  fetchFilesRef.current = fetchFiles
+  listingOptionsRef.current = { searchQuery, sortBy, sortOrder }
+
+  useEffect(() => {
+    if (isSearchMode) return
+    const source = new EventSource(`${API_URL}/events?path=${encodeURIComponent(currentPath)}`)
+    source.addEventListener('ready', () => {
+      feedLiveRef.current = true
+      // Deltas only apply to a listing loaded after this point: changes made before the
+      // subscription (or while we were disconnected) were never sent
+      fetchFilesRef.current()
+    })
+    source.addEventListener('change', (event) => {
+      const { added, removed, modified } = JSON.parse(event.data)
+      const { searchQuery, sortBy, sortOrder } = listingOptionsRef.current
+      const query = searchQuery.toLowerCase()
+      const incoming = [...added, ...modified].filter(f => !query || f.name.toLowerCase().includes(query))
+      const replaced = new Set([...removed, ...incoming.map(f => f.name), ...modified.map(f => f.name)])
+      setFiles(prev => prev
+        .filter(f => !replaced.has(f.name))
+        .concat(incoming)
+        .sort(compareEntries(sortBy, sortOrder)))
+    })
+    source.addEventListener('resync', () => fetchFilesRef.current())
+    source.onerror = () => {
+      feedLiveRef.current = false
+    }
+    return () => {
+      feedLiveRef.current = false
+      source.close()
+    }
+  }, [currentPath, isSearchMode])
+
+  // After an operation: the live feed brings the changes, so only reload without it
+  const refreshFiles = useCallback(() => {
+    if (!feedLiveRef.current) fetchFiles()
+  }, [fetchFiles])
+
   // Keyboard shortcuts
   useEffect(() => {
     const handleKeyPress = (e) => {
@@ -209,7 +299,7 @@ export default function EnhancedFileManager() {
         })
       }
     }
-    fetchFiles()
+    refreshFiles()
   }
 
   const handleFolderUpload = async (files) => {
@@ -229,7 +319,7 @@ export default function EnhancedFileManager() {
         status: 'success',
         duration: 3000,
       })
-      fetchFiles()
+      refreshFiles()
     } catch (error) {
       toast({
         title: 'Folder upload failed',
@@ -257,7 +347,7 @@ export default function EnhancedFileManager() {
         status: 'success',
         duration: 2000,
       })
-      fetchFiles()
+      refreshFiles()
     } catch (error) {
       toast({
         title: 'Delete failed',
@@ -284,7 +374,7 @@ export default function EnhancedFileManager() {
       })
       
       setSelectedFiles(new Set())
-      fetchFiles()
+      refreshFiles()
     } catch (error) {
       toast({
         title: 'Bulk delete failed',
@@ -384,7 +474,7 @@ export default function EnhancedFileManager() {
       
       setNewFolderName('')
       onFolderClose()
-      fetchFiles()
+      refreshFiles()
     } catch (error) {
       toast({
         title: 'Failed to create folder',
@@ -412,7 +502,7 @@ export default function EnhancedFileManager() {
         duration: 2000,
       })
       
-      fetchFiles()
+      refreshFiles()
       setSelectedFiles(new Set())
     } catch (error) {
       toast({
@@ -447,7 +537,7 @@ export default function EnhancedFileManager() {
       
       setSelectedFiles(new Set())
       onOperationClose()
-      fetchFiles()
+      refreshFiles()
     } catch (error) {
       toast({
         title: 'Operation failed',
@@ -489,7 +579,7 @@ export default function EnhancedFileManager() {
             onFileSelect={handleFileSelect}
             onFolderNavigate={handleFolderNavigate}
           />
-          <RecycleBin onRefresh={fetchFiles} />
+          <RecycleBin onRefresh={refreshFiles} />
         </VStack>
       )}
       
@@ -861,7 +951,7 @@ export default function EnhancedFileManager() {
           isOpen={isViewerOpen}
           onClose={onViewerClose}
           file={viewerFile}
-          onSave={fetchFiles}
+          onSave={refreshFiles}
         />
       )}
 
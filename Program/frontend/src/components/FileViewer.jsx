@@ -32,6 +32,39 @@ import axios from 'axios'
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
 
+const PATCH_CONTEXT_LINES = 3
+
+const splitLines = (text) => text.match(/[^\n]*\n|[^\n]+$/g) || []
+
+// Single-hunk unified diff covering everything between the unchanged head and tail,
+// so a one-line edit to a large file sends a few lines instead of the whole document
+const buildPatch = (before, after) => {
+  const oldLines = splitLines(before)
+  const newLines = splitLines(after)
+  let head = 0
+  while (head < oldLines.length && head < newLines.length && oldLines[head] === newLines[head]) head++
+  let tail = 0
+  while (
+    tail < oldLines.length - head && tail < newLines.length - head &&
+    oldLines[oldLines.length - 1 - tail] === newLines[newLines.length - 1 - tail]
+  ) tail++
+
+  const start = Math.max(head - PATCH_CONTEXT_LINES, 0)
+  const oldEnd = Math.min(oldLines.length - tail + PATCH_CONTEXT_LINES, oldLines.length)
+  const newEnd = Math.min(newLines.length - tail + PATCH_CONTEXT_LINES, newLines.length)
+  const formatLine = (prefix, line) =>
+    prefix + line + (line.endsWith('\n') ? '' : '\n\\ No newline at end of file\n')
+
+  const oldCount = oldEnd - start
+  const newCount = newEnd - start
+  let patch = `@@ -${oldCount ? start + 1 : start},${oldCount} +${newCount ? start + 1 : start},${newCount} @@\n`
+  for (let i = start; i < head; i++) patch += formatLine(' ', oldLines[i])
+  for (let i = head; i < oldLines.length - tail; i++) patch += formatLine('-', oldLines[i])
+  for (let i = head; i < newLines.length - tail; i++) patch += formatLine('+', newLines[i])
+  for (let i = oldLines.length - tail; i < oldEnd; i++) patch += formatLine(' ', oldLines[i])
+  return patch
+}
+
 export default function FileViewer({ isOpen, onClose, file, onSave }) {
   const [content, setContent] = useState('')
   const [originalContent, setOriginalContent] = useState('')
@@ -73,9 +106,16 @@ export default function FileViewer({ isOpen, onClose, file, onSave }) {
 
   const handleSave = async () => {
     try {
-      await axios.put(`${API_URL}/files/${file.path}/content`, {
-        content: content
-      })
+      // Send only the changed lines when we know which version they apply to
+      const response = fileData?.version
+        ? await axios.patch(`${API_URL}/files/${file.path}/content`, {
+            patch: buildPatch(originalContent, content),
+            base_version: fileData.version
+          })
+        : await axios.put(`${API_URL}/files/${file.path}/content`, {
+            content: content
+          })
+      setFileData({ ...fileData, version: response.data.version })
       setOriginalContent(content)
       setIsEditing(false)
       toast({
@@ -85,9 +125,10 @@ export default function FileViewer({ isOpen, onClose, file, onSave }) {
       })
       if (onSave) onSave()
     } catch (error) {
+      const conflict = error.response?.status === 409
       toast({
-        title: 'Error saving file',
-        description: error.message,
+        title: conflict ? 'File changed on the server' : 'Error saving file',
+        description: conflict ? 'Reload the file before saving your changes' : error.message,
         status: 'error',
         duration: 3000,
       })
@@ -147,6 +188,12 @@ export default function FileViewer({ isOpen, onClose, file, onSave }) {
       case 'text':
         return (
           <Box>
+            {fileData?.truncated && (
+              <Alert status="info" mb={2}>
+                <AlertIcon />
+                Large file: showing bytes {fileData.offset}–{fileData.nextOffset} of {fileData.size}. Download it to see or edit the whole file.
+              </Alert>
+            )}
             {isEditing ? (
               <Textarea
                 value={content}